@@ -1,52 +1,119 @@
 // Receiver of Serial Messages from Raspberry Pi
-  // always checking for new values on the serial port 
-  // update the PWM output if so
+  // always checking for new values on the serial port
+  // update the PWM output as soon as a value arrives
 
 // inputs over serial are 0 to 100
 // convert to between 0 and 255 (PWM limits)
 
-// note on what needs to be sent over serial to the Arduino
-  // from python: arduino.write(bytes(f"{val}\n",'utf-8'))
+// note on what needs to be sent over serial to the Arduino (see rpi/light_utilities.py)
+  // this sketch reads both, the Pi picks one with the ARDUINO_PROTOCOL environment variable
+  // ASCII (the Pi's default, ARDUINO_PROTOCOL=ascii): arduino.write(bytes(f"{val}\n",'utf-8'))
     // tested sending val = "27" and val = 81.9 from python, and it worked
+    // ASCII lines set channel 0 and are not acknowledged
+  // framed (ARDUINO_PROTOCOL=framed, once the Arduino is reflashed with this sketch):
+    // 5 bytes [0xAA, sequence, channel, value, checksum]
+    // checksum is the sum of the first 4 bytes, modulo 256
+    // every frame is answered with 4 bytes [0x55, sequence, status, checksum]
+    // status 0 = applied, 1 = bad checksum, 2 = unknown channel
 
-const int outputPin = 6; // Define the PWM output pin
-int pwmVal = 0;
-int intensity = 0;
-String serial_data;
+// At 9600 baud a frame and its ack take ~10 ms on the wire, so the loop must never block:
+// no delay() and no readStringUntil() (it waits up to 1 second for the '\n').
+
+const byte FRAME_START = 0xAA;
+const byte ACK_START = 0x55;
+const byte FRAME_SIZE = 5;
+const byte ACK_APPLIED = 0;
+const byte ACK_BAD_CHECKSUM = 1;
+const byte ACK_BAD_CHANNEL = 2;
+// Drop a partial frame if the rest of it doesn't arrive in time (milliseconds)
+const unsigned long FRAME_TIMEOUT = 50;
+
+const int outputPins[] = {6}; // PWM output pin of each channel
+const byte NUM_CHANNELS = sizeof(outputPins) / sizeof(outputPins[0]);
+
+byte frame[FRAME_SIZE];
+byte frameLength = 0;
+unsigned long frameStarted = 0;
+char line[8]; // legacy ASCII value, e.g. "81.9"
+byte lineLength = 0;
 
 void setup() {
 
-  pinMode(outputPin, OUTPUT); // Set the output pin as OUTPUT
+  for (byte channel = 0; channel < NUM_CHANNELS; channel++) {
+    pinMode(outputPins[channel], OUTPUT); // Set the output pins as OUTPUT
+  }
 
   Serial.begin(9600); // Start serial communication
 
 }
 
-void loop() {
-  
-  // check for new intensity value of serial port (it comes as a string)
-  if (Serial.available() > 0) {
-    
-    // read the incoming data
-    serial_data = Serial.readStringUntil('\n');
-    intensity = serial_data.toInt();
-
-    // fix value within bounds if necessary
-    if (intensity > 100) {
-      intensity = 100;
-    } else if (intensity < 0) {
-      intensity = 0;
-    }
+void setIntensity(byte channel, int intensity) {
 
-    // convert intensity to PWM value
-    pwmVal = map(intensity, 0, 100, 0, 255); // integer math only
+  // fix value within bounds if necessary
+  if (intensity > 100) {
+    intensity = 100;
+  } else if (intensity < 0) {
+    intensity = 0;
+  }
 
+  // convert intensity to PWM value and send PWM to pin
+  analogWrite(outputPins[channel], map(intensity, 0, 100, 0, 255)); // integer math only
+
+}
+
+void sendAck(byte sequence, byte status) {
+
+  byte ack[4] = {ACK_START, sequence, status, 0};
+  ack[3] = (byte)(ack[0] + ack[1] + ack[2]);
+  Serial.write(ack, 4);
+
+}
+
+void handleFrame() {
+
+  byte checksum = frame[0] + frame[1] + frame[2] + frame[3];
+  if (checksum != frame[4]) {
+    sendAck(frame[1], ACK_BAD_CHECKSUM);
+  } else if (frame[2] >= NUM_CHANNELS) {
+    sendAck(frame[1], ACK_BAD_CHANNEL);
+  } else {
+    // Set the lights first, the ack confirms the new PWM is already out
+    setIntensity(frame[2], frame[3]);
+    sendAck(frame[1], ACK_APPLIED);
+  }
+
+}
+
+void loop() {
+
+  // a partial frame that stalled is dropped, the Raspberry Pi resends it
+  if (frameLength > 0 && millis() - frameStarted > FRAME_TIMEOUT) {
+    frameLength = 0;
   }
 
-  // send PWM to pin
-  analogWrite(outputPin, pwmVal);
+  // handle every byte that has arrived, without waiting for more
+  while (Serial.available() > 0) {
+    byte data = Serial.read();
+
+    if (frameLength > 0) {
+      frame[frameLength++] = data;
+      if (frameLength == FRAME_SIZE) {
+        handleFrame();
+        frameLength = 0;
+      }
+    } else if (data == FRAME_START && lineLength == 0) {
+      frame[frameLength++] = data;
+      frameStarted = millis();
+    } else if (data == '\n') {
+      // legacy ASCII value, channel 0
+      line[lineLength] = '\0';
+      if (lineLength > 0) {
+        setIntensity(0, atoi(line));
+      }
+      lineLength = 0;
+    } else if (lineLength < sizeof(line) - 1) {
+      line[lineLength++] = data;
+    }
+  }
 
-  // delay in milliseconds (every 1 second run the loop)
-  delay(1000);
-  
-}
\ No newline at end of file
+}
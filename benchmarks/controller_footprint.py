@@ -0,0 +1,99 @@
+"""Measures the Light Controller's startup time and memory (RSS).
+
+Each case starts a fresh interpreter that imports the controller and loads a compiled profile,
+then reports its CPU time and peak resident memory. The cases compare the stdlib only controller
+(control_lights.py reading profile_format.py arrays) with the same process carrying the web app's
+imports, as it did when it was forked from the web app:
+
+    python3 benchmarks/controller_footprint.py [--sizes 1000 1000000] [--repeats 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+RPI_FOLDER = os.path.join(BENCHMARKS_FOLDER, "../rpi")
+sys.path.insert(0, BENCHMARKS_FOLDER)
+sys.path.insert(0, RPI_FOLDER)
+
+SIZES = [1000, 1000000]
+REPEATS = 5
+
+# Run in the child with {folder} and {path} formatted in, prints its footprint as json.
+CASES: Dict[str, str] = {
+    "controller (stdlib)": """
+import control_lights, profile_format
+profile_format.COMPILED_FOLDER_PATH = {folder!r}
+profile = profile_format.load_arrays({path!r})
+profile.wake_rows()
+""",
+    "controller with web app imports": """
+import climate_web_utilities, control_lights, profile_format
+from profile_cache import load_profile
+profile_format.COMPILED_FOLDER_PATH = {folder!r}
+profile = load_profile({path!r})
+profile.wake_rows()
+""",
+}
+REPORT = """
+import json, sys, time
+print(json.dumps({"cpu": time.process_time(), "rss_mb": control_lights.peak_rss_mb(),
+                  "modules": len(sys.modules)}))
+"""
+
+
+def run_case(code: str, repeats: int) -> dict:
+    """Runs code in repeats fresh interpreters, returning the median footprint."""
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    runs: List[dict] = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", code + REPORT],
+            cwd=RPI_FOLDER,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["wall"] = time.perf_counter() - started
+        runs.append(result)
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="profile rows")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="interpreters per case")
+    args = parser.parse_args(argv)
+
+    import profile_format
+    from profile_cache import load_profile
+    from run_benchmarks import profile_file
+
+    with tempfile.TemporaryDirectory() as folder:
+        profile_format.COMPILED_FOLDER_PATH = folder
+        for rows in args.sizes:
+            path = profile_file(rows)
+            # Compiled up front, as the web app does when a profile is uploaded.
+            load_profile(path)
+            for name, code in CASES.items():
+                result = run_case(code.format(folder=folder, path=path), args.repeats)
+                print(
+                    f"{name:32} {rows:>9,} rows  startup {result['wall'] * 1000:8.0f} ms  "
+                    f"cpu {result['cpu'] * 1000:8.0f} ms  rss {result['rss_mb']:7.1f} MB  "
+                    f"modules {result['modules']:5.0f}",
+                    flush=True,
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
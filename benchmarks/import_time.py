@@ -0,0 +1,93 @@
+"""Reports the cold start of the web app and Light Controller, like python -X importtime.
+
+Each entry point is imported by a fresh interpreter with -X importtime, and its import time is
+reported with the packages that took longest. The web app's time to its first served page (the
+import plus a request of "/" with Flask's test client) is also reported:
+
+    python3 benchmarks/import_time.py [--top 8] [--repeats 3]
+
+Importing the web app resumes a live profile's Light Controller, as it does after a power
+outage, so run this where no profile is live.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+RPI_FOLDER = os.path.join(BENCHMARKS_FOLDER, "../rpi")
+
+ENTRY_POINTS = ["climate_web_interface", "control_lights", "multi_controller"]
+TOP = 8
+REPEATS = 3
+FIRST_PAGE = """
+import climate_web_interface
+response = climate_web_interface.app.test_client().get("/")
+assert response.status_code == 200, response.status_code
+"""
+
+
+def import_times(module: str) -> Tuple[float, Dict[str, float]]:
+    """Imports module in a fresh interpreter.
+
+    Returns (tuple):
+        The seconds the import took and the seconds each top level package took itself.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=RPI_FOLDER,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    total = 0.0
+    packages: Dict[str, float] = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(own) / 1e6
+        if name.strip() == module:
+            total = int(cumulative) / 1e6
+    return total, packages
+
+
+def first_page_seconds() -> float:
+    """Returns the seconds from starting the web app's interpreter to serving its main page."""
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", FIRST_PAGE],
+        cwd=RPI_FOLDER,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--top", type=int, default=TOP, help="packages listed per entry point")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="interpreters per entry point")
+    args = parser.parse_args(argv)
+
+    for module in ENTRY_POINTS:
+        runs = [import_times(module) for _ in range(args.repeats)]
+        total = statistics.median(run[0] for run in runs)
+        packages = {
+            name: statistics.median(run[1].get(name, 0.0) for run in runs)
+            for name in runs[0][1]
+        }
+        print(f"{module:24} import {total * 1000:8.0f} ms")
+        for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[: args.top]:
+            print(f"    {name:20} {seconds * 1000:8.1f} ms")
+    first_page = statistics.median(first_page_seconds() for _ in range(args.repeats))
+    print(f"{'web app first page':24} served {first_page * 1000:8.0f} ms after starting")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""Benchmarks the profile, plotting and Light Controller hot paths.
+
+Every benchmark runs against synthetic profiles of each size (rows), reporting the best and median
+time of repeated calls and the peak memory (tracemalloc) of one call. Results can be saved as a
+baseline and later runs compared against it, flagging anything slower by more than --threshold:
+
+    python3 benchmarks/run_benchmarks.py --save benchmarks/baseline.json
+    python3 benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Profiles are .xlsx files of dates and times (like Excel's) so any number of rows is valid. They are
+generated once into benchmarks/data/ and reused. The web app's live folder and compiled profile
+cache are redirected to a temporary folder so a benchmark never touches a running profile, and
+the plots are drawn there too.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_FOLDER, "../rpi"))
+
+import climate_web_utilities  # noqa: E402
+import config_store  # noqa: E402
+import control_lights  # noqa: E402
+import profile_format  # noqa: E402
+from climate_web_utilities import (  # noqa: E402
+    RETRIEVE_CONFIG,
+    check_profile_validity,
+    expand_profile_points,
+    plot_excel,
+    times_to_timedeltas,
+)
+from control_lights import save_config  # noqa: E402
+from controller_status import StatusReader  # noqa: E402
+from profile_cache import load_profile  # noqa: E402
+from profile_format import ProfileSchedule, find_next_row  # noqa: E402
+
+DATA_FOLDER = os.path.join(BENCHMARKS_FOLDER, "data")
+SIZES = [10, 1000, 100000, 1000000]
+# Seconds each benchmark is repeated for (at least once), and the most repeats.
+MIN_SECONDS = 1.0
+MAX_REPEATS = 50
+# find_next_row and schedule lookups per timed call.
+LOOKUPS = 10000
+# Slower than the baseline by this ratio (and by more than NOISE_SECONDS) is a regression.
+THRESHOLD = 1.3
+NOISE_SECONDS = 0.001
+START = datetime(2025, 1, 1)
+
+
+def synthetic_profile(rows: int, seed: int = 0) -> "pd.DataFrame":
+    """Returns a profile of rows one second apart whose intensity changes about every 5 rows."""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    changes = rng.random(rows) < 0.2
+    intensities = np.where(changes, rng.integers(0, 101, rows), 0)
+    # Carry the last change forward, so most rows repeat the previous intensity.
+    intensities = intensities[np.maximum.accumulate(np.where(changes, np.arange(rows), 0))]
+    return pd.DataFrame(
+        {
+            "time": pd.Timestamp(START) + pd.to_timedelta(np.arange(rows), unit="s"),
+            "intensity": intensities,
+        }
+    )
+
+
+def profile_file(rows: int) -> str:
+    """Returns the path of an .xlsx synthetic profile, generating it the first time."""
+    import openpyxl
+
+    path = os.path.join(DATA_FOLDER, f"profile_{rows}.xlsx")
+    if not os.path.exists(path):
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+        print(f"Generating {path}...", flush=True)
+        df = synthetic_profile(rows)
+        # Excel's own writer is far faster than DataFrame.to_excel for large profiles.
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(list(df.columns))
+        for i, intensity in enumerate(df["intensity"].tolist()):
+            sheet.append((START + timedelta(seconds=i), intensity))
+        workbook.save(path + ".tmp")
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def live_config(path: str) -> SimpleNamespace:
+    """Returns the state plot_excel reads from a ClimateConfig, for a profile started a day ago.
+
+    A real ClimateConfig deletes the live profile when it is garbage collected.
+    """
+    now = datetime.now().replace(microsecond=0)
+    return SimpleNamespace(
+        started=now - timedelta(days=1),
+        _started=now - timedelta(days=1),
+        last_updated=now - timedelta(seconds=30),
+        last_intensity=50,
+        run_continuously=True,
+        profile_filename=os.path.basename(path),
+        _profile_filepath=path,
+    )
+
+
+def clear_compiled() -> None:
+    """Deletes every compiled profile, so the next check_profile_validity parses the file."""
+    for path in os.listdir(profile_format.COMPILED_FOLDER_PATH):
+        if path.startswith("profile_") and path.endswith(".npy"):
+            os.remove(os.path.join(profile_format.COMPILED_FOLDER_PATH, path))
+    profile_format._DIGESTS.clear()
+
+
+def measure(
+    func: Callable[[], object],
+    setup: Optional[Callable[[], None]] = None,
+    min_seconds: float = MIN_SECONDS,
+) -> dict:
+    """Times repeated calls of func (after an untimed setup each), then its peak memory."""
+    times: List[float] = []
+    while len(times) < MAX_REPEATS and (not times or sum(times) < min_seconds):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "best": min(times),
+        "median": statistics.median(times),
+        "repeats": len(times),
+        "peak_mb": peak / 2**20,
+    }
+
+
+def benchmarks(rows: int) -> Dict[str, tuple]:
+    """Returns (func, setup) of every benchmark of a profile of rows."""
+    path = profile_file(rows)
+    df = synthetic_profile(rows)
+    expanded_input = times_to_timedeltas(df.copy())
+    # Compiled once so the plots don't measure parsing the file.
+    profile = load_profile(path)
+    seconds = np.asarray(profile.seconds)
+    lookups = [
+        timedelta(seconds=float(s))
+        for s in np.random.default_rng(1).uniform(0, seconds[-1], LOOKUPS)
+    ]
+    # Times across three cycles of a looping run.
+    schedule = ProfileSchedule(profile, START)
+    whens = [START + 3 * elapsed for elapsed in lookups]
+    timestamps = np.array([when.timestamp() for when in whens])
+    config = live_config(path)
+    # The viewer's plot is saved next to its profile, so it's drawn from a copy in the live folder.
+    viewer_path = shutil.copy(path, config_store.LIVE_FOLDER_PATH)
+    return {
+        "times_to_timedeltas": (lambda: times_to_timedeltas(df.copy()), None),
+        "expand_profile_points": (lambda: expand_profile_points(expanded_input), None),
+        "plot_excel (viewer)": (lambda: plot_excel(viewer_path), None),
+        "plot_excel (live)": (lambda: plot_excel(path, config), None),
+        "check_profile_validity (cold)": (lambda: check_profile_validity(path), clear_compiled),
+        "check_profile_validity (compiled)": (lambda: check_profile_validity(path), None),
+        f"find_next_row x{LOOKUPS}": (
+            lambda: [find_next_row(seconds, elapsed) for elapsed in lookups],
+            None,
+        ),
+        f"ProfileSchedule.intensity_at x{LOOKUPS}": (
+            lambda: [schedule.intensity_at(when) for when in whens],
+            None,
+        ),
+        f"ProfileSchedule.intensities_at x{LOOKUPS}": (
+            lambda: schedule.intensities_at(timestamps),
+            None,
+        ),
+    }
+
+
+def config_benchmarks() -> Dict[str, tuple]:
+    """Returns (func, setup) of the config checkpoint benchmarks, which don't depend on rows."""
+    config = {
+        "_started": START,
+        "_profile_filepath": profile_file(SIZES[0]),
+        "last_updated": START + timedelta(hours=1),
+        "last_intensity": 50,
+        "run_continuously": True,
+        "rpi_time_script_finished": None,
+        "pid": os.getpid(),
+    }
+    save_config(config)
+    return {
+        "RETRIEVE_CONFIG": (RETRIEVE_CONFIG, None),
+        "save_config": (lambda: save_config(config), None),
+    }
+
+
+def run(sizes: List[int], only: Optional[str] = None) -> Dict[str, dict]:
+    """Runs the benchmarks, returning the results by 'name@rows'."""
+    results = {}
+
+    def record(name: str, rows: int, func, setup) -> None:
+        if only and only not in name:
+            return
+        result = measure(func, setup)
+        results[f"{name}@{rows}"] = result
+        print(
+            f"{name:36} {rows:>9,} rows  best {result['best'] * 1000:10.2f} ms  "
+            f"median {result['median'] * 1000:10.2f} ms  peak {result['peak_mb']:8.2f} MB",
+            flush=True,
+        )
+
+    for name, (func, setup) in config_benchmarks().items():
+        record(name, 0, func, setup)
+    for rows in sizes:
+        for name, (func, setup) in benchmarks(rows).items():
+            record(name, rows, func, setup)
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Prints the results against the baseline, returning the regressions."""
+    regressions = []
+    print(f"\n{'benchmark':48} {'baseline':>12} {'now':>12} {'ratio':>7}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before, now = baseline[key]["best"], result["best"]
+        ratio = now / before if before else float("inf")
+        regressed = ratio > threshold and now - before > NOISE_SECONDS
+        if regressed:
+            regressions.append(key)
+        print(
+            f"{key:48} {before * 1000:10.2f}ms {now * 1000:10.2f}ms {ratio:6.2f}x"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="profile rows")
+    parser.add_argument("--only", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", help="save the results as a baseline json")
+    parser.add_argument("--compare", help="compare the results to a baseline json")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as live_folder:
+        climate_web_utilities.LIVE_FOLDER_PATH = live_folder
+        config_store.LIVE_FOLDER_PATH = live_folder
+        profile_format.COMPILED_FOLDER_PATH = live_folder
+        control_lights.CONFIG_PATH = os.path.join(live_folder, config_store.CONFIG_NAME)
+        # RETRIEVE_CONFIG reads the Light Controller's status record too, never the live one.
+        config_store.STATUS_READER = StatusReader(
+            os.path.join(live_folder, "controller_status.bin")
+        )
+        climate_web_utilities.STATUS_READER = config_store.STATUS_READER
+        results = run(args.sizes, args.only)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as outfile:
+            json.dump(
+                {
+                    "created": datetime.now().isoformat(timespec="seconds"),
+                    "machine": platform.node(),
+                    "python": platform.python_version(),
+                    "results": results,
+                },
+                outfile,
+                indent=4,
+            )
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as infile:
+            baseline = json.load(infile)
+        print(f"Baseline from {baseline['machine']} at {baseline['created']}")
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,55 @@
 import json
 import logging
+import numpy as np
 import os
-import psutil
 import shutil
+import subprocess
+import sys
+import threading
 import time
-from flask import Flask, request, render_template, url_for, redirect, send_file, g
+from datetime import datetime, timedelta
+from flask import (
+    Flask,
+    Response,
+    g,
+    request,
+    render_template,
+    url_for,
+    redirect,
+    send_file,
+    make_response,
+    stream_with_context,
+)
 from glob import glob
-from multiprocessing import Process
-from typing import Optional
+from typing import Optional, Tuple
 from werkzeug.utils import secure_filename
 from climate_web_utilities import (
-    plot_excel,
-    check_profile_validity,
+    STATUS_READER,
+    profile_data,
+    profile_error,
+    profile_preview_png,
+    live_schedule,
     ClimateConfig,
 )
-from control_lights import control_lights
+from controller_status import SEND_BUCKETS
+from fleet import FleetMonitor
+from jobs import Job, JobError, JobQueue
+from live_events import LiveEventBroadcaster
+from live_plot import LivePlotRenderer
+from metrics import (
+    CONTENT_TYPE,
+    METRICS_ENABLED,
+    ExternalHistogram,
+    Gauge,
+    Histogram,
+    exposition,
+)
+from profile_cache import MAX_PROFILE_BYTES, load_compiled, load_profile
+from profile_library import ProfileLibrary
+from preview_cache import PreviewCache
+from run_history import query_history
+from supervisor import ControllerSupervisor
+from transition_timing import timing_summary
 
 app = Flask(__name__)
 UPLOAD_FOLDER: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
@@ -24,76 +59,178 @@ LIVE_FOLDER: str = os.path.join(
 DATA_FOLDER: str = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "data"
 )
+# Uploads being validated, by the viewer or by their job (see send_light_profile).
+PENDING_FOLDER: str = os.path.join(UPLOAD_FOLDER, "pending")
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["LIVE_FOLDER"] = LIVE_FOLDER
+# Larger uploads are refused (413) before they're saved.
+app.config["MAX_CONTENT_LENGTH"] = MAX_PROFILE_BYTES + 2**16
+# Largest plot width (in pixels) that profile series are downsampled for.
+MAX_PLOT_WIDTH: int = 4000
+# Most run history records returned by one request.
+MAX_HISTORY_RECORDS: int = 100000
+# Most scheduled intensities returned by one request.
+MAX_SCHEDULE_POINTS: int = 100000
 ACTIVE_CONFIG: Optional[ClimateConfig] = None
-LIGHT_CONTROLLER: Optional[Process] = None
+# Held while ACTIVE_CONFIG is replaced (e.g. by an upload job), request handlers read it once.
+ACTIVE_CONFIG_LOCK = threading.Lock()
+# The Light Controller runs in a fresh interpreter rather than a fork of the web app, so it
+# doesn't carry the web app's pandas and matplotlib (see control_lights.py).
+CONTROLLER_SCRIPT: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "control_lights.py"
+)
+LIVE_PLOT = LivePlotRenderer()
+LIVE_EVENTS = LiveEventBroadcaster()
+# Uploads are validated and handed to the Light Controller here, off the request thread.
+JOBS = JobQueue()
+# Held while one profile replaces another, by upload jobs and library runs.
+HANDOFF_LOCK = threading.Lock()
+# The stored profiles (default_profiles/), compiled in the background from startup.
+LIBRARY = ProfileLibrary()
+LIBRARY.start()
+# Preview images of the viewer's and library's profiles, by content digest.
+PREVIEWS = PreviewCache()
+# Seconds browsers may reuse a preview, which never changes as it's named by its profile's digest.
+PREVIEW_MAX_AGE: int = 365 * 24 * 60 * 60
 
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+
+def start_light_controller(resume: bool = False) -> subprocess.Popen:
+    """Starts the Light Controller on the live config in a process of its own.
+
+    Arguments:
+        resume (bool): Whether the run was already started, the lights aren't flashed.
+    """
+    return subprocess.Popen(
+        [sys.executable, CONTROLLER_SCRIPT] + (["--resume"] if resume else []),
+        cwd=os.path.dirname(CONTROLLER_SCRIPT),
+    )
+
+
+# Starts every Light Controller and restarts one that dies or hangs (see supervisor.py).
+SUPERVISOR = ControllerSupervisor(start_light_controller)
+
+
+def controller_status_field(field: str):
+    """Returns a field of the Light Controller's status record, None if it isn't running."""
+    status = STATUS_READER.read()
+    return getattr(status, field) if status and status.pid else None
+
+
+def serial_write_counts() -> Optional[tuple]:
+    """Returns the Light Controller's serial write counts by bucket and their total seconds."""
+    status = STATUS_READER.read()
+    return (status.send_counts, status.send_seconds) if status else None
+
+
+def live_timing(field: str):
+    """Returns a field of the live run's timing summary (see transition_timing.py), or None."""
+    config = ACTIVE_CONFIG
+    summary = timing_summary(config.started) if config else None
+    return summary[field] if summary else None
+
+
+# The web app's hot paths are timed where they're defined (e.g. climate_web_utilities.py), the
+# Light Controller's state is read from its status record when /metrics is scraped.
+REQUEST_SECONDS = Histogram(
+    "climate_http_request_seconds",
+    "Seconds to serve a request, by route and method.",
+    label_names=("route", "method"),
+)
+Gauge(
+    "climate_controller_intensity",
+    "The last intensity the Light Controller sent to the lights.",
+    lambda: controller_status_field("last_intensity"),
+)
+Gauge(
+    "climate_controller_cycle",
+    "The profile cycle the Light Controller's run is in.",
+    lambda: controller_status_field("cycle_num"),
+)
+Gauge(
+    "climate_controller_transition_lateness_seconds",
+    "Seconds the last intensity change was sent after it was due.",
+    lambda: controller_status_field("lateness"),
+)
+Gauge(
+    "climate_controller_up",
+    "Whether the Light Controller is running and its heartbeat is recent.",
+    lambda: int(bool(controller_status_field("alive"))),
+)
+Gauge(
+    "climate_controller_restarts_total",
+    "Times the supervisor restarted the Light Controller since the web app started.",
+    lambda: SUPERVISOR.restarts,
+    counter=True,
+)
+Gauge(
+    "climate_run_lateness_p50_seconds",
+    "Median seconds the live run's transitions were sent after they were due.",
+    lambda: live_timing("p50"),
+)
+Gauge(
+    "climate_run_lateness_p99_seconds",
+    "99th percentile of the seconds the live run's transitions were sent after they were due.",
+    lambda: live_timing("p99"),
+)
+Gauge(
+    "climate_run_lateness_max_seconds",
+    "Most seconds a transition of the live run was sent after it was due.",
+    lambda: live_timing("max"),
+)
+Gauge(
+    "climate_run_wall_jumps",
+    "Jumps of the wall clock during the live run.",
+    lambda: live_timing("wall_jumps"),
+)
+ExternalHistogram(
+    "climate_serial_write_seconds",
+    "Seconds the Light Controller took to send an intensity, including the Arduino's ack.",
+    SEND_BUCKETS,
+    serial_write_counts,
+)
+
+
 with open(DATA_FOLDER + "/devices.json", 'r', encoding='utf-8') as infile:
     DEVICES = json.load(infile)
+FLEET = FleetMonitor(DEVICES)
 def device_info(ip_address: str) -> dict:
     ip_address = ip_address[:ip_address.index(":")] if ":" in ip_address else ip_address
     info = DEVICES[ip_address] if ip_address in DEVICES else {"name": "Unknown", "description": "None", "location": "unknown"}
     info['ip'] = ip_address
     return info
 
-# Check for pre-existing climate_config.json
+# Check for pre-existing climate_config.json, a run that was live when the web app stopped
+# (e.g. a power outage) is resumed by a supervised Light Controller.
 if os.path.exists(os.path.join(LIVE_FOLDER, "climate_config.json")):
     ACTIVE_CONFIG = ClimateConfig()
-    # Check if a Light Controller process is supposed to be running and is.
+    # A finished run's config has no pid.
     if ACTIVE_CONFIG.pid:
-        with app.app_context(): # Needed to access Flask's g object.
-            try:
-                pid_process = psutil.Process(ACTIVE_CONFIG.pid)
-                if pid_process.is_running:
-                    logger.info("Previously started Light Controller still running as pid: %s",
-                                ACTIVE_CONFIG.pid)
-                else:
-                    # I'm not sure this condition can exist, but I'll report it if so.
-                    logger.info("Previous Light Controller pid is no longer running, but still exists, pid: %s",
-                                ACTIVE_CONFIG.pid)
-                g.pid = ACTIVE_CONFIG.pid
-            except psutil.NoSuchProcess:
-                # The Light Controller died before completion.
-                if hasattr(g, "pid") and g.pid:
-                    # Saving pid in Flask's g object is an attempt to prevent multiple Light Controllers
-                    # from being started which happened without this code. Using python globals as I've
-                    # done has thread/process issues which I've tried to address. I've left the globals
-                    # because g's lifetime is a Flask session which could be shorter than a 
-                    # Light Controller's. There's perhaps a different more rigorous/appropriate way.
-                    try:
-                        pid_process = psutil.Process(g.pid)
-                        if pid_process.is_running:
-                            logger.info("PID found from Flask global and is running: %s", g.pid)
-                            ACTIVE_CONFIG.pid = g.pid
-                        else:
-                            logger.info("PID found from Flask global is not running, but still exists: %s",
-                                        g.pid)
-                        restart = False
-                    except psutil.NoSuchProcess:
-                        restart = True
-                        logger.info("PID found from Flask global is not running: %s. "
-                                    "Light Controller will be restarted.", g.pid)
-                        g.pid = None
-                else:
-                    restart = True
-                if restart:
-                    logger.info("Light Controller being restarted...")
-                    LIGHT_CONTROLLER = Process(target=control_lights)
-                    LIGHT_CONTROLLER.start()
-                    time.sleep(1)
-                    ACTIVE_CONFIG.retrieve_config()
-                    g.pid = ACTIVE_CONFIG.pid
+        logger.info("Resuming the live profile, its Light Controller was pid %s", ACTIVE_CONFIG.pid)
+        ACTIVE_CONFIG.pid = SUPERVISOR.resume(ACTIVE_CONFIG.pid).pid
+
+if METRICS_ENABLED:
+    # every request is timed by its route, requests for unknown urls aren't
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request_seconds(response):
+        if request.url_rule is not None and "request_started" in g:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - g.request_started, request.url_rule.rule, request.method
+            )
+        return response
+
 
 # Main Page
 @app.get("/")
 def main_page():
     device = device_info(request.headers.get('Host'))
     return render_template("main_page.html",
-                           file_uploaded=False,
                            desc=device["description"],
                            location=device["location"],
                            ip=device['ip'])
@@ -109,12 +246,12 @@ def example_page():
 @app.get("/live")
 def live_light_profile():
     global ACTIVE_CONFIG, LIVE_FOLDER
-    if ACTIVE_CONFIG:
-        ACTIVE_CONFIG.update(retreive=True)
-    else:
-        if os.path.exists(os.path.join(LIVE_FOLDER, "climate_config.json")):
+    # The plot itself is rendered when the page requests it (see display_live_plot).
+    with ACTIVE_CONFIG_LOCK:
+        if ACTIVE_CONFIG:
+            ACTIVE_CONFIG.retrieve_config()
+        elif os.path.exists(os.path.join(LIVE_FOLDER, "climate_config.json")):
             ACTIVE_CONFIG = ClimateConfig()
-            ACTIVE_CONFIG.update(retreive=True)
     device = device_info(request.headers.get('Host'))
     return render_template("live_light_profile.html",
                            location=device["location"])
@@ -129,6 +266,12 @@ def run_light_profile():
                            location=device["location"])
 
 
+# Fleet Page, the status of every Pi in devices.json
+@app.get("/fleet")
+def fleet_page():
+    return render_template("fleet.html")
+
+
 # Light Profile Viewer Page
 @app.get("/viewer")
 def view_light_profile():
@@ -146,35 +289,33 @@ def view_profile():
     if file.filename == "":
         return redirect(request.url)
 
-    # save the file in 'static/'
+    # save the file in 'static/pending', under a unique name so previews at the same time
+    # don't overwrite each other
     safe_fn = secure_filename(file.filename)
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], safe_fn)
+    os.makedirs(PENDING_FOLDER, exist_ok=True)
+    filepath = os.path.join(PENDING_FOLDER, f"{os.urandom(8).hex()}_{safe_fn}")
     logger.info("filepath: %s", filepath)
     file.save(filepath)
 
-    # check file format validity
-    if check_profile_validity(filepath) == False:
-        os.remove(filepath)  # delete the file if it's invalid
-        return "Invalid file format. Please upload .xlsx or .csv file with 2 columns: Time and Light Intensity Value."
-
-    # create a profile plot and save it
-    plot_excel(filepath)
-
-    # remove excel files to reduce clutter
-    for filename in os.listdir(app.config["UPLOAD_FOLDER"]):
-        if filename.endswith(".xlsx"):
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            os.remove(file_path)
+    try:
+        # check file format validity, which also compiles the profile
+        error = profile_error(filepath)
+        if error:
+            return f"Invalid profile: {error}", 400
+        # the page plots the profile from /api/profile/<digest>
+        digest = load_profile(filepath).digest
+    finally:
+        # only the compiled profile is needed from here on
+        os.remove(filepath)
 
     # all is well, return .html with the plot
-    return render_template("view_light_profile.html", file_uploaded=True)
+    return render_template("view_light_profile.html", file_uploaded=True,
+                           digest=digest, filename=safe_fn)
 
 
 # this is triggered when user clicks "Send to Lights" button on the 'run' page
 @app.post("/run")
 def send_light_profile():
-    global ACTIVE_CONFIG, LIGHT_CONTROLLER, logger
-
     # check if file is real from the HTML request
     if "file" not in request.files:
         return redirect(request.url)
@@ -184,58 +325,318 @@ def send_light_profile():
     run_continuous = True if loop else False
     if file.filename == "":
         return redirect(request.url)
-    # save the file in 'static/live'
+    # save the file in 'static/pending', under a unique name until its job has validated it
     safe_fn = secure_filename(file.filename)
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], safe_fn)
+    os.makedirs(PENDING_FOLDER, exist_ok=True)
+    filepath = os.path.join(PENDING_FOLDER, f"{os.urandom(8).hex()}_{safe_fn}")
     file.save(filepath)
-    # check file format validity
-    if check_profile_validity(filepath) == False:
-        os.remove(filepath)  # delete the file if it's invalid
-        return "Invalid file format. Please upload .xlsx or .csv file with 2 columns: Time and Light Intensity Value."
     livepath = os.path.join(app.config["LIVE_FOLDER"], safe_fn)
-
-    g.pid = None
-    # If there is an active LIGHT_CONTROLLER running, kill it.
-    if LIGHT_CONTROLLER and LIGHT_CONTROLLER.is_alive():
-        LIGHT_CONTROLLER.kill()
-        LIGHT_CONTROLLER = None
-    # If there is an active config eliminate it.
-    if ACTIVE_CONFIG:
-        ACTIVE_CONFIG = None
-        # Give the garbage collector a moment to do its thing.
-        time.sleep(2)
-    # delete any other plots, configs or profiles in the 'live' folder
-    for pathname in glob(os.path.join(app.config["LIVE_FOLDER"], "*.png")):
-        os.remove(pathname)
-    for pathname in glob(os.path.join(app.config["LIVE_FOLDER"], "*.json")):
-        os.remove(pathname)
-    for pathname in glob(os.path.join(app.config["LIVE_FOLDER"], "*.xlsx")):
-        os.remove(pathname)
-
-    shutil.move(filepath, livepath)
-    logger.info("New validated profile uploaded: %s", livepath)
+    # Validating, compiling and plotting the profile and restarting the Light Controller take
+    # seconds, the page polls /api/jobs/<id> until they're done.
+    job = JOBS.submit(
+        safe_fn, lambda job: run_profile_job(job, filepath, livepath, run_continuous)
+    )
+    device = device_info(request.headers.get('Host'))
+    return render_template("run_light_profile.html",
+                           desc=device["description"],
+                           location=device["location"],
+                           job_id=job.id), 202
+
+
+def run_profile_job(job: Job, filepath: str, livepath: str, run_continuous: bool) -> None:
+    """Validates an uploaded profile and hands it to a new Light Controller (a JOBS job)."""
+    try:
+        job.step = "Validating the profile"
+        # check file format validity, which also compiles the profile
+        error = profile_error(filepath)
+        if error:
+            raise JobError(f"Invalid profile: {error}")
+
+        with HANDOFF_LOCK:
+            job.step = "Stopping the running profile"
+            stop_light_controller()
+            shutil.move(filepath, livepath)
+            logger.info("New validated profile uploaded: %s", livepath)
+
+            job.step = "Starting the Light Controller"
+            start_profile(livepath, run_continuous)
+    finally:
+        # the pending upload is gone once it's live, otherwise the job failed and it's deleted
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+def stop_light_controller() -> None:
+    """Stops the running profile's Light Controller and clears the 'live' folder of it."""
+    global ACTIVE_CONFIG
+    SUPERVISOR.stop()
+    with ACTIVE_CONFIG_LOCK:
+        config, ACTIVE_CONFIG = ACTIVE_CONFIG, None
+        # Handlers still holding the config keep its last state, its files are deleted now.
+        if config:
+            config.delete_files()
+        # delete any other plots, configs or profiles in the 'live' folder
+        for pathname in glob(os.path.join(app.config["LIVE_FOLDER"], "*.png")):
+            os.remove(pathname)
+        for pathname in glob(os.path.join(app.config["LIVE_FOLDER"], "*.json")):
+            os.remove(pathname)
+        for pathname in glob(os.path.join(app.config["LIVE_FOLDER"], "*.xlsx")):
+            os.remove(pathname)
+
+
+def start_profile(livepath: str, run_continuous: bool) -> None:
+    """Starts a Light Controller on the (compiled) profile at livepath in the 'live' folder."""
+    global ACTIVE_CONFIG
     logger.info(
         "The new profile was set to run %s.",
         "continuously looping" if run_continuous else "once",
     )
-
-    ACTIVE_CONFIG = ClimateConfig(livepath, run_continuous)
-    ACTIVE_CONFIG.update()
-    LIGHT_CONTROLLER = Process(target=control_lights)
-    LIGHT_CONTROLLER.start()
+    with ACTIVE_CONFIG_LOCK:
+        config = ACTIVE_CONFIG = ClimateConfig(livepath, run_continuous)
+        config.update()
     # climate_config.json's pid key/value will be saved by control_lights.
-    g.pid = LIGHT_CONTROLLER.pid
+    config.pid = SUPERVISOR.start().pid
+
+
+# the 'run' page polls this until its upload has been handed to the Light Controller
+@app.get("/api/jobs/<job_id>")
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return {"error": "Unknown job."}, 404
+    return job.to_dict()
+
+
+# Profile Library Page, the stored profiles ready to run
+@app.get("/library")
+def library_page():
+    device = device_info(request.headers.get('Host'))
+    return render_template("profile_library.html",
+                           profiles=LIBRARY.refresh(),
+                           desc=device["description"],
+                           location=device["location"])
+
 
-    # It may take a short bit to start the run.
-    time.sleep(1)
+# the library's profiles, their digests and whether they're valid
+@app.get("/api/library")
+def library_profiles():
+    return {"profiles": [entry.to_dict() for entry in LIBRARY.refresh()]}
+
+
+# a stored profile's file, e.g. to modify it
+@app.get("/library/<name>/download")
+def library_download(name: str):
+    entry = LIBRARY.get(name)
+    if entry is None:
+        return "Unknown library profile.", 404
+    return send_file(entry.path, as_attachment=True)
+
+
+# this is triggered when user clicks "Run" on a library profile, it's already compiled
+# so the profile is started straight away rather than in a job
+@app.post("/library/<name>/run")
+def run_library_profile(name: str):
+    entry = LIBRARY.get(name)
+    if entry is None:
+        return "Unknown library profile.", 404
+    if entry.error:
+        return f"Invalid profile: {entry.error}", 400
+    run_continuous = bool(request.form.get("run_continuous"))
+    livepath = os.path.join(app.config["LIVE_FOLDER"], entry.name)
+    with HANDOFF_LOCK:
+        stop_light_controller()
+        # Marks the compiled profile as recently used, compiling it again if it was evicted.
+        load_profile(entry.path)
+        shutil.copyfile(entry.path, livepath)
+        logger.info("Library profile started: %s", livepath)
+        start_profile(livepath, run_continuous)
     return redirect(url_for("live_light_profile"))
 
 
-# this is called by HTML after user clicks 'View Profile' button
-# this grabs the plot.png that was created by upload_file() and displays it
-@app.get("/display_plot")
-def display_plot():
-    return redirect(url_for("static", filename="plot.png"))
+# the preview image of a compiled profile, drawn once per profile and cached by browsers
+@app.get("/display_plot/<digest>")
+def display_plot(digest: str):
+    try:
+        path = PREVIEWS.get_or_render(digest, lambda: profile_preview_png(load_compiled(digest)))
+    except FileNotFoundError:
+        return "Unknown profile, please upload it again.", 404
+    response = send_file(path, mimetype="image/png", max_age=PREVIEW_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def plot_width() -> int:
+    """Returns the plot width requested by ?width=, bounded to [10, MAX_PLOT_WIDTH]."""
+    return min(max(request.args.get("width", default=1000, type=int), 10), MAX_PLOT_WIDTH)
+
+
+# this is called by the 'live' page to plot the running profile and its state
+@app.get("/api/live")
+def live_profile_data():
+    config = ACTIVE_CONFIG
+    if not config:
+        return {"error": "No profile is running."}, 404
+    config.retrieve_config()
+    if not config._profile_filepath:
+        return {"error": "No profile is running."}, 404
+    profile = load_profile(config._profile_filepath)
+    return profile_data(profile, plot_width(), config=config)
+
+
+# the 'live' page subscribes to this for intensity changes and Light Controller heartbeats
+@app.get("/live/events")
+def live_events():
+    response = Response(
+        stream_with_context(LIVE_EVENTS.stream()), mimetype="text/event-stream"
+    )
+    response.cache_control.no_cache = True
+    # Stops proxies (e.g. nginx) buffering the stream.
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+# this is called by the viewer page to plot an uploaded (and compiled) profile
+@app.get("/api/profile/<digest>")
+def viewer_profile_data(digest: str):
+    try:
+        profile = load_compiled(digest)
+    except FileNotFoundError:
+        return {"error": "Unknown profile, please upload it again."}, 404
+    return profile_data(profile, plot_width(), name=request.args.get("name", ""))
+
+
+# a compact status of this Pi, collected from every Pi by the fleet page
+@app.get("/api/status")
+def device_status():
+    device = device_info(request.headers.get('Host'))
+    status = {
+        "name": device["name"],
+        "description": device["description"],
+        "location": device["location"],
+        "profile": None,
+        "run_continuously": None,
+        "started": None,
+        "cycle_num": None,
+        "last_intensity": None,
+        "last_updated": None,
+        "controller_alive": False,
+        "controller_restarts": SUPERVISOR.restarts,
+    }
+    config = ACTIVE_CONFIG
+    if config:
+        config.retrieve_config()
+        status.update(
+            profile=config.profile_filename,
+            run_continuously=config.run_continuously,
+            started=config.started.isoformat(timespec="seconds"),
+            last_intensity=config.last_intensity,
+            last_updated=config.last_updated.isoformat(timespec="seconds"),
+        )
+    controller = STATUS_READER.read()
+    if controller:
+        status["controller_alive"] = controller.alive
+        if config:
+            status["cycle_num"] = controller.cycle_num
+    return status
+
+
+# the status of every Pi in devices.json, for the fleet page
+@app.get("/api/fleet")
+def fleet_status():
+    devices = FLEET.statuses()
+    return {
+        "updated": FLEET.updated.isoformat(timespec="seconds"),
+        "devices": devices,
+    }
+
+
+def time_range() -> Tuple[datetime, datetime]:
+    """Returns the ?start= and ?end= of a request (ISO times), by default the last day.
+
+    Raises:
+        ValueError: If start or end isn't an ISO formatted time.
+    """
+    end = datetime.fromisoformat(request.args.get("end", datetime.now().isoformat()))
+    start = datetime.fromisoformat(
+        request.args.get("start", (end - timedelta(days=1)).isoformat())
+    )
+    return start, end
+
+
+# the intensities sent to the lights between ?start= and ?end= (ISO times, default last day)
+@app.get("/api/history")
+def intensity_history():
+    try:
+        start, end = time_range()
+    except ValueError:
+        return {"error": "start and end must be ISO formatted times."}, 400
+    limit = min(request.args.get("limit", default=MAX_HISTORY_RECORDS, type=int),
+                MAX_HISTORY_RECORDS)
+    records = query_history(start, end, limit)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "records": [record.to_dict() for record in records],
+    }
+
+
+# the live profile's intensity every ?step= seconds (default 60) between ?start= and ?end= (ISO
+# times, default last day), e.g. to backfill the history of a time the lights weren't controlled
+@app.get("/api/schedule")
+def intensity_schedule():
+    config = ACTIVE_CONFIG
+    if not config:
+        return {"error": "No profile is running."}, 404
+    config.retrieve_config()
+    if not config._profile_filepath:
+        return {"error": "No profile is running."}, 404
+    try:
+        start, end = time_range()
+    except ValueError:
+        return {"error": "start and end must be ISO formatted times."}, 400
+    step = request.args.get("step", default=60.0, type=float)
+    if not step > 0:
+        return {"error": "step must be a positive number of seconds."}, 400
+    if (end - start).total_seconds() / step > MAX_SCHEDULE_POINTS:
+        return {"error": f"At most {MAX_SCHEDULE_POINTS} points, use a larger step."}, 400
+    timestamps = np.arange(start.timestamp(), end.timestamp(), step)
+    schedule = live_schedule(load_profile(config._profile_filepath), config)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "step": step,
+        "timestamps": timestamps.tolist(),
+        "intensities": schedule.intensities_at(timestamps).tolist(),
+    }
+
+
+# how late the transitions of the run started at ?started= (ISO time, default the live run) were
+# sent: their p50, p99 and max, and whether the wall clock jumped (see transition_timing.py)
+@app.get("/api/timing")
+def run_timing():
+    config = ACTIVE_CONFIG
+    if "started" in request.args:
+        try:
+            started = datetime.fromisoformat(request.args["started"])
+        except ValueError:
+            return {"error": "started must be an ISO formatted time."}, 400
+    elif config:
+        started = config.started
+    else:
+        return {"error": "No profile is running."}, 404
+    summary = timing_summary(started)
+    if summary is None:
+        return {"error": f"No timing log for the run started at {started.isoformat()}."}, 404
+    return {"started": started.isoformat(), **summary}
+
+
+# the metrics of this Pi's web app and Light Controller for Prometheus to scrape (see metrics.py)
+@app.get("/metrics")
+def prometheus_metrics():
+    if not METRICS_ENABLED:
+        return "Metrics are off (METRICS=0).", 404
+    return Response(exposition(), content_type=CONTENT_TYPE)
 
 
 # Custom error handler for 400 Bad Request
@@ -244,11 +645,25 @@ def bad_request(error):
     return "Bad Request: Please check your request and try again.", 400
 
 
-@app.get("/live/live_plot.png")  # this path doesn't do anything???
+# Custom error handler for uploads over MAX_CONTENT_LENGTH
+@app.errorhandler(413)
+def upload_too_large(error):
+    return f"Profile too large: profiles must be at most {MAX_PROFILE_BYTES // 2**20} MB.", 413
+
+
+# this is called by the 'live' page's <img>, the plot is rendered in memory
+@app.get("/live/live_plot.png")
 def display_live_plot():
-    return redirect(
-        url_for("static", filename="live/live_plot.png")
-    )  # must use subfolder within 'static'
+    config = ACTIVE_CONFIG
+    if not config or not config._profile_filepath:
+        return "No profile is running.", 404
+    png, etag = LIVE_PLOT.render(config)
+    response = make_response(png)
+    response.mimetype = "image/png"
+    response.set_etag(etag)
+    # Browsers must revalidate, an unchanged plot is answered with 304 Not Modified.
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @app.route("/download")
@@ -261,5 +676,6 @@ def download():
 
 # Main Driver Function
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
-    g.pid = None
+    # The reloader would import this module in a 2nd process, with a supervisor and library of
+    # its own racing this one's for the Light Controller and its port.
+    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
@@ -1,88 +1,61 @@
-import json
+import io
 import logging
-import matplotlib
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
+import numpy as np
 import os
-import pandas as pd
 from abc import ABC
 from datetime import datetime, date, time, timedelta
 from glob import glob
-from multiprocessing import Process
-from typing import Optional
-
-CONFIG_NAME: str = "climate_config.json"
-LIVE_FOLDER_PATH: str = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)), "static/live"
+from typing import TYPE_CHECKING, Optional, Tuple
+from config_store import (
+    CONFIG_NAME,
+    LIVE_FOLDER_PATH,
+    RETRIEVE_CONFIG,
+    STATUS_READER,
+    save_json_atomically,
 )
+from metrics import Histogram, timed
+from profile_cache import CompiledProfile, ProfileError, load_profile
+from profile_format import ProfileSchedule
+
+# pandas and matplotlib take seconds to import on a Raspberry Pi, so they're imported by the
+# functions that use them and the web app starts (and resumes the Light Controller) without them.
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+
 DEFAULT_PROFILE: str = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "default_profiles/base.xlsx"
 )
 
-matplotlib.use("Agg")
-
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
+EXPAND_SECONDS = Histogram(
+    "climate_expand_profile_points_seconds", "Seconds to expand a profile's steps for plotting."
+)
+# By plot: "live" (see live_plot.py), "plot_excel" or "preview".
+PLOT_SECONDS = Histogram(
+    "climate_plot_render_seconds", "Seconds to draw and encode a plot.", label_names=("plot",)
+)
+SAVEFIG_SECONDS = Histogram(
+    "climate_plot_savefig_seconds", "Seconds to encode a plot as a PNG.", label_names=("plot",)
+)
 
 
-def RETRIEVE_CONFIG() -> dict:
-    """Retrieves climate configuration dictionary from static/live/{CONFIG_NAME}."""
-    config_path = os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME)
-    if os.path.exists(config_path):
-        with open(config_path, "r", encoding="utf-8") as infile:
-            data = json.load(infile)
-    else:
-        logger.warning("No config file was found!")
-        return {}
-    # Populate config from available data.
-    # Note datetimes are saved as strings in jsons because they're not natively serializable.
-    config = {}
-    config["_started"] = (
-        datetime.fromisoformat(data["_started"])
-        if "_started" in data and isinstance(data["_started"], str)
-        else None
-    )
-    config["last_updated"] = (
-        datetime.fromisoformat(data["last_updated"])
-        if "last_updated" in data and isinstance(data["last_updated"], str)
-        else None
-    )
-    config["run_continuously"] = (
-        data["run_continuously"]
-        if "run_continuously" in data and isinstance(data["run_continuously"], bool)
-        else False
-    )
-    config["rpi_time_script_finished"] = (
-        datetime.fromisoformat(data["rpi_time_script_finished"])
-        if "rpi_time_script_finished" in data
-        and isinstance(data["rpi_time_script_finished"], str)
-        else None
-    )
-    config["_profile_filepath"] = (
-        data["_profile_filepath"]
-        if "_profile_filepath" in data
-        and isinstance(data["_profile_filepath"], str)
-        and os.path.exists(data["_profile_filepath"])
-        else None
-    )
-    config["pid"] = data["pid"] if "pid" in data else None
-    config["last_intensity"] = (
-        data["last_intensity"]
-        if "last_intensity" in data and isinstance(data["last_intensity"], int)
-        else int(data["last_intensity"]) if data["last_intensity"].isnumeric() else 0
-    )
-    return config
+def times_to_timedeltas(df: "pd.DataFrame") -> "pd.DataFrame":
+    import pandas as pd
 
-
-def times_to_timedeltas(df: pd.DataFrame) -> pd.DataFrame:
     if df.dtypes[df.columns[0]] == "O" and isinstance(df.iloc[0, 0], time):
         # Pandas column datatype is 'Object', specifically a python datetime.time, in Excel it is a time
         time_deltas = [
             datetime.combine(date.min, x) - datetime.min for x in df.iloc[:, 0].tolist()
         ]
-    elif df.dtypes[df.columns[0]] == "<M8[ns]":
-        # Pandas column datatype is a pandas Timestamp, in Excel it is a date (with time)
-        time_deltas = [(x - df.iloc[0, 0]).to_pytimedelta() for x in df.iloc[:, 0]]
+    elif pd.api.types.is_datetime64_any_dtype(df.dtypes[df.columns[0]]):
+        # Pandas column datatype is a pandas Timestamp, in Excel it is a date (with time). Any
+        # resolution, pandas 3 reads dates as datetime64[us] rather than [ns].
+        time_deltas = pd.to_timedelta(df.iloc[:, 0] - df.iloc[0, 0])
+    else:
+        raise ValueError("The first column of a profile must be times or dates.")
     df[df.columns[0]] = time_deltas
     return df
 
@@ -102,7 +75,7 @@ class ClimateConfig(ABC):
         started (datetime): Returns _started.
         update: Saves a copy of an instances's state to {LIVE_FOLDER_PATH}/{CONFIG_NAME} (a .json)
         retrieve_config: Repopulates an instance with what's in {LIVE_FOLDER_PATH}/{CONFIG_NAME}
-        __del__: Upon deletion of an instance any saved state file is deleted.
+        delete_files: Deletes the instance's saved state file, profile and live plot.
     """
 
     def __init__(self, profile_path: str = None, run_continuously: bool = True):
@@ -139,10 +112,6 @@ class ClimateConfig(ABC):
                             xlsx_files[0],
                         )
                         self._profile_filepath = xlsx_files[0]
-        # Note: Due to when python garbage collection happens, if you reinstantiate a instance of this class
-        # the __del__ may occur AFTER the save() that happens in the update() below leaving no .json.
-        # A new json will be created the next save() but if this becomes a problem it will have to be dealt
-        # with. This should normally never be a problem with one, prolonged instance of the class.
 
     @property
     def started(self) -> datetime:
@@ -157,7 +126,7 @@ class ClimateConfig(ABC):
         )
 
     def update(self, retreive: bool=False) -> None:
-        """Updates the live plot and 'remembered' state.
+        """Updates the 'remembered' state, the live plot is rendered when viewed (see live_plot.py).
         
         Parameters:
             retreive (bool): If True values are reteived from the json file.
@@ -169,19 +138,18 @@ class ClimateConfig(ABC):
         else:
             now = datetime.now()
             self.last_updated = now - timedelta(microseconds=now.microsecond)
-        plot_excel(self._profile_filepath, self)
         self.save()
 
     def save(self) -> None:
         """Saves the state of the config to live/{CONFIG_NAME}."""
-        with open(
-            os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME), "w", encoding="utf-8"
-        ) as outfile:
-            json.dump(self.__dict__, outfile, indent=4, sort_keys=True, default=str)
+        save_json_atomically(self.__dict__, os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME))
 
     def retrieve_config(self) -> None:
         """Retrieves climate configuration from static/live/{CONFIG_NAME}."""
         data = RETRIEVE_CONFIG()
+        if not data:
+            # The run was stopped (its config deleted), the instance keeps its last state.
+            return
         # Repopulate the config instance from available data.
         # Note datetimes are saved as strings in jsons because they're not natively serializable.
         self._started = (
@@ -222,160 +190,351 @@ class ClimateConfig(ABC):
             missing = [key for key in self.__dict__.keys() if key not in data]
             logger.warning("Data for %s keys missing in the config found: ", missing)
 
-    def __del__(self) -> None:
-        """Function called when a ClimateConfig instance is deleted."""
+    def delete_files(self) -> None:
+        """Deletes the instance's saved state file, profile and live plot, once its run is stopped."""
         # Note: This could add the start and finish times to the name and move to a history folder.
         # Instead it now just cleans up after itself.
         if os.path.exists(os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME)):
             os.remove(os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME))
-        if os.path.exists(self._profile_filepath):
+        if self._profile_filepath and os.path.exists(self._profile_filepath):
             os.remove(self._profile_filepath)
         if os.path.exists(os.path.join(LIVE_FOLDER_PATH, "live_plot.png")):
             os.remove(os.path.join(LIVE_FOLDER_PATH, "live_plot.png"))
 
 
-def expand_profile_points(df: pd.DataFrame) -> pd.DataFrame:
+def expand_steps(
+    times: np.ndarray, values: np.ndarray, ramps: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the points that draw a profile's times and intensities as steps and ramps.
+
+    The output starts with a synthetic (0, 0) point. Rows at zero duration (other than the
+    last) and rows that repeat the previous intensity are dropped. Every kept row becomes two
+    points: its time at the previous intensity then its time at its own intensity. The last
+    row is always kept. A ramp row and the row it ramps to are always kept, and are a single
+    point where the line is continuous. This runs in linear time.
+
+    Arguments:
+        times (ndarray): Durations since the start of the profile (numbers or timedelta64).
+        values (ndarray): Light intensity at each duration.
+        ramps (ndarray): Nonzero where a row ramps to the next row's intensity, None if the
+            profile is all steps.
+
+    Returns (tuple):
+        Arrays of the expanded times and intensities.
+    """
+    if len(times) == 0:
+        return times, values
+    zero = times[:1] - times[:1]
+    last = len(times) - 1
+    is_ramp = np.zeros(len(times), dtype=bool) if ramps is None else np.asarray(ramps) != 0
+    is_ramp[last:] = False
+    # Zero duration rows never start a step, unless it's the last row of the profile or the
+    # start of a ramp.
+    candidates = np.flatnonzero((times != zero[0]) | is_ramp)
+    if len(candidates) == 0 or candidates[-1] != last:
+        candidates = np.append(candidates, last)
+    # Intensity in effect before each candidate: a row at zero duration sets the starting
+    # intensity, otherwise the profile starts from 0.
+    before = np.empty(len(candidates), dtype=values.dtype)
+    before[0] = values[0] if times[0] == zero[0] else 0
+    before[1:] = values[candidates[:-1]]
+    # Rows that start or end a ramp. A ramp arrives at the intensity of the row it ends on.
+    ends_ramp = np.zeros(len(candidates), dtype=bool)
+    ends_ramp[1:] = is_ramp[candidates[:-1]]
+    before[ends_ramp] = values[candidates[ends_ramp]]
+    ramped = is_ramp[candidates] | ends_ramp
+    keep = (values[candidates] != before) | ramped
+    keep[-1] = True
+    rows = candidates[keep]
+    # The end of a ramp, or a ramp starting at the current intensity, needs no step.
+    points = np.ones((len(rows), 2), dtype=bool)
+    points[:, 0] = ~(ramped[keep] & (before[keep] == values[rows]))
+    points = points.ravel()
+    expanded_times = np.concatenate((zero, np.repeat(times[rows], 2)[points]))
+    expanded_values = np.concatenate(
+        (np.zeros(1, dtype=values.dtype),
+         np.column_stack((before[keep], values[rows])).ravel()[points])
+    )
+    return expanded_times, expanded_values
+
+
+@timed(EXPAND_SECONDS)
+def expand_profile_points(df: "pd.DataFrame") -> "pd.DataFrame":
     """Pads a dataframe of duration, intensity values to capture step nature of profiles.
 
     Arguments:
-        df(DataFrame): Dataframe with first column of timedeltas (time since start) and
-        second column of light intensity values.
+        df(DataFrame): Dataframe with first column of timedeltas (time since start),
+        second column of light intensity values and an optional third column of whether
+        each row ramps to the next.
 
     Returns (DataFrame):
         Dataframe with extra rows facilitating the plotting of light intensity setting
         steps where the source dataframe specifies only the time and intensity values
         at the steps.
     """
-    df2 = pd.DataFrame(columns=df.columns)
-    idx2 = 0
-    zero = pd.Timedelta(seconds=0)
-    time_col = df.columns[0]
-    intensity_col = df.columns[1]
-    for idx, row in df.iterrows():
-        duration = row[time_col]
-        if idx == 0:
-            # If the first row isn't duration = zero create one.
-            if duration == zero:
-                df2.loc[0] = [timedelta(0), 0]
-                row.name = 0
-                last_row = row
-            else:
-                # Otherwise use the initial row.
-                first_row = row.copy()
-                first_row.name = 0
-                first_row[time_col] = zero
-                first_row[intensity_col] = 0
-                df2 = df2._append(first_row)
-                last_row = first_row
-            idx2 += 1
-        if duration == zero or row[intensity_col] == last_row[intensity_col]:
-            # Skip any duplicate duration = zero rows or duplicate intensities in profile
-            if idx < len(df) - 1:  # Keep the last row of the profile.
-                continue
-        # Add a row that has new timedelta and intensity from the last row.
-        new_row = last_row.copy()
-        new_row[time_col] = row[time_col]
-        new_row.name = idx2
-        df2 = df2._append(new_row)
-        idx2 += 1
-        # Finally append the next row
-        row.name = idx2
-        df2 = df2._append(row)
-        last_row = row.copy()
-        idx2 += 1
-    return df2
+    import pandas as pd
 
+    time_col, intensity_col = df.columns[:2]
+    ramps = df[df.columns[2]].to_numpy() if len(df.columns) > 2 else None
+    times, values = expand_steps(
+        df[time_col].to_numpy(), df[intensity_col].to_numpy(), ramps
+    )
+    return pd.DataFrame({time_col: times, intensity_col: values})
 
-def plot_excel(filepath: str = "", config: Optional[ClimateConfig] = None):
-    now = datetime.now()
-    now = now - timedelta(microseconds=now.microsecond)
-    # Get the profile
-    df = pd.read_excel(filepath)
-    # Transform input data time column to timedeltas
-    df = times_to_timedeltas(df)
-    # Add data points that facilitate plotting step changes
-    df = expand_profile_points(df)
-    # Determine the profile cycle length and last cycle start time.
-    cycle_dur = min(max(df[df.columns[0]]), timedelta(days=1))
+
+def live_schedule(profile: CompiledProfile, config: ClimateConfig) -> ProfileSchedule:
+    """Returns the schedule of a live profile's run, as its Light Controller runs it."""
+    return ProfileSchedule(profile, config.started, config.run_continuously)
+
+
+def live_cycle_position(
+    schedule: ProfileSchedule, config: ClimateConfig, now: Optional[datetime] = None
+) -> Tuple[datetime, int, datetime, bool]:
+    """Determines where a live profile is within its cycles.
+
+    Arguments:
+        schedule (ProfileSchedule): The run's schedule (see live_schedule).
+        config (ClimateConfig): The config of the running profile.
+        now (datetime): The time to locate, defaults to the current time.
+
+    Returns (tuple):
+        The (possibly adjusted) time, the cycle number, the cycle's start time and whether a
+        profile that doesn't loop has completed.
+    """
+    if now is None:
+        now = datetime.now()
+        now = now - timedelta(microseconds=now.microsecond)
+    if now - config.last_updated < timedelta(seconds=1.2):
+        now = config.last_updated
+    cycle_num, cycle_start = schedule.cycle_at(now)
+    completed = not config.run_continuously and schedule.completed(now)
+    if completed:
+        now = cycle_start + schedule.cycle_dur
+    return now, cycle_num, cycle_start, completed
+
+
+def downsample_minmax(
+    times: np.ndarray, values: np.ndarray, width: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduces a series to at most 4 points per pixel column of a plot width pixels wide.
+
+    The first, last, minimum and maximum points of each column are kept, in time order, which
+    preserves the shape of steps and spikes that averaging or striding would lose.
+
+    Arguments:
+        times (ndarray): Ascending x values.
+        values (ndarray): y values.
+        width (int): Pixel width of the plot.
+
+    Returns (tuple):
+        The kept times and values.
+    """
+    span = times[-1] - times[0] if len(times) else 0
+    if len(times) <= 4 * width or not span:
+        return times, values
+    # Times are ascending so each column's points are contiguous.
+    columns = np.minimum(((times - times[0]) / span * width).astype(int), width - 1)
+    firsts = np.flatnonzero(np.diff(columns, prepend=-1))
+    lasts = np.append(firsts[1:], len(times)) - 1
+    # Sorting by column then value leaves each column in the same positions.
+    by_value = np.lexsort((values, columns))
+    keep = np.unique(
+        np.concatenate((firsts, lasts, by_value[firsts], by_value[lasts]))
+    )
+    return times[keep], values[keep]
+
+
+def profile_data(
+    profile: CompiledProfile,
+    width: int,
+    name: str = "",
+    config: Optional[ClimateConfig] = None,
+) -> dict:
+    """Returns a profile's step series, downsampled for plotting, for the web app's JSON API.
+
+    Arguments:
+        profile (CompiledProfile): The profile to plot.
+        width (int): Pixel width of the plot the series is downsampled for.
+        name (str): The profile's filename.
+        config (ClimateConfig): The config of a live profile, None for the viewer.
+
+    Returns (dict):
+        The series as seconds since the cycle start and intensities, and for a live profile
+        its state: where it is within its cycles and the last intensity sent to the lights.
+    """
+    seconds, intensities = expand_steps(
+        np.asarray(profile.seconds),
+        np.asarray(profile.intensities),
+        np.asarray(profile.ramps),
+    )
+    cycle_dur = timedelta(seconds=float(seconds[-1]))
+    state = None
     if config:
-        if now - config.last_updated < timedelta(seconds=1.2):
-            now = config.last_updated
-        total_elapsed_time = now - config.started
-        cycle_num = total_elapsed_time // cycle_dur
-        if config.run_continuously:
-            cycle_start = config.started + cycle_num * cycle_dur
-        else:
-            cycle_start = config.started
+        schedule = live_schedule(profile, config)
+        now, cycle_num, cycle_start, completed = live_cycle_position(schedule, config)
+        state = {
+            "started": config.started.isoformat(timespec="seconds"),
+            "last_updated": config.last_updated.isoformat(timespec="seconds"),
+            "last_intensity": config.last_intensity,
+            "run_continuously": config.run_continuously,
+            "cycle_num": cycle_num,
+            "completed": completed,
+            "now_seconds": (now - cycle_start).total_seconds(),
+            # What the profile sets at now, the Light Controller's intensity_at.
+            "now_intensity": float(schedule.intensity_at(now)),
+        }
+        name = config.profile_filename
     else:
         # Facilitates Light Profile View
-        cycle_start = datetime(
-            year=now.year, month=now.month, day=now.day, hour=0, second=0
-        )
-        cycle_num = 0
+        cycle_start = datetime.combine(date.today(), time())
+    total_points = len(seconds)
+    seconds, intensities = downsample_minmax(seconds, intensities, width)
+    return {
+        "name": name,
+        "digest": profile.digest,
+        "cycle_start": cycle_start.isoformat(timespec="milliseconds"),
+        "cycle_duration": cycle_dur.total_seconds(),
+        "total_points": total_points,
+        "source_rows": profile.source_rows,
+        "compression": profile.compression,
+        "seconds": seconds.tolist(),
+        "intensities": intensities.tolist(),
+        "state": state,
+    }
+
+
+def plot_time_format(cycle_dur: timedelta) -> str:
+    """Returns the time format of plot labels for a profile's cycle length."""
+    return "%H:%M:%S" if cycle_dur < timedelta(minutes=10) else "%H:%M"
+
+
+def draw_profile_layer(
+    filepath: str,
+    df: "pd.DataFrame",
+    cycle_start: datetime,
+    cycle_num: int = 0,
+    config: Optional[ClimateConfig] = None,
+    completed: bool = False,
+) -> "Figure":
+    """Draws the parts of a profile plot that don't change during a cycle.
+
+    Arguments:
+        filepath (str): Path of the profile, titles the viewer plot.
+        df (DataFrame): The expanded profile (see expand_profile_points).
+        cycle_start (datetime): Start time of the plotted cycle.
+        cycle_num (int): Number of the plotted cycle (live plots only).
+        config (ClimateConfig): The config of a live profile, None for the viewer.
+        completed (bool): Whether a live profile that doesn't loop has completed.
+
+    Returns (Figure):
+        A figure (not managed by pyplot) with an Agg canvas.
+    """
+    import matplotlib.dates as mdates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    cycle_dur = max(df[df.columns[0]])
     # Calculate plot x values for the current (or first) cycle.
     times = [cycle_start + x for x in df.iloc[:, 0]]
     values = df.iloc[:, 1]
 
     # Build plot
-    plt.figure(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
 
     # plot cols
-    plt.plot(times, values, marker=".")
-    plt.grid("both")
-    plt.xlabel("Duration from Start of Profile")
-    plt.ylabel("Light Intensity Value")
-    plt.title(str(os.path.basename(filepath)))
-    plt.tight_layout()
-
-    time_fmt = "%H:%M:%S" if cycle_dur < timedelta(minutes=10) else "%H:%M"
+    ax.plot(times, values, marker=".")
+    ax.grid("both")
+    ax.set_xlabel("Duration from Start of Profile")
+    ax.set_ylabel("Light Intensity Value")
+    ax.set_title(str(os.path.basename(filepath)))
+    fig.tight_layout()
+
+    time_fmt = plot_time_format(cycle_dur)
     if config:
-        # For life profile label plots with start and current time/duration.
-        dur = now - cycle_start
-        if dur > cycle_dur and not config.run_continuously:
-            now = cycle_start + cycle_dur
-            dur = cycle_dur
-            completed = True
-        else:
-            completed = False
-        dur_str = now.strftime("%m/%d " + time_fmt)
-        plt.axvline(x=now, linestyle="--", color="r")
-        an_y = (78, 80.5) if config.last_intensity < 60. else (0, 2.5)
-        intensity = config.last_intensity
-        plt.annotate(f"{intensity}", xy=(now, intensity),
-                     xytext=(now + 2*cycle_dur/100, intensity + 5),
-                     arrowprops=dict(facecolor='black', width=1,
-                                     headwidth=6, headlength=6)
-                     )
-        plt.annotate(dur_str, [now, an_y[0]], rotation=90, ha="right")
-        # TODO: To plot value we need to determine what it is. This should be done by
-        #       the same function that does it for control_lights.py.
-        # plt.annotate(0, [now, 0], ha="left")
-        plt.annotate("Last Update", [now, an_y[1]], rotation=90, ha="left")
         if config.run_continuously and cycle_num:
-            plt.axvline(x=cycle_start, linestyle="--", color="r")
-            plt.annotate(
+            ax.axvline(x=cycle_start, linestyle="--", color="r")
+            ax.annotate(
                 cycle_start.strftime("%m/%d %H:%M:%S"),
                 [cycle_start, 41],
                 rotation=90,
                 ha="right",
             )
-            plt.annotate(
+            ax.annotate(
                 f"Cycle {cycle_num + 1:,} Start Time",
                 [cycle_start, 39],
                 rotation=90,
                 ha="left",
             )
-        plt.xlabel("Rasberry Pi Time of Day")
-        plt.title(
+        ax.set_xlabel("Rasberry Pi Time of Day")
+        ax.set_title(
             f"Controlling Profile: {config.profile_filename}"
             f"{' (looping)' if config.run_continuously else ' (COMPLETED)' if completed else ''}"
             f"\n Started: {config._started.strftime('%m/%d %H:%M:%S')}"
         )
-        plt.tight_layout()
+        fig.tight_layout()
 
-    plt.gcf().autofmt_xdate(rotation=90, ha="center")
-    ax = plt.gca()
+    fig.autofmt_xdate(rotation=90, ha="center")
     ax.xaxis.set_major_formatter(mdates.DateFormatter(time_fmt))
+    return fig
+
+
+def draw_now_layer(
+    ax: "Axes",
+    now: datetime,
+    cycle_dur: timedelta,
+    config: ClimateConfig,
+    intensity: Optional[float] = None,
+) -> list:
+    """Draws the "Last Update" line and annotations of a live plot.
+
+    Arguments:
+        intensity (float): The intensity the profile sets at now (see ProfileSchedule),
+            defaults to the last intensity sent.
+
+    Returns (list):
+        The drawn artists, so they can be removed or redrawn on their own.
+    """
+    # For life profile label plots with start and current time/duration.
+    dur_str = now.strftime("%m/%d " + plot_time_format(cycle_dur))
+    intensity = config.last_intensity if intensity is None else intensity
+    an_y = (78, 80.5) if intensity < 60. else (0, 2.5)
+    return [
+        ax.axvline(x=now, linestyle="--", color="r"),
+        ax.annotate(f"{intensity}", xy=(now, intensity),
+                    xytext=(now + 2*cycle_dur/100, intensity + 5),
+                    arrowprops=dict(facecolor='black', width=1,
+                                    headwidth=6, headlength=6)
+                    ),
+        ax.annotate(dur_str, [now, an_y[0]], rotation=90, ha="right"),
+        ax.annotate("Last Update", [now, an_y[1]], rotation=90, ha="left"),
+    ]
+
+
+@timed(PLOT_SECONDS, "plot_excel")
+def plot_excel(filepath: str = "", config: Optional[ClimateConfig] = None):
+    now = datetime.now()
+    now = now - timedelta(microseconds=now.microsecond)
+    # Get the compiled profile as timedeltas and intensities
+    profile = load_profile(filepath)
+    # Add data points that facilitate plotting step changes
+    df = expand_profile_points(profile.to_frame())
+    # Determine the profile cycle length and last cycle start time.
+    cycle_dur = max(df[df.columns[0]])
+    if config:
+        schedule = live_schedule(profile, config)
+        now, cycle_num, cycle_start, completed = live_cycle_position(schedule, config, now)
+    else:
+        # Facilitates Light Profile View
+        cycle_start = datetime(
+            year=now.year, month=now.month, day=now.day, hour=0, second=0
+        )
+        cycle_num = 0
+        completed = False
+    fig = draw_profile_layer(filepath, df, cycle_start, cycle_num, config, completed)
+    if config:
+        draw_now_layer(fig.axes[0], now, cycle_dur, config, schedule.intensity_at(now))
 
     # save plot to 'static' folder
     plot_path = (
@@ -383,32 +542,38 @@ def plot_excel(filepath: str = "", config: Optional[ClimateConfig] = None):
         if config
         else os.path.join(os.path.dirname(filepath), "plot.png")
     )
-    plt.savefig(plot_path)
-    plt.close()
-
+    with SAVEFIG_SECONDS.time("plot_excel"):
+        fig.savefig(plot_path)
 
-def check_profile_validity(filepath):
 
-    # 1. check if excel file or csv file
-    if filepath.endswith(".xlsx"):
-        df = pd.read_excel(filepath)
+@timed(PLOT_SECONDS, "preview")
+def profile_preview_png(profile: CompiledProfile) -> bytes:
+    """Returns a PNG of a profile's first cycle, drawn as the viewer's plot.png (see plot_excel).
 
-    elif filepath.endswith(".csv"):
-        df = pd.read_csv(filepath)
+    The plot isn't titled with a file name, previews are shared by files with the same contents.
+    """
+    df = expand_profile_points(profile.to_frame())
+    now = datetime.now()
+    fig = draw_profile_layer("", df, datetime(now.year, now.month, now.day))
+    png = io.BytesIO()
+    with SAVEFIG_SECONDS.time("preview"):
+        fig.savefig(png, format="png")
+    return png.getvalue()
 
-    else:
-        return False
 
-    # 2. check if file has 2 columns
-    if len(df.columns) != 2:
-        return False
+def profile_error(filepath: str) -> Optional[str]:
+    """Returns why filepath isn't a valid .xlsx or .csv profile, None if it is.
 
-    # 3. check if first column is time
+    The profile is compiled as part of the check so later consumers don't parse it again.
+    """
     try:
-        # convert first col to pd time
-        df.iloc[:, 0] = pd.to_datetime(df.iloc[:, 0], format="%H:%M:%S").dt.time
-    except:
-        return False
+        load_profile(filepath)
+    except ProfileError as e:
+        logger.info("Invalid profile %s: %s", filepath, e)
+        return str(e)
+    return None
+
 
-    # if passed all the tests, return True!
-    return True
+def check_profile_validity(filepath) -> bool:
+    """Returns True if filepath is a valid .xlsx or .csv profile, see profile_error."""
+    return profile_error(filepath) is None
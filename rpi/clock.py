@@ -0,0 +1,132 @@
+"""Clocks the Light Controller tells time and sleeps with.
+
+The Light Controller uses SYSTEM_CLOCK. A VirtualClock jumps forward instead of sleeping, so a
+multi-day run of a profile can be replayed in seconds (see simulate.py).
+
+A run is timed by a RunClock: the wall clock's time when the run clock was made, moved on by the
+monotonic clock, so the wall clock being slewed or adjusted by less than WALL_JUMP_TOLERANCE
+doesn't make the run's transitions late or early. A larger step of the wall clock (an NTP
+correction, e.g. a Pi without a real-time clock that booted before NTP synced, a DST change, the
+date being set by hand) is detected by check_wall, and the run clock is re-anchored to the wall
+clock. The Light Controller, a restarted Light Controller and the web app's schedule (the plots,
+/api/schedule, the live events), which use the wall clock, then all agree on the row in effect.
+
+Only the standard library is used so the Light Controller stays light.
+"""
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Sequence, Tuple
+
+# Seconds the wall clock may move against the monotonic clock between checks before it's a
+# jump rather than drift.
+WALL_JUMP_TOLERANCE: float = 1.0
+
+
+class ClockStopped(Exception):
+    """Raised by a VirtualClock that reached its stop time, e.g. to simulate a power outage."""
+
+
+class SystemClock:
+    """The system's wall and monotonic clocks."""
+
+    __slots__ = ()
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+class VirtualClock:
+    """A clock that only moves when slept on.
+
+    Attributes:
+        stop_at (datetime): ClockStopped is raised by a sleep that reaches it, None to never stop.
+        wall_jumps (list): (monotonic seconds, seconds) of steps of the wall clock, e.g. an NTP
+            correction, applied once the clock has been slept on that long.
+    """
+
+    __slots__ = ("_now", "_elapsed", "stop_at", "wall_jumps")
+
+    def __init__(
+        self,
+        start: datetime,
+        stop_at: Optional[datetime] = None,
+        wall_jumps: Sequence[Tuple[float, float]] = (),
+    ):
+        """Initializes the VirtualClock class."""
+        self._now = start
+        # Kept as a timedelta so the monotonic clock moves exactly as the wall clock does.
+        self._elapsed = timedelta()
+        self.stop_at = stop_at
+        self.wall_jumps = sorted(wall_jumps)
+
+    def now(self) -> datetime:
+        return self._now
+
+    def monotonic(self) -> float:
+        return self._elapsed.total_seconds()
+
+    def sleep(self, seconds: float) -> None:
+        step = timedelta(seconds=max(seconds, 0))
+        self._now += step
+        self._elapsed += step
+        while self.wall_jumps and self.wall_jumps[0][0] <= self.monotonic():
+            self._now += timedelta(seconds=self.wall_jumps.pop(0)[1])
+        if self.stop_at and self._now >= self.stop_at:
+            self._now = self.stop_at
+            raise ClockStopped(f"Clock stopped at {self.stop_at}")
+
+
+class RunClock:
+    """The time of a run, told by a clock's monotonic time and re-anchored on a wall clock jump.
+
+    Attributes:
+        clock (SystemClock or VirtualClock): The clock the run clock is anchored to and sleeps on.
+        wall_offset (float): Seconds the wall clock was ahead of its time when the run clock was
+            made moved on by the monotonic clock, at the last check.
+        jumps (int): The number of wall clock jumps check_wall detected.
+    """
+
+    __slots__ = ("clock", "wall_offset", "jumps", "_anchor", "_anchor_monotonic", "_stepped")
+
+    def __init__(self, clock=SYSTEM_CLOCK):
+        """Initializes the RunClock class, anchored to clock's wall time now."""
+        self.clock = clock
+        self._anchor_monotonic = self.clock.monotonic()
+        self._anchor = self.clock.now()
+        # Seconds the run clock was moved by to follow wall clock jumps.
+        self._stepped = 0.0
+        self.wall_offset = 0.0
+        self.jumps = 0
+
+    def now(self) -> datetime:
+        return self._anchor + timedelta(
+            seconds=self.clock.monotonic() - self._anchor_monotonic + self._stepped
+        )
+
+    def sleep(self, seconds: float) -> None:
+        self.clock.sleep(seconds)
+
+    def check_wall(self, tolerance: float = WALL_JUMP_TOLERANCE) -> Optional[float]:
+        """Returns the seconds the wall clock jumped by since the last check, None if it didn't.
+
+        A jump re-anchors the run clock to the wall clock. Drift below tolerance between checks
+        is only tracked in wall_offset.
+        """
+        elapsed = self.clock.monotonic() - self._anchor_monotonic
+        offset = (self.clock.now() - self._anchor).total_seconds() - elapsed
+        jump = offset - self.wall_offset
+        self.wall_offset = offset
+        if abs(jump) < tolerance:
+            return None
+        self._stepped = offset
+        self.jumps += 1
+        return jump
@@ -0,0 +1,99 @@
+"""The web app's saved climate config, shared with the Light Controller.
+
+Only the standard library is used so the Light Controller can read its config without loading
+the web app's plotting and spreadsheet dependencies (see climate_web_utilities.py).
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from controller_status import StatusReader
+from metrics import Histogram, timed
+
+CONFIG_NAME: str = "climate_config.json"
+LIVE_FOLDER_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static/live"
+)
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+# The Light Controller's live state (last intensity etc.), see controller_status.py.
+STATUS_READER = StatusReader()
+CONFIG_SAVE_SECONDS = Histogram(
+    "climate_config_save_seconds", "Seconds to save climate_config.json (or another json)."
+)
+CONFIG_LOAD_SECONDS = Histogram(
+    "climate_config_load_seconds", "Seconds to load climate_config.json and the status record."
+)
+
+
+@timed(CONFIG_SAVE_SECONDS)
+def save_json_atomically(data: dict, path: str) -> None:
+    """Saves data to a json at path without readers ever seeing a partially written file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as outfile:
+        json.dump(data, outfile, indent=4, sort_keys=True, default=str)
+    os.replace(tmp_path, path)
+
+
+@timed(CONFIG_LOAD_SECONDS)
+def RETRIEVE_CONFIG() -> dict:
+    """Retrieves climate configuration dictionary from static/live/{CONFIG_NAME}."""
+    config_path = os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME)
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as infile:
+            data = json.load(infile)
+    else:
+        logger.warning("No config file was found!")
+        return {}
+    # Populate config from available data.
+    # Note datetimes are saved as strings in jsons because they're not natively serializable.
+    config = {}
+    config["_started"] = (
+        datetime.fromisoformat(data["_started"])
+        if "_started" in data and isinstance(data["_started"], str)
+        else None
+    )
+    config["last_updated"] = (
+        datetime.fromisoformat(data["last_updated"])
+        if "last_updated" in data and isinstance(data["last_updated"], str)
+        else None
+    )
+    config["run_continuously"] = (
+        data["run_continuously"]
+        if "run_continuously" in data and isinstance(data["run_continuously"], bool)
+        else False
+    )
+    config["rpi_time_script_finished"] = (
+        datetime.fromisoformat(data["rpi_time_script_finished"])
+        if "rpi_time_script_finished" in data
+        and isinstance(data["rpi_time_script_finished"], str)
+        else None
+    )
+    config["_profile_filepath"] = (
+        data["_profile_filepath"]
+        if "_profile_filepath" in data
+        and isinstance(data["_profile_filepath"], str)
+        and os.path.exists(data["_profile_filepath"])
+        else None
+    )
+    config["pid"] = data["pid"] if "pid" in data else None
+    config["last_intensity"] = (
+        data["last_intensity"]
+        if "last_intensity" in data and isinstance(data["last_intensity"], int)
+        else int(data["last_intensity"]) if data["last_intensity"].isnumeric() else 0
+    )
+    # The json is only a checkpoint, the running Light Controller's state is in its status record.
+    status = STATUS_READER.read()
+    if (
+        status
+        and status.started
+        and config["_started"]
+        and abs(status.started - config["_started"]) < timedelta(milliseconds=1)
+    ):
+        config["pid"] = status.pid
+        config["last_intensity"] = int(status.last_intensity)
+        if status.last_updated:
+            config["last_updated"] = status.last_updated
+    return config
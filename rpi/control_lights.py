@@ -1,135 +1,269 @@
-import json
-import logging
-import os
-import pandas as pd
-from datetime import datetime, date, time, timedelta
-from time import sleep
-from typing import Optional
-from climate_web_utilities import (
-    CONFIG_NAME,
-    LIVE_FOLDER_PATH,
-    RETRIEVE_CONFIG,
-    times_to_timedeltas,
-)
-from light_utilities import flash_lights_thrice, send_to_arduino
-
-logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
-logger = logging.getLogger(__name__)
-CONFIG_PATH = os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME)
-
-
-def find_next_row(df: pd.DataFrame, elapsed_time: timedelta) -> int:
-    """Find the next row of the Dataframe that elapsed_time > elapsed_time.
-
-    Arguments:
-        df (DataFrame): A dataframe where the first column are timedeltas that light intensities are to be set.
-        elapsed_time (timedelta): The amount of time since the profile was started.
-    Returns (int):
-        Index of the next row in the dataframe where time <= the elapsed time.
-    """
-    time_column_name: str = df.columns[0]
-    row_idx: int = 0
-    # Note: Time values in the dataframe are type datetime.timedelta's
-    next_time = df[time_column_name][row_idx]
-    while elapsed_time > next_time and row_idx + 1 < len(df):
-        next_time = df[time_column_name][row_idx + 1]
-        row_idx += 1
-    return row_idx
-
-
-def save_config(config: dict) -> None:
-    """Save climate_config.json."""
-    with open(CONFIG_PATH, "w", encoding="utf-8") as outfile:
-        json.dump(config, outfile, indent=4, sort_keys=True, default=str)
-    return
-
-
-def control_lights():
-    """Controls light intensity and updates climate_config.json."""
-    # Get and save pid immediately before taking the time to flash the lights.
-    pid = os.getpid()
-    logger.info("Light controller starting as pid=%s", pid)
-    config = RETRIEVE_CONFIG()
-    config["pid"] = pid
-    start_time = config["_started"]
-    save_config(config)
-    # Confirm new light controller by flashing lights:
-    flash_lights_thrice()
-    # Read profile excel file
-    df = pd.read_excel(config["_profile_filepath"])
-    time_column_name, intensity_column_name = df.columns[:2]
-    # Transform input data time column to timedeltas
-    df = times_to_timedeltas(df)
-
-    def update_and_report(time_point: datetime, update_intensity: float):
-        send_to_arduino(update_intensity)
-        config["last_updated"] = time_point
-        config["last_intensity"] = int(update_intensity)
-        save_config(config)
-
-    # Determine the profile cycle length and where the current time is relative to when it was started.
-    cycle_dur = max(df[time_column_name])
-    now = datetime.now()
-    now = now - timedelta(microseconds=now.microsecond)
-    total_elapsed_time = now - start_time
-    cycle_num = total_elapsed_time // cycle_dur
-    cycle_start = start_time + cycle_num * cycle_dur
-    dur_into_cycle = now - cycle_start
-    if dur_into_cycle > cycle_dur and not config["run_continuously"]:
-        logger.info(
-            "Duration since start already > profile cycle length. Light controller done."
-        )
-        controlling = False
-        row_count = len(df) - 1
-    else:
-        # Find the next row in the dataframe that is at or after the current elapsed time:
-        # Note, this may not be the 1st row if a profile is "restarted".
-        row_count = max(0, find_next_row(df, dur_into_cycle) - 1)
-    next_time = df[time_column_name][row_count + 1]
-    intensity = df[intensity_column_name][row_count]
-    logger.info(
-        "%s: Initializing light intensity to %s by pid %s."
-        % (now.strftime("%m/%d %H:%M:%S"), intensity, config['pid'])
-    )
-    update_and_report(now, intensity)
-    last_intensity = intensity
-
-    controlling = True
-    while controlling:
-        # go thru each of the rows
-        while row_count < len(df)-1:
-            if intensity != last_intensity:
-                # Set light intensity
-                logger.info(
-                    "%s: Updating light intensity to %s by pid %s."
-                    % (now.strftime("%m/%d %H:%M:%S"), intensity, config['pid'])
-                )
-                update_and_report(now, intensity)
-                last_intensity = intensity
-
-            while dur_into_cycle <= next_time:
-                sleep(0.5)
-                now = datetime.now()
-                now = now - timedelta(microseconds=now.microsecond)
-                dur_into_cycle = now - cycle_start
-            row_count += 1
-            # Extract the "next" row's time and the new intensity:
-            next_time = df[time_column_name][row_count + 1] if row_count < len(df)-1 else df[time_column_name][1]
-            intensity = df[intensity_column_name][row_count]
-        row_count = 0
-        cycle_num += 1
-        now = datetime.now()
-        now = now - timedelta(microseconds=now.microsecond)
-        cycle_start = start_time + cycle_num * cycle_dur
-        dur_into_cycle = now - cycle_start
-        controlling = config["run_continuously"]
-        intensity = df[intensity_column_name].iloc[0] if config["run_continuously"] else df[intensity_column_name].iloc[-1]
-    if intensity != last_intensity:
-        logger.info(
-            "%s, Final light intensity to %s by pid %s."
-            % (now.strftime("%m/%d %H:%M:%S"), intensity, config['pid'])
-        )
-        update_and_report(now, intensity)
-    config["rpi_time_script_finished"] = datetime.now()
-    config["pid"] = None
-    save_config(config)
+"""The Light Controller, steps the lights through the live profile.
+
+Started by the web app as its own process (python3 control_lights.py). Only the standard library
+and pyserial are imported, the profile is read from its compiled form (see profile_format.py), so
+the process stays small and starts quickly on a Raspberry Pi. The web app's supervisor (see
+supervisor.py) restarts it with --resume if it dies or its heartbeat stops.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from clock import SYSTEM_CLOCK, RunClock
+from config_store import (
+    CONFIG_NAME,
+    LIVE_FOLDER_PATH,
+    RETRIEVE_CONFIG,
+    save_json_atomically,
+)
+from controller_status import EXIT_PORT_LOCKED, HEARTBEAT_INTERVAL, StatusWriter
+from light_utilities import (
+    PortLockedError,
+    connect_arduino,
+    flash_lights_thrice,
+    send_to_arduino,
+)
+from metrics import METRICS_ENABLED
+from profile_format import ProfileArrays, ProfileSchedule, load_arrays
+from run_history import RunHistory
+from transition_timing import TransitionLog
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+CONFIG_PATH = os.path.join(LIVE_FOLDER_PATH, CONFIG_NAME)
+# Seconds between recalculating the intensity during a ramp. Only whole intensity changes are
+# sent to the lights, so a slow ramp sends far fewer commands than it has ticks.
+RAMP_TICK_SECONDS: float = float(os.environ.get("RAMP_TICK_SECONDS", 1.0))
+
+
+def sleep_until(
+    wake_time: datetime,
+    heartbeat: Optional[Callable[[], None]] = None,
+    clock=SYSTEM_CLOCK,
+) -> None:
+    """Sleeps until clock reaches wake_time, calling heartbeat every HEARTBEAT_INTERVAL."""
+    while True:
+        remaining = (wake_time - clock.now()).total_seconds()
+        if remaining <= 0:
+            return
+        if heartbeat:
+            clock.sleep(min(remaining, HEARTBEAT_INTERVAL))
+            heartbeat()
+        else:
+            clock.sleep(remaining)
+
+
+def save_config(config: dict) -> None:
+    """Save climate_config.json, the checkpoint a run is resumed from."""
+    save_json_atomically(config, CONFIG_PATH)
+    return
+
+
+def control_lights(
+    config: Optional[dict] = None,
+    clock=SYSTEM_CLOCK,
+    arduino=None,
+    status: Optional[StatusWriter] = None,
+    history: Optional[RunHistory] = None,
+    checkpoint: bool = True,
+    flash: bool = True,
+    timing: Optional[TransitionLog] = None,
+):
+    """Controls light intensity and reports it in the controller status record.
+
+    climate_config.json is only saved when the controller starts and finishes. The defaults
+    control the lights, simulate.py replaces them to replay a run in virtual time. The run
+    starts at the row in effect now, so a restarted controller resumes where its run is. From
+    then on the run is timed by the monotonic clock (see clock.RunClock). A jump of the wall
+    clock is logged and recorded in the run's timing log, and the run follows the wall clock
+    from then on, as the web app and a restarted controller do.
+
+    Arguments:
+        config (dict): The run's config, defaults to climate_config.json's.
+        clock (SystemClock or VirtualClock): Tells the time and sleeps.
+        arduino (serial object): Serial object for the Arduino controlling the lights, defaults
+            to the one on ARDUINO_PORT.
+        status (StatusWriter): The status record, defaults to the web app's.
+        history (RunHistory): The run history, defaults to the web app's.
+        checkpoint (bool): Whether to save the config to climate_config.json.
+        flash (bool): Whether to flash the lights before starting, not when resuming.
+        timing (TransitionLog): The run's timing log, defaults to the web app's.
+
+    Raises:
+        PortLockedError: If another Light Controller is driving the Arduino's port.
+    """
+    pid = os.getpid()
+    logger.info("Light controller starting as pid=%s", pid)
+    config = RETRIEVE_CONFIG() if config is None else config
+    # The port is locked first, a second controller stops before it claims the run.
+    arduino = connect_arduino() if arduino is None else arduino
+    # Get and save pid immediately before taking the time to flash the lights.
+    config["pid"] = pid
+    start_time = config["_started"]
+    if checkpoint:
+        save_config(config)
+    profile = load_arrays(config["_profile_filepath"])
+    # Once its pid is in the status record the supervisor expects a heartbeat every
+    # HEARTBEAT_INTERVAL, so the slow steps above come first.
+    status = StatusWriter() if status is None else status
+    status.write(pid=pid, started=start_time)
+    history = RunHistory() if history is None else history
+    timing = TransitionLog(start_time) if timing is None else timing
+    run_clock = RunClock(clock)
+
+    def heartbeat() -> None:
+        status.heartbeat()
+        jump = run_clock.check_wall()
+        if jump is not None:
+            logger.warning(
+                "The wall clock jumped by %+.3f s, the run follows it from now.", jump
+            )
+
+    try:
+        if flash:
+            # Confirm new light controller by flashing lights:
+            flash_lights_thrice(
+                arduino,
+                lambda seconds: sleep_until(
+                    run_clock.now() + timedelta(seconds=seconds), heartbeat, run_clock
+                ),
+                # The flashes are recorded too, the history is what the lights did.
+                lambda intensity: history.append(
+                    intensity, profile.digest, pid, run_clock.now().timestamp()
+                ),
+            )
+        _run_profile(
+            config, profile, run_clock, heartbeat, arduino, status, history, timing, checkpoint
+        )
+    finally:
+        status.close()
+        history.close()
+        timing.close()
+
+
+def _run_profile(
+    config: dict,
+    profile: ProfileArrays,
+    run_clock: RunClock,
+    heartbeat: Callable[[], None],
+    arduino,
+    status: StatusWriter,
+    history: RunHistory,
+    timing: TransitionLog,
+    checkpoint: bool,
+) -> None:
+    """Steps through the config's profile, see control_lights."""
+    pid = config["pid"]
+    schedule = ProfileSchedule(profile, config["_started"], config["run_continuously"])
+
+    def update_and_report(
+        time_point: datetime, update_intensity: float, due: Optional[datetime] = None
+    ):
+        sent_at = run_clock.now()
+        sent = time.perf_counter()
+        send_to_arduino(update_intensity, arduino)
+        # Serial writes are timed for /metrics (see metrics.py) unless metrics are off.
+        send_seconds = time.perf_counter() - sent if METRICS_ENABLED else None
+        if due:
+            timing.append(due, sent_at, run_clock.wall_offset)
+        history.append(update_intensity, profile.digest, pid, time_point.timestamp())
+        config["last_updated"] = time_point - timedelta(microseconds=time_point.microsecond)
+        config["last_intensity"] = int(update_intensity)
+        status.write(
+            last_intensity=update_intensity,
+            last_updated=config["last_updated"],
+            cycle_num=cycle_num,
+            lateness=(sent_at - due).total_seconds() if due else None,
+            send_seconds=send_seconds,
+        )
+
+    # Where the current time is relative to when the profile was started.
+    now = run_clock.now()
+    cycle_num, cycle_start = schedule.cycle_at(now)
+    last_intensity = None
+    # When the intensity was due to change, None for the intensity the run starts at.
+    due = None
+    controlling = not schedule.completed(now)
+    if not controlling:
+        logger.info(
+            "Duration since start already > profile cycle length. Light controller done."
+        )
+    while controlling:
+        # The intensity in effect now. This may not be the 1st row's if a profile is "restarted".
+        cycle_num, cycle_start = schedule.cycle_at(now)
+        intensity = schedule.intensity_at(now)
+        if intensity != last_intensity:
+            # Set light intensity
+            logger.info(
+                "%s: %s light intensity to %s by pid %s."
+                % (
+                    now.strftime("%m/%d %H:%M:%S"),
+                    "Initializing" if last_intensity is None else "Updating",
+                    intensity,
+                    config["pid"],
+                )
+            )
+            update_and_report(now, intensity, due)
+            last_intensity = intensity
+        # Sleep until the next intensity change, skipping rows that repeat the intensity, or
+        # the next tick of a ramp.
+        wake_time = schedule.next_transition(now, RAMP_TICK_SECONDS)
+        if wake_time is None:
+            # Woke after the end of a run that doesn't loop, e.g. a slow serial write.
+            break
+        jumps = run_clock.jumps
+        sleep_until(wake_time, heartbeat, run_clock)
+        # A transition the wall clock jumped past isn't late, so it isn't timed.
+        due = wake_time if run_clock.jumps == jumps else None
+        if wake_time >= cycle_start + schedule.cycle_dur:
+            # No more changes this cycle, on to the next cycle or done.
+            controlling = config["run_continuously"]
+        now = run_clock.now()
+    intensity = profile.intensities[-1]
+    if intensity != last_intensity:
+        logger.info(
+            "%s, Final light intensity to %s by pid %s."
+            % (now.strftime("%m/%d %H:%M:%S"), intensity, config['pid'])
+        )
+        update_and_report(now, intensity, due)
+    config["rpi_time_script_finished"] = run_clock.clock.now()
+    config["pid"] = None
+    if checkpoint:
+        save_config(config)
+    status.write(finished=True)
+
+
+def peak_rss_mb() -> float:
+    """Returns the most memory this process has had resident in MB, 0 if unknown (not Linux)."""
+    # Unlike getrusage's ru_maxrss, VmHWM isn't carried over from the parent that started us.
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as infile:
+            for line in infile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Steps the lights through the live profile.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume a run whose controller stopped, without flashing the lights",
+    )
+    args = parser.parse_args()
+    logger.info(
+        "Light controller loaded using %.0f ms of CPU, %.1f MB resident.",
+        time.process_time() * 1000,
+        peak_rss_mb(),
+    )
+    try:
+        control_lights(flash=not args.resume)
+    except PortLockedError as e:
+        logger.error("Another Light Controller is driving the lights: %s", e)
+        sys.exit(EXIT_PORT_LOCKED)
@@ -0,0 +1,213 @@
+"""A fixed layout status record shared by the Light Controller and the web app.
+
+The Light Controller used to rewrite climate_config.json on every intensity change and the web
+app re-parsed it to show the live state. Now the controller writes its state into a small
+memory mapped file, {STATUS_PATH}, and the web app reads it in microseconds. climate_config.json
+is only written to checkpoint a run so it can be resumed (e.g. after a power outage).
+
+Writes are lock free using a sequence counter (a seqlock): the writer makes the counter odd,
+writes the fields, then makes it even. A reader retries if the counter was odd or changed while
+it read the fields.
+
+Only the standard library is used so the Light Controller stays light.
+"""
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+STATUS_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static/live/controller_status.bin"
+)
+# Seconds between Light Controller heartbeats.
+HEARTBEAT_INTERVAL: float = 0.5
+# Missed heartbeats before the Light Controller is considered not alive, and is restarted by
+# the supervisor (see supervisor.py).
+STALE_HEARTBEAT_INTERVALS: int = 2
+# Seconds without a heartbeat before the Light Controller is considered not alive.
+HEARTBEAT_TIMEOUT: float = STALE_HEARTBEAT_INTERVALS * HEARTBEAT_INTERVAL
+# The Light Controller's exit status when another controller holds its port (EX_TEMPFAIL).
+EXIT_PORT_LOCKED: int = 75
+# Upper bounds (seconds) of the buckets serial writes are counted into, for /metrics. A framed
+# write and its ack take ~10 ms at 9600 baud.
+SEND_BUCKETS: tuple = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+# Sequence counter, then: pid, started, last intensity, last updated, heartbeat, cycle number,
+# lateness of the last transition, total seconds of serial writes and the count of writes in
+# each of SEND_BUCKETS (and above the last). Times are seconds since the epoch, 0 when unset.
+_SEQUENCE = struct.Struct("<I")
+_FIELDS = struct.Struct(f"<iddddqdd{len(SEND_BUCKETS) + 1}I")
+_SEND_COUNTS_INDEX = 8
+_FIELDS_OFFSET = 8
+RECORD_SIZE: int = _FIELDS_OFFSET + _FIELDS.size
+# Reads of a record that is being written before giving up (the writer died mid write).
+_MAX_READ_ATTEMPTS = 10000
+
+
+class ControllerStatus(NamedTuple):
+    """A snapshot of the Light Controller's state.
+
+    Attributes:
+        pid (int): The Light Controller's pid, None once it has finished.
+        started (datetime): The start time of the run (the config's _started).
+        last_intensity (float): The last intensity sent to the lights.
+        last_updated (datetime): When the last intensity was sent.
+        cycle_num (int): The profile cycle the run is in.
+        heartbeat (float): Seconds since the epoch of the controller's last heartbeat.
+        lateness (float): Seconds the last transition was sent after it was due.
+        send_seconds (float): Total seconds of serial writes.
+        send_counts (tuple): The count of serial writes in each of SEND_BUCKETS, and above.
+    """
+
+    pid: Optional[int]
+    started: Optional[datetime]
+    last_intensity: float
+    last_updated: Optional[datetime]
+    cycle_num: int
+    heartbeat: float
+    lateness: float = 0.0
+    send_seconds: float = 0.0
+    send_counts: tuple = ()
+
+    @property
+    def heartbeat_age(self) -> float:
+        """Seconds since the last heartbeat."""
+        return time.time() - self.heartbeat
+
+    @property
+    def alive(self) -> bool:
+        """Whether the Light Controller is running and its heartbeat is recent."""
+        return bool(self.pid) and self.heartbeat_age < HEARTBEAT_TIMEOUT
+
+
+def _timestamp(value: Optional[datetime]) -> float:
+    return value.timestamp() if value else 0.0
+
+
+def _datetime(value: float) -> Optional[datetime]:
+    return datetime.fromtimestamp(value) if value else None
+
+
+def _open_record(path: str, access: int) -> mmap.mmap:
+    """Memory maps the record at path, creating it if needed."""
+    if not os.path.exists(path) or os.path.getsize(path) < RECORD_SIZE:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as outfile:
+            outfile.truncate(RECORD_SIZE)
+    with open(path, "r+b" if access == mmap.ACCESS_WRITE else "rb") as infile:
+        return mmap.mmap(infile.fileno(), RECORD_SIZE, access=access)
+
+
+class StatusWriter:
+    """Writes the Light Controller's status record. There must only be one writer."""
+
+    __slots__ = ("_map", "_sequence", "_fields")
+
+    def __init__(self, path: str = STATUS_PATH):
+        """Initializes the StatusWriter class."""
+        self._map = _open_record(path, mmap.ACCESS_WRITE)
+        self._sequence = _SEQUENCE.unpack_from(self._map, 0)[0]
+        if self._sequence % 2:
+            # A previous writer died mid write.
+            self._sequence += 1
+        self._fields = list(_FIELDS.unpack_from(self._map, _FIELDS_OFFSET))
+
+    def write(
+        self,
+        pid: Optional[int] = None,
+        started: Optional[datetime] = None,
+        last_intensity: Optional[float] = None,
+        last_updated: Optional[datetime] = None,
+        cycle_num: Optional[int] = None,
+        finished: bool = False,
+        lateness: Optional[float] = None,
+        send_seconds: Optional[float] = None,
+    ) -> None:
+        """Updates the given fields (and the heartbeat) of the record.
+
+        A started other than the record's is a new run, the previous run's fields (intensity,
+        cycle, lateness and serial writes) are cleared so they aren't shown as the new run's.
+        send_seconds is the time a serial write took, it's counted into its bucket.
+        """
+        fields = self._fields
+        if pid is not None or finished:
+            fields[0] = 0 if finished else pid
+        if started is not None and _timestamp(started) != fields[1]:
+            fields[1:] = [0] * (len(fields) - 1)
+            fields[1] = _timestamp(started)
+        if last_intensity is not None:
+            fields[2] = float(last_intensity)
+        if last_updated is not None:
+            fields[3] = _timestamp(last_updated)
+        fields[4] = time.time()
+        if cycle_num is not None:
+            fields[5] = cycle_num
+        if lateness is not None:
+            fields[6] = lateness
+        if send_seconds is not None:
+            fields[7] += send_seconds
+            fields[_SEND_COUNTS_INDEX + bisect_left(SEND_BUCKETS, send_seconds)] += 1
+        self._sequence += 1
+        _SEQUENCE.pack_into(self._map, 0, self._sequence)
+        _FIELDS.pack_into(self._map, _FIELDS_OFFSET, *fields)
+        self._sequence += 1
+        _SEQUENCE.pack_into(self._map, 0, self._sequence)
+
+    def heartbeat(self) -> None:
+        """Records that the Light Controller is alive."""
+        self.write()
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class StatusReader:
+    """Reads the Light Controller's status record."""
+
+    __slots__ = ("_path", "_map")
+
+    def __init__(self, path: str = STATUS_PATH):
+        """Initializes the StatusReader class."""
+        self._path = path
+        self._map: Optional[mmap.mmap] = None
+
+    @property
+    def sequence(self) -> int:
+        """The record's sequence counter, it changes on every write."""
+        if not self._map:
+            return 0
+        return _SEQUENCE.unpack_from(self._map, 0)[0]
+
+    def read(self) -> Optional[ControllerStatus]:
+        """Returns a consistent snapshot of the record, None if it was never written."""
+        if not self._map:
+            if not os.path.exists(self._path):
+                return None
+            self._map = _open_record(self._path, mmap.ACCESS_READ)
+        for _ in range(_MAX_READ_ATTEMPTS):
+            before = _SEQUENCE.unpack_from(self._map, 0)[0]
+            if before % 2:
+                continue
+            fields = _FIELDS.unpack_from(self._map, _FIELDS_OFFSET)
+            if _SEQUENCE.unpack_from(self._map, 0)[0] == before:
+                break
+        else:
+            return None
+        if not before:
+            return None
+        pid, started, last_intensity, last_updated, heartbeat, cycle_num = fields[:6]
+        lateness, send_seconds = fields[6:_SEND_COUNTS_INDEX]
+        return ControllerStatus(
+            pid or None,
+            _datetime(started),
+            last_intensity,
+            _datetime(last_updated),
+            cycle_num,
+            heartbeat,
+            lateness,
+            send_seconds,
+            fields[_SEND_COUNTS_INDEX:],
+        )
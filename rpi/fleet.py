@@ -0,0 +1,155 @@
+"""Collects the status of every Raspberry Pi listed in data/devices.json for the fleet page.
+
+Every device is asked for its /api/status concurrently, over a kept alive connection per device,
+and the answers are cached for FLEET_CACHE_TTL seconds so many browsers on the fleet page cost
+one round of requests. A device that doesn't answer within FLEET_TIMEOUT is reported as offline
+and, if its request is still in flight at the next refresh, as its last known status, so a slow or
+offline Pi never holds up the page.
+
+Devices are keyed by ip address, or "host:port" for one not on DEVICE_PORT (e.g. a stub server
+standing in for a device, see tests/fleet_stub_server.py).
+"""
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Port the web app listens on.
+DEVICE_PORT: int = 5000
+# Seconds to wait for a device's status.
+FLEET_TIMEOUT: float = 2.0
+# Seconds a fleet status is reused before the devices are asked again.
+FLEET_CACHE_TTL: float = 5.0
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+class DeviceClient:
+    """Requests a device's status over a kept alive HTTP connection.
+
+    Attributes:
+        key (str): The device's key in devices.json.
+        info (dict): The device's name, description and location from devices.json.
+        last_status (dict): The device's last status, None before it first answered.
+    """
+
+    __slots__ = ("key", "info", "last_status", "_host", "_port", "_timeout", "_connection", "lock")
+
+    def __init__(self, key: str, info: dict, timeout: float = FLEET_TIMEOUT):
+        """Initializes the DeviceClient class."""
+        self.key = key
+        self.info = info
+        self.last_status: Optional[dict] = None
+        host, _, port = key.partition(":")
+        self._host = host
+        self._port = int(port) if port else DEVICE_PORT
+        self._timeout = timeout
+        self._connection: Optional[http.client.HTTPConnection] = None
+        # Held while a request is in flight, a connection carries one request at a time.
+        self.lock = threading.Lock()
+
+    def _get(self, path: str) -> dict:
+        if not self._connection:
+            self._connection = http.client.HTTPConnection(
+                self._host, self._port, timeout=self._timeout
+            )
+        self._connection.request("GET", path, headers={"Accept": "application/json"})
+        response = self._connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status}")
+        return json.loads(body)
+
+    def fetch(self) -> dict:
+        """Returns the device's status, or its error, timed in milliseconds."""
+        started = time.perf_counter()
+        try:
+            try:
+                status = self._get("/api/status")
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The device closed the kept alive connection, reconnect once.
+                self.close()
+                status = self._get("/api/status")
+            status["online"] = True
+            self.last_status = status
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            self.close()
+            status = {"online": False, "error": str(e) or type(e).__name__}
+        status["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return status
+
+    def close(self) -> None:
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+
+class FleetMonitor:
+    """Caches the status of every device in devices.json.
+
+    Attributes:
+        timeout (float): Seconds to wait for the devices' statuses.
+        ttl (float): Seconds a fleet status is reused.
+        updated (datetime): When the devices were last asked for their status.
+    """
+
+    def __init__(
+        self,
+        devices: Dict[str, dict],
+        timeout: float = FLEET_TIMEOUT,
+        ttl: float = FLEET_CACHE_TTL,
+    ):
+        """Initializes the FleetMonitor class."""
+        self.timeout = timeout
+        self.ttl = ttl
+        self._clients = [DeviceClient(key, info, timeout) for key, info in devices.items()]
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(len(self._clients), 1), thread_name_prefix="fleet"
+        )
+        self._lock = threading.Lock()
+        self._statuses: List[dict] = []
+        self._updated = float("-inf")
+        self.updated: Optional[datetime] = None
+
+    def _fetch(self, client: DeviceClient) -> dict:
+        try:
+            return client.fetch()
+        finally:
+            client.lock.release()
+
+    def _refresh(self) -> List[dict]:
+        """Asks every device for its status, waiting at most timeout for all of them."""
+        futures = {}
+        for client in self._clients:
+            # A device still answering the last refresh isn't asked again.
+            if client.lock.acquire(blocking=False):
+                futures[client.key] = self._executor.submit(self._fetch, client)
+        wait(futures.values(), timeout=self.timeout)
+        statuses = []
+        for client in self._clients:
+            future = futures.get(client.key)
+            if future and future.done():
+                status = future.result()
+            else:
+                status = dict(client.last_status or {})
+                status.update(online=False, error="timed out", latency_ms=None)
+                if client.last_status:
+                    status["stale"] = True
+            status.update(client.info, ip=client.key)
+            statuses.append(status)
+        return statuses
+
+    def statuses(self) -> List[dict]:
+        """Returns every device's status, from the cache if it's fresh."""
+        with self._lock:
+            if time.monotonic() - self._updated >= self.ttl:
+                self._statuses = self._refresh()
+                self._updated = time.monotonic()
+                self.updated = datetime.now()
+            return self._statuses
@@ -0,0 +1,122 @@
+"""Runs slow web app work (e.g. handing an uploaded profile to the lights) off the request thread.
+
+A request submits a job and returns straight away with the job's id. One worker thread runs the
+jobs in the order they were submitted, so two uploads never hand their profiles to the Light
+Controller at the same time. Pages poll the job's status (its state and current step) until it
+is done or failed.
+"""
+import logging
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+
+# Finished jobs remembered for status requests before the oldest are forgotten.
+MAX_FINISHED_JOBS: int = 50
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """Raised by a job to fail with a message meant for the user."""
+
+
+class Job:
+    """A unit of work run by a JobQueue.
+
+    Attributes:
+        id (str): Identifies the job in status requests.
+        name (str): What the job works on, e.g. the uploaded file's name.
+        state (str): "queued", "running", "done" or "failed".
+        step (str): What a running job is doing, set by the job itself.
+        error (str): Why a failed job failed.
+        submitted (datetime): When the job was submitted.
+        finished (datetime): When the job finished, None until then.
+    """
+
+    __slots__ = ("id", "name", "state", "step", "error", "submitted", "finished", "_work")
+
+    def __init__(self, name: str, work: Callable[["Job"], None]):
+        """Initializes the Job class."""
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.state = "queued"
+        self.step = ""
+        self.error: Optional[str] = None
+        self.submitted = datetime.now()
+        self.finished: Optional[datetime] = None
+        self._work = work
+
+    def to_dict(self) -> dict:
+        """Returns the job's status, e.g. for a json response."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "step": self.step,
+            "error": self.error,
+            "submitted": self.submitted.isoformat(timespec="seconds"),
+            "finished": self.finished.isoformat(timespec="seconds") if self.finished else None,
+        }
+
+
+class JobQueue:
+    """Runs submitted jobs one at a time on a worker thread.
+
+    Attributes:
+        max_finished (int): Finished jobs remembered for status requests.
+    """
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        """Initializes the JobQueue class."""
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._jobs: OrderedDict = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, name: str, work: Callable[[Job], None]) -> Job:
+        """Queues work, which is called with its Job, starting the worker if needed."""
+        job = Job(name, work)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="jobs", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        logger.info("Job %s queued for %s", job.id, name)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns the job with job_id, None if it's unknown or forgotten."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _forget_finished(self) -> None:
+        """Forgets the oldest finished jobs beyond max_finished, the lock must be held."""
+        finished = [job.id for job in self._jobs.values() if job.finished]
+        for job_id in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self) -> None:
+        """Runs queued jobs until the process exits."""
+        while True:
+            job = self._queue.get()
+            job.state = "running"
+            try:
+                job._work(job)
+                job.state = "done"
+            except JobError as e:
+                job.error = str(e)
+                job.state = "failed"
+                logger.info("Job %s for %s failed: %s", job.id, job.name, e)
+            except Exception as e:
+                job.error = f"Unexpected error: {e}"
+                job.state = "failed"
+                logger.exception("Job %s for %s failed", job.id, job.name)
+            job.finished = datetime.now()
@@ -2,49 +2,298 @@
 # check device port depending on your system (/dev/ttyACM0 and /dev/ttyACM1 are common)
 # viewable in Arduino IDE or `ls /dev/tty*`, set baudrate in IDE
 
+import fcntl
 import logging
 import os
+import re
+import tempfile
 import time
+from collections import deque
+from typing import Callable, Optional
 import serial
+from clock import SYSTEM_CLOCK
 
-# TODO: COMM_PORT should probably come by detection in the os or by a system variable that
-# can be set up by the reboot_climate_web_app.sh.
-COMM_PORT = "/dev/ttyACM0"
+# Set ARDUINO_PORT (e.g. in reboot_climate_web_app.sh) if the Arduino isn't /dev/ttyACM0, or to
+# "simulated" to run without one (see SimulatedArduino).
+COMM_PORT = os.environ.get("ARDUINO_PORT", "/dev/ttyACM0")
 BAUD_RATE = 9600
+# "ascii", which every version of arduino_lights_manager.ino reads, or "framed" (acknowledged)
+# once the Arduino runs the current sketch. Framed commands to an older sketch are never
+# acknowledged, so each one fails.
+ARDUINO_PROTOCOL = os.environ.get("ARDUINO_PROTOCOL", "ascii")
+FRAME_START = 0xAA
+ACK_START = 0x55
+ACK_STATUSES = {0: "applied", 1: "bad checksum", 2: "unknown channel"}
+# Seconds to wait for an ack. A frame and its ack take ~10 ms at 9600 baud.
+ACK_TIMEOUT = 0.05
+# Times a frame is sent before giving up on it.
+MAX_SEND_ATTEMPTS = 3
+# Seconds the Arduino takes to boot, opening the serial port resets it.
+ARDUINO_BOOT_SECONDS = 2
+# Where the lock files that stop two processes driving the same port are kept.
+PORT_LOCK_FOLDER = "/run/lock" if os.access("/run/lock", os.W_OK) else tempfile.gettempdir()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# class Arduino:
-#     """A dummy Arduino class to facilitate testing.
+class SimulatedArduino:
+    """Stands in for an Arduino running arduino_lights_manager.ino and records what it's sent.
 
-#     To use uncomment this class, comment out the `ARDUINO = serial.Serial...` line below,
-#     and uncomment the `ARDUINO = Arduino()` line below that.
-#     """
+    Frames are acknowledged and ASCII lines accepted as the sketch does, so it can replace the
+    serial object anywhere, e.g. to replay a run in virtual time (see simulate.py).
+
+    Attributes:
+        clock (SystemClock or VirtualClock): Timestamps the trace.
+        channels (int): The number of light channels (PWM pins).
+        trace (list): (time, channel, intensity) of every intensity applied.
+        timeout (float): Read timeout, reads never wait.
+    """
+
+    def __init__(self, clock=SYSTEM_CLOCK, channels: int = 1) -> None:
+        """Initializes the SimulatedArduino class."""
+        self.clock = clock
+        self.channels = channels
+        self.trace = []
+        self.timeout = None
+        self.is_open = True
+        self._frame = bytearray()
+        self._line = bytearray()
+        self._acks = bytearray()
+
+    def write(self, message: bytes) -> int:
+        for byte in message:
+            if self._frame:
+                self._frame.append(byte)
+                if len(self._frame) == 5:
+                    self._handle_frame(bytes(self._frame))
+                    self._frame.clear()
+            elif byte == FRAME_START and not self._line:
+                self._frame.append(byte)
+            elif byte == ord("\n"):
+                # Legacy ASCII value, channel 0. Like atoi(), "81.9" is 81.
+                if self._line:
+                    value = re.match(rb"\s*([-+]?\d+)", bytes(self._line))
+                    self._apply(0, int(value.group(1)) if value else 0)
+                self._line.clear()
+            elif len(self._line) < 7:
+                self._line.append(byte)
+        return len(message)
+
+    def _handle_frame(self, frame: bytes) -> None:
+        if checksum(frame[:4]) != frame[4]:
+            status = 1
+        elif frame[2] >= self.channels:
+            status = 2
+        else:
+            self._apply(frame[2], frame[3])
+            status = 0
+        ack = bytes((ACK_START, frame[1], status))
+        self._acks += ack + bytes((checksum(ack),))
+
+    def _apply(self, channel: int, intensity: int) -> None:
+        self.trace.append((self.clock.now(), channel, min(max(intensity, 0), 100)))
+
+    def read(self, size: int = 1) -> bytes:
+        data = bytes(self._acks[:size])
+        del self._acks[:size]
+        return data
+
+    def reset_input_buffer(self) -> None:
+        self._acks.clear()
+
+
+class PortLockedError(serial.SerialException):
+    """Another process holds the port's lock, it's already driving the lights."""
+
+
+# Lock files by port, held open for the life of the process.
+_PORT_LOCKS: dict = {}
+
+
+def lock_port(port: str = COMM_PORT) -> None:
+    """Takes an exclusive lock on port, so no other process drives its lights.
+
+    The lock is taken on a lock file rather than the port, as opening the port resets the
+    Arduino. It's held until the process exits (however it exits), so a killed Light Controller
+    never leaves its port locked.
+
+    Raises:
+        PortLockedError: If another process holds the port's lock.
+    """
+    if port in _PORT_LOCKS:
+        return
+    path = os.path.join(PORT_LOCK_FOLDER, f"climate_sim_{os.path.basename(port)}.lock")
+    lock_file = open(path, "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.seek(0)
+        holder = lock_file.read().strip() or "unknown"
+        lock_file.close()
+        raise PortLockedError(f"{port} is locked by pid {holder} ({path})") from None
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _PORT_LOCKS[port] = lock_file
+
+
+def open_arduino(port: str = COMM_PORT, baud_rate: int = BAUD_RATE) -> serial.Serial:
+    """Locks (see lock_port) and opens the serial port of an Arduino and waits for it to boot.
+
+    Raises:
+        PortLockedError: If another process is driving the port.
+        serial.SerialException: If the port can't be opened.
+    """
+    lock_port(port)
+    arduino = serial.Serial(port=port, baudrate=baud_rate)
+    # Opening the port resets the Arduino, values sent while it boots are lost.
+    time.sleep(ARDUINO_BOOT_SECONDS)
+    return arduino
+
+
+# The Arduino on COMM_PORT. It's opened by the first connect_arduino() rather than on import, as
+# opening the port resets the Arduino and takes ARDUINO_BOOT_SECONDS.
+_ARDUINO = None
 
-#     def __init__(self) -> None:
-#         self.is_open = True
 
-#     def write(self, message):
-#         print(f"Sent to Arduino: {message}")
+def connect_arduino():
+    """Returns the Arduino on COMM_PORT, opening it the first time.
 
+    Returns (serial object):
+        The Arduino's serial object (a SimulatedArduino if COMM_PORT is "simulated"), None if
+        the port can't be opened.
 
-try:
-    ARDUINO = serial.Serial(port=COMM_PORT, baudrate=BAUD_RATE)
-    # ARDUINO = Arduino()
-    IS_ARDUINO_SETUP = True
+    Raises:
+        PortLockedError: If another process is driving COMM_PORT (a simulated one included).
+    """
+    global _ARDUINO
+    if _ARDUINO is None:
+        try:
+            if COMM_PORT == "simulated":
+                lock_port(COMM_PORT)
+                _ARDUINO = SimulatedArduino()
+            else:
+                _ARDUINO = open_arduino()
+        except PortLockedError:
+            raise
+        except Exception as e:
+            logger.error("Could not open the Arduino on %s: %s", COMM_PORT, e)
+    return _ARDUINO
+
+
+class ArduinoDeliveryError(IOError):
+    """An intensity was not acknowledged by the Arduino."""
+
+
+def checksum(data: bytes) -> int:
+    """Returns the checksum of a frame or ack: the sum of its bytes, modulo 256."""
+    return sum(data) & 0xFF
+
+
+class FramedArduinoWriter:
+    """Sends intensities to the Arduino as acknowledged frames and measures their latency.
+
+    A frame is [0xAA, sequence, channel, value, checksum] and the Arduino answers, once the new
+    PWM is out, with [0x55, sequence, status, checksum]. A frame that isn't acknowledged within
+    ack_timeout is sent again.
+
+    Attributes:
+        arduino (serial object): Serial object for the Arduino controlling the lights.
+        ack_timeout (float): Seconds to wait for an ack.
+        max_attempts (int): Times a frame is sent before giving up on it.
+        round_trips (deque): Seconds from first sending to the ack of recent deliveries.
+    """
+
+    def __init__(
+        self,
+        arduino,
+        ack_timeout: float = ACK_TIMEOUT,
+        max_attempts: int = MAX_SEND_ATTEMPTS,
+    ):
+        """Initializes the FramedArduinoWriter class."""
+        self.arduino = arduino
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        self.round_trips = deque(maxlen=1000)
+        self._sequence = 0
+
+    def send(self, val, channel: int = 0) -> float:
+        """Sends an intensity and waits for the Arduino to apply it.
 
-except Exception as e:
-    print(f"Error was: {e}")
-    ARDUINO = None
-    IS_ARDUINO_SETUP = False
+        Arguments:
+            val(float): Intensity from 0 to 100, rounded to an int.
+            channel(int): Light channel of the Arduino.
 
+        Returns (float):
+            Seconds from first sending the frame to receiving its ack.
 
-def flash_lights_thrice(arduino=ARDUINO):
+        Raises:
+            ArduinoDeliveryError: If no attempt was acknowledged.
+        """
+        self._sequence = (self._sequence + 1) & 0xFF
+        frame = bytes(
+            (FRAME_START, self._sequence, channel, min(max(int(round(val)), 0), 100))
+        )
+        frame += bytes((checksum(frame),))
+        status = None
+        started = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            # Acks of earlier frames that timed out would be mistaken for this one's.
+            self.arduino.reset_input_buffer()
+            sent = time.perf_counter()
+            self.arduino.write(frame)
+            status = self._read_ack(self._sequence, sent + self.ack_timeout)
+            if status == 0:
+                # Including any retries, it's the delay the lights saw.
+                round_trip = time.perf_counter() - started
+                self.round_trips.append(round_trip)
+                logger.debug(
+                    "Arduino applied %s in %.1f ms (attempt %s)",
+                    frame[3], round_trip * 1000, attempt,
+                )
+                return round_trip
+            logger.warning(
+                "Arduino did not apply %s (attempt %s): %s",
+                frame[3], attempt, ACK_STATUSES.get(status, "no ack"),
+            )
+        raise ArduinoDeliveryError(
+            f"Arduino did not acknowledge intensity {frame[3]} after "
+            f"{self.max_attempts} attempts: {ACK_STATUSES.get(status, 'no ack')}"
+        )
+
+    def _read_ack(self, sequence: int, deadline: float) -> Optional[int]:
+        """Returns the status of the ack for sequence, None if none arrived by deadline."""
+        ack = b""
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            self.arduino.timeout = remaining
+            ack += self.arduino.read(4 - len(ack))
+            # Resynchronize on the start byte if there was line noise.
+            start = ack.find(ACK_START)
+            ack = ack[start:] if start >= 0 else b""
+            if len(ack) == 4:
+                if checksum(ack[:3]) == ack[3] and ack[1] == sequence:
+                    return ack[2]
+                ack = ack[1:]
+
+
+# One writer per serial port, so each keeps its own sequence numbers.
+_WRITERS: dict = {}
+
+
+def flash_lights_thrice(
+    arduino,
+    sleep: Callable[[float], None] = time.sleep,
+    sent: Optional[Callable[[int], None]] = None,
+):
     """Used to inform user of a successful action by flashing pond lights 3x
 
     Arguments:
         arduino(serial object): Serial object for the Arduino controlling the lights.
+        sleep(callable): Sleeps between flashes, e.g. a virtual clock's sleep.
+        sent(callable): Called with each intensity once it's sent, e.g. to record it.
 
     Returns:
         None
@@ -53,28 +302,37 @@ def flash_lights_thrice(arduino=ARDUINO):
 
     for i in range(3):
         logger.info("Flash light...%s", arduino)
-        send_to_arduino(100, arduino)
-        time.sleep(0.5)
-        send_to_arduino(0, arduino)
-        time.sleep(0.5)
+        for intensity in (100, 0):
+            send_to_arduino(intensity, arduino)
+            if sent:
+                sent(intensity)
+            sleep(0.5)
     return
 
 
-def send_to_arduino(val, arduino=ARDUINO):
+def send_to_arduino(val, arduino):
     """Sends a value to the Arduino to control the lights
 
     Arguments:
-        arduino(serial object): Serial object for the Arduino controlling the lights.
         val(float): Value to send to the Arduino, cast this as int
+        arduino(serial object): Serial object for the Arduino controlling the lights, None to
+            send nothing.
 
-    Returns:
-        None
-        Sends the value to the Arduino.
+    Returns (float):
+        Seconds until the Arduino acknowledged the value with the framed protocol, otherwise
+        None. Delivery failures are logged rather than raised so the lights keep being
+        controlled.
     """
-    if IS_ARDUINO_SETUP:
+    if arduino is None:
+        return None
+    if ARDUINO_PROTOCOL != "framed":
         arduino.write(bytes(f"{val}\n", "utf-8"))
-    return
-
-
-if ARDUINO and ARDUINO.is_open:
-    flash_lights_thrice()
+        return None
+    writer = _WRITERS.get(id(arduino))
+    if writer is None:
+        writer = _WRITERS[id(arduino)] = FramedArduinoWriter(arduino)
+    try:
+        return writer.send(val)
+    except (ArduinoDeliveryError, serial.SerialException) as e:
+        logger.error("Failed to send %s to the Arduino: %s", val, e)
+        return None
@@ -0,0 +1,155 @@
+"""Pushes the Light Controller's intensity changes and heartbeats to browsers (Server-Sent Events).
+
+A single watcher thread polls the Light Controller's status record (see controller_status.py)
+and formats each event once for every subscriber. Many browsers watching the 'live' page
+therefore cost about the same as one.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Iterator, Optional
+
+from controller_status import StatusReader
+
+# Seconds between checks for a new intensity, bounds the latency to the browser.
+POLL_INTERVAL: float = 0.1
+# Seconds between heartbeat events, which also keep proxies from closing idle streams.
+EVENT_HEARTBEAT_INTERVAL: float = 5.0
+# Events queued for a subscriber that isn't reading before it is dropped.
+MAX_QUEUED_EVENTS: int = 100
+# Queued in place of an event to end a dropped subscriber's stream.
+_CLOSE = None
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+def format_event(event: str, data: dict) -> str:
+    """Returns an event formatted for a text/event-stream."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class LiveEventBroadcaster:
+    """Watches the Light Controller and broadcasts events to subscribed browsers.
+
+    Attributes:
+        poll_interval (float): Seconds between checks for a new intensity.
+        heartbeat_interval (float): Seconds between heartbeat events.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = POLL_INTERVAL,
+        heartbeat_interval: float = EVENT_HEARTBEAT_INTERVAL,
+    ):
+        """Initializes the LiveEventBroadcaster class."""
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._lock = threading.Lock()
+        self._subscribers: set = set()
+        self._thread: Optional[threading.Thread] = None
+        # The last intensity event, sent to new subscribers straight away.
+        self._last_event: Optional[str] = None
+
+    def subscribe(self) -> queue.Queue:
+        """Returns a queue that receives formatted events, starting the watcher if needed."""
+        subscriber: queue.Queue = queue.Queue(maxsize=MAX_QUEUED_EVENTS)
+        with self._lock:
+            if self._last_event:
+                subscriber.put_nowait(self._last_event)
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._watch, name="live-events", daemon=True
+                )
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        """Stops sending events to subscriber."""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stream(self) -> Iterator[str]:
+        """Yields formatted events for one browser until it disconnects or is dropped.
+
+        Ending the response when the subscriber is dropped frees the worker thread, and
+        the browser's EventSource reconnects with a fresh queue.
+        """
+        subscriber = self.subscribe()
+        try:
+            while True:
+                message = subscriber.get()
+                if message is _CLOSE:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def publish(self, event: str, data: dict) -> None:
+        """Sends an event to every subscriber."""
+        message = format_event(event, data)
+        with self._lock:
+            if event == "intensity":
+                self._last_event = message
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    logger.info("Dropping a live event subscriber that stopped reading.")
+                    self._subscribers.discard(subscriber)
+                    self._close(subscriber)
+
+    @staticmethod
+    def _close(subscriber: queue.Queue) -> None:
+        """Ends a dropped subscriber's stream, making room for the close sentinel."""
+        try:
+            subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            subscriber.put_nowait(_CLOSE)
+        except queue.Full:
+            pass
+
+    def _watch(self) -> None:
+        """Publishes intensity changes and heartbeats while there are subscribers."""
+        reader = StatusReader()
+        last_state = None
+        last_heartbeat = 0.0
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # Cleared under the lock so the next subscribe() starts a new watcher.
+                    self._thread = None
+                    return
+            status = reader.read()
+            if status:
+                state = (status.last_intensity, status.last_updated)
+                if state != last_state:
+                    last_state = state
+                    self.publish(
+                        "intensity",
+                        {
+                            "intensity": int(status.last_intensity),
+                            "last_updated": status.last_updated.isoformat(
+                                timespec="seconds"
+                            ) if status.last_updated else None,
+                            "pid": status.pid,
+                            "cycle_num": status.cycle_num,
+                        },
+                    )
+            now = time.monotonic()
+            if now - last_heartbeat >= self.heartbeat_interval:
+                last_heartbeat = now
+                self.publish(
+                    "heartbeat",
+                    {
+                        "pid": status.pid if status else None,
+                        "alive": status.alive if status else False,
+                    },
+                )
+            time.sleep(self.poll_interval)
@@ -0,0 +1,132 @@
+"""Renders the 'live' profile plot for the web app.
+
+Drawing the whole figure (profile curve, grid, labels) on every view of /live is slow on a
+Raspberry Pi. The profile layer only changes when the profile or its cycle changes, so it is
+drawn once and its pixels cached. Each render restores those pixels and draws only the
+"Last Update" line and annotations over them. Renders are rate limited so that viewers
+arriving together share one image.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+import numpy as np
+
+from climate_web_utilities import (
+    PLOT_SECONDS,
+    SAVEFIG_SECONDS,
+    ClimateConfig,
+    draw_now_layer,
+    draw_profile_layer,
+    expand_profile_points,
+    live_cycle_position,
+    live_schedule,
+)
+from profile_cache import load_profile
+
+# Seconds a rendered live plot is reused before another render is allowed.
+MIN_RENDER_INTERVAL: float = 1.0
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+class LivePlotRenderer:
+    """Renders live plots from a cached profile layer and a per render "now" overlay.
+
+    Attributes:
+        min_interval (float): Seconds a rendered image is reused for.
+    """
+
+    def __init__(self, min_interval: float = MIN_RENDER_INTERVAL):
+        """Initializes the LivePlotRenderer class."""
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        # The cached profile layer: its key, figure, pixels and the run's schedule.
+        self._layer_key: Optional[tuple] = None
+        self._figure = None
+        self._background = None
+        self._schedule = None
+        self._expanded = None
+        # The last rendered image, its ETag, when it was rendered and what it showed.
+        self._png: bytes = b""
+        self._etag: str = ""
+        self._rendered_at: float = 0.0
+        self._overlay_key: Optional[tuple] = None
+
+    def render(self, config: ClimateConfig) -> Tuple[bytes, str]:
+        """Returns the live plot of config as a PNG and its ETag."""
+        with self._lock:
+            profile, df = self._profile(config)
+            schedule = live_schedule(profile, config)
+            now, cycle_num, cycle_start, completed = live_cycle_position(schedule, config)
+            layer_key = (
+                profile.digest,
+                config.profile_filename,
+                config.started,
+                config.run_continuously,
+                cycle_num,
+                completed,
+            )
+            overlay_key = (layer_key, now, config.last_intensity)
+            if overlay_key == self._overlay_key or (
+                layer_key == self._layer_key
+                and time.monotonic() - self._rendered_at < self.min_interval
+            ):
+                return self._png, self._etag
+            with PLOT_SECONDS.time("live"):
+                if layer_key != self._layer_key:
+                    self._draw_layer(layer_key, config, df, cycle_start, cycle_num, completed)
+                self._schedule = schedule
+                self._png = self._draw_overlay(now, config)
+            self._etag = hashlib.md5(self._png).hexdigest()
+            self._rendered_at = time.monotonic()
+            self._overlay_key = overlay_key
+            return self._png, self._etag
+
+    def _profile(self, config: ClimateConfig):
+        """Returns the compiled and expanded profile of config's profile."""
+        profile = load_profile(config._profile_filepath)
+        if self._layer_key and self._layer_key[0] == profile.digest:
+            return profile, self._expanded
+        self._expanded = expand_profile_points(profile.to_frame())
+        return profile, self._expanded
+
+    def _draw_layer(self, layer_key, config, df, cycle_start, cycle_num, completed):
+        """Draws and caches the profile layer."""
+        start = time.perf_counter()
+        self._figure = draw_profile_layer(
+            config._profile_filepath, df, cycle_start, cycle_num, config, completed
+        )
+        self._figure.canvas.draw()
+        self._background = self._figure.canvas.copy_from_bbox(self._figure.bbox)
+        self._layer_key = layer_key
+        logger.info(
+            "Live plot profile layer drawn in %.2fs", time.perf_counter() - start
+        )
+
+    def _draw_overlay(self, now: datetime, config: ClimateConfig) -> bytes:
+        """Draws the "now" overlay over the cached profile layer and returns it as a PNG."""
+        import matplotlib.image as mpimg
+
+        canvas = self._figure.canvas
+        ax = self._figure.axes[0]
+        canvas.restore_region(self._background)
+        artists = draw_now_layer(
+            ax, now, self._schedule.cycle_dur, config, self._schedule.intensity_at(now)
+        )
+        for artist in artists:
+            ax.draw_artist(artist)
+        pixels = np.asarray(canvas.buffer_rgba()).copy()
+        # Remove the overlay so the next render starts from the profile layer alone.
+        for artist in artists:
+            artist.remove()
+        png = io.BytesIO()
+        with SAVEFIG_SECONDS.time("live"):
+            mpimg.imsave(png, pixels, format="png", dpi=self._figure.dpi)
+        return png.getvalue()
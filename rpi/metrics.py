@@ -0,0 +1,238 @@
+"""Times the web app's and Light Controller's hot paths and exports them for Prometheus.
+
+GET /metrics returns every metric registered here in the Prometheus text format: histograms of
+how long profiles take to parse, expand and plot, how long configs take to save and load and
+how long each web page takes to serve, and gauges of the Light Controller's state. The Light
+Controller is a process of its own, so its metrics (e.g. how long each serial write takes) are
+kept in its status record (see controller_status.py) and read from there when scraped.
+
+Observing a histogram is a bisect and two additions, and a scrape only formats the counts, so
+metrics are on by default. Set METRICS=0 to turn them off: timed() then returns functions
+unwrapped and Histogram.time() does nothing, so the instrumentation costs nothing.
+
+Only the standard library is used so the Light Controller stays light.
+"""
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED: bool = os.environ.get("METRICS", "1") != "0"
+# Upper bounds (seconds) of the latency histograms' buckets, Prometheus's defaults and a minute
+# for parsing the largest profiles.
+LATENCY_BUCKETS: tuple = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+# Every metric exported by /metrics, in the order they are registered.
+REGISTRY: list = []
+
+
+def _escape(value: str) -> str:
+    """Returns a label value escaped for the text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Returns the label set of a sample, e.g. '{route="/live",le="0.5"}'."""
+    pairs = [
+        '%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def format_histogram(
+    name: str,
+    documentation: str,
+    buckets: Sequence[float],
+    series: Iterable[Tuple[Sequence[str], Sequence[float], float]],
+    label_names: Sequence[str] = (),
+) -> List[str]:
+    """Returns the exposition lines of a histogram.
+
+    Arguments:
+        name (str): The metric's name.
+        documentation (str): The metric's help text.
+        buckets (Sequence[float]): The buckets' upper bounds, ascending.
+        series (Iterable): (label values, count in each bucket and above the last, sum) of each
+            label set. Counts are per bucket, not cumulative.
+        label_names (Sequence[str]): The names of the label values.
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    for values, counts, total in series:
+        cumulative = 0
+        for bound, count in zip([repr(float(bound)) for bound in buckets] + ["+Inf"], counts):
+            cumulative += count
+            labels = _labels(label_names, values, 'le="%s"' % bound)
+            lines.append(f"{name}_bucket{labels} {cumulative:.0f}")
+        lines.append(f"{name}_sum{_labels(label_names, values)} {total!r}")
+        lines.append(f"{name}_count{_labels(label_names, values)} {cumulative:.0f}")
+    return lines
+
+
+class Histogram:
+    """Durations (or other values) counted into buckets, by label values.
+
+    Attributes:
+        name (str): The metric's name.
+        documentation (str): The metric's help text.
+        buckets (tuple): The buckets' upper bounds, ascending.
+        label_names (tuple): The names of the labels observations are split by.
+    """
+
+    __slots__ = ("name", "documentation", "buckets", "label_names", "_series", "_lock")
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        label_names: Sequence[str] = (),
+    ):
+        """Initializes the Histogram class and registers it for /metrics."""
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        # Per bucket counts (and the count above the last bucket), then the sum, by label values.
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """Counts value into its bucket of the label values' series."""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values: str):
+        """Observes the seconds the with block takes, nothing is timed if metrics are off."""
+        if not METRICS_ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def exposition(self) -> List[str]:
+        """Returns the histogram's lines of the Prometheus text format."""
+        with self._lock:
+            series = [(values, s[:-1], s[-1]) for values, s in sorted(self._series.items())]
+        return format_histogram(
+            self.name, self.documentation, self.buckets, series, self.label_names
+        )
+
+
+class ExternalHistogram:
+    """A histogram counted by another process, e.g. the Light Controller, read when scraped.
+
+    Attributes:
+        name (str): The metric's name.
+        documentation (str): The metric's help text.
+        buckets (tuple): The buckets' upper bounds, ascending.
+    """
+
+    __slots__ = ("name", "documentation", "buckets", "_read")
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float],
+        read: Callable[[], Optional[Tuple[Sequence[float], float]]],
+    ):
+        """Initializes the ExternalHistogram class and registers it for /metrics.
+
+        Arguments:
+            read (Callable): Returns the per bucket counts (and the count above the last
+                bucket) and the sum, None if there are none.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._read = read
+        REGISTRY.append(self)
+
+    def exposition(self) -> List[str]:
+        """Returns the histogram's lines of the Prometheus text format."""
+        values = self._read()
+        series = [((), values[0], values[1])] if values else []
+        return format_histogram(self.name, self.documentation, self.buckets, series)
+
+
+class Gauge:
+    """A value read when scraped, e.g. from the Light Controller's status record.
+
+    Attributes:
+        name (str): The metric's name.
+        documentation (str): The metric's help text.
+    """
+
+    __slots__ = ("name", "documentation", "_read", "_type")
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        read: Callable[[], Optional[float]],
+        counter: bool = False,
+    ):
+        """Initializes the Gauge class and registers it for /metrics.
+
+        Arguments:
+            read (Callable): Returns the value, None if there isn't one.
+            counter (bool): Whether the value only ever goes up, it's exported as a counter.
+        """
+        self.name = name
+        self.documentation = documentation
+        self._read = read
+        self._type = "counter" if counter else "gauge"
+        REGISTRY.append(self)
+
+    def exposition(self) -> List[str]:
+        """Returns the gauge's lines of the Prometheus text format."""
+        value = self._read()
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self._type}"]
+        if value is not None:
+            lines.append(f"{self.name} {float(value)!r}")
+        return lines
+
+
+def timed(histogram: Histogram, *label_values: str) -> Callable:
+    """Decorates a function so every call is observed by histogram, or not at all if metrics
+    are off."""
+
+    def decorator(func: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *label_values)
+
+        return wrapper
+
+    return decorator
+
+
+def exposition() -> str:
+    """Returns every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.exposition())
+    return "\n".join(lines) + "\n"
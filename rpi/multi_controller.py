@@ -0,0 +1,274 @@
+"""Runs light profiles on any number of light channels from a single asyncio process.
+
+control_lights.py runs one profile on one Arduino in a process of its own. This controller runs
+the channels listed in {CHANNELS_PATH}, e.g. several ponds each on their own Arduino or several
+PWM pins of one Arduino, as coroutines of one process:
+
+    {
+        "pond_a": {"port": "/dev/ttyACM0", "channel": 0, "profile": "default_profiles/a.xlsx"},
+        "pond_b": {"port": "/dev/ttyACM1", "channel": 0, "profile": "default_profiles/b.csv",
+                   "run_continuously": false, "started": "2025-06-01T06:00:00"}
+    }
+
+"port" defaults to ARDUINO_PORT, "channel" (the Arduino's PWM pin, see arduino_lights_manager.ino)
+to 0 and "run_continuously" to true. A channel without "started" starts now and the time is saved
+back to the file, so a restarted controller resumes every channel where it was.
+
+Compiled profiles are read into compact arrays (see profile_format.py), so each channel only adds
+its coroutine and schedule to the process. Neither numpy nor pandas is imported unless a
+channel's profile wasn't compiled by the web app, which is then compiled (with numpy) first. Commands
+to one serial port are sent one at a time, using ARDUINO_PROTOCOL (see light_utilities.py). The
+default, "ascii", can only address channel 0, so a channels file using other channels needs
+ARDUINO_PROTOCOL=framed and Arduinos reflashed with the current sketch, and is refused otherwise.
+Each channel reports its state in {STATUS_FOLDER}/channel_<name>_status.bin (see
+controller_status.py) and appends what it sends to {HISTORY_FOLDER}/<name>/ (see run_history.py).
+
+Usage: python3 rpi/multi_controller.py [channels.json]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import serial
+
+from clock import RunClock
+from controller_status import HEARTBEAT_INTERVAL, StatusWriter
+from light_utilities import (
+    ARDUINO_PROTOCOL,
+    COMM_PORT,
+    ArduinoDeliveryError,
+    FramedArduinoWriter,
+    connect_arduino,
+    open_arduino,
+    send_to_arduino,
+)
+from profile_format import ProfileArrays, ProfileSchedule, load_arrays
+from run_history import HISTORY_FOLDER, RunHistory
+
+RPI_FOLDER: str = os.path.dirname(os.path.abspath(__file__))
+CHANNELS_PATH: str = os.path.join(RPI_FOLDER, "data/channels.json")
+STATUS_FOLDER: str = os.path.join(RPI_FOLDER, "static/live")
+# Seconds between recalculating the intensity during a ramp (as control_lights.py).
+RAMP_TICK_SECONDS: float = float(os.environ.get("RAMP_TICK_SECONDS", 1.0))
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+class ArduinoPort:
+    """A serial port shared by the channels of one Arduino.
+
+    Attributes:
+        port (str): The serial port, e.g. /dev/ttyACM0.
+    """
+
+    __slots__ = ("port", "_arduino", "_writer", "_lock")
+
+    def __init__(self, port: str):
+        """Initializes the ArduinoPort class."""
+        self.port = port
+        arduino = connect_arduino() if port == COMM_PORT else None
+        # open_arduino raises if the port can't be opened.
+        self._arduino = arduino if arduino is not None else open_arduino(port)
+        # None to send ASCII lines, which only reach channel 0 and aren't acknowledged.
+        self._writer = (
+            FramedArduinoWriter(self._arduino) if ARDUINO_PROTOCOL == "framed" else None
+        )
+        self._lock = asyncio.Lock()
+
+    async def send(self, intensity: float, channel: int) -> Optional[float]:
+        """Sends an intensity to a channel, returns the round trip in seconds or None if it failed."""
+        async with self._lock:
+            try:
+                # A serial write (and waiting for the ack) blocks, so it's done off the event
+                # loop and the other channels keep to their schedules.
+                if self._writer is None:
+                    return await asyncio.get_running_loop().run_in_executor(
+                        None, send_to_arduino, intensity, self._arduino
+                    )
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, self._writer.send, intensity, channel
+                )
+            except (ArduinoDeliveryError, serial.SerialException) as e:
+                logger.error("Failed to send %s to %s channel %s: %s",
+                             intensity, self.port, channel, e)
+                return None
+
+
+class Channel:
+    """A light channel running a profile.
+
+    Attributes:
+        name (str): The channel's name in the channels file.
+        port (ArduinoPort): The serial port of the channel's Arduino.
+        number (int): The Arduino's channel (PWM pin) number.
+        profile (ProfileArrays): The profile being run.
+        started (datetime): The start time of the run.
+        run_continuously (bool): Whether the profile loops.
+        status (StatusWriter): The channel's status record.
+        history (RunHistory): The channel's run history.
+    """
+
+    __slots__ = (
+        "name",
+        "port",
+        "number",
+        "profile",
+        "started",
+        "run_continuously",
+        "status",
+        "history",
+        "_last_intensity",
+        "_cycle_num",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        port: ArduinoPort,
+        number: int,
+        profile: ProfileArrays,
+        started: datetime,
+        run_continuously: bool = True,
+    ):
+        """Initializes the Channel class."""
+        self.name = name
+        self.port = port
+        self.number = number
+        self.profile = profile
+        self.started = started
+        self.run_continuously = run_continuously
+        self.status = StatusWriter(os.path.join(STATUS_FOLDER, f"channel_{name}_status.bin"))
+        self.status.write(pid=os.getpid(), started=started)
+        self.history = RunHistory(os.path.join(HISTORY_FOLDER, name))
+        self._last_intensity = None
+        self._cycle_num = 0
+
+    async def _update(self, now: datetime, intensity: float) -> None:
+        """Sends an intensity if it changed and reports it."""
+        if intensity == self._last_intensity:
+            return
+        logger.info("%s: %s channel %s light intensity to %s.",
+                    now.strftime("%m/%d %H:%M:%S"),
+                    "Initializing" if self._last_intensity is None else "Updating",
+                    self.name, intensity)
+        await self.port.send(intensity, self.number)
+        self.history.append(intensity, self.profile.digest, os.getpid(), now.timestamp())
+        self.status.write(
+            last_intensity=intensity,
+            last_updated=now - timedelta(microseconds=now.microsecond),
+            cycle_num=self._cycle_num,
+        )
+        self._last_intensity = intensity
+
+    async def run(self) -> None:
+        """Runs the profile until it completes, or forever if it loops."""
+        schedule = ProfileSchedule(self.profile, self.started, self.run_continuously)
+        # Timed by the monotonic clock and re-anchored on a wall clock jump, as control_lights.py.
+        run_clock = RunClock()
+        now = run_clock.now()
+        controlling = not schedule.completed(now)
+        while controlling:
+            # The intensity in effect now, the last row only marks the end of the cycle.
+            self._cycle_num, cycle_start = schedule.cycle_at(now)
+            await self._update(now, schedule.intensity_at(now))
+            # Sleep until the next intensity change or the next tick of a ramp.
+            wake_time = schedule.next_transition(now, RAMP_TICK_SECONDS)
+            if wake_time is None:
+                # Woke after the end of a run that doesn't loop.
+                break
+            await asyncio.sleep(max((wake_time - run_clock.now()).total_seconds(), 0))
+            jump = run_clock.check_wall()
+            now = run_clock.now()
+            if jump is not None:
+                logger.warning("Channel %s: the wall clock jumped by %+.3f s, following it.",
+                               self.name, jump)
+                # The run clock moved, the row in effect is looked up again.
+                continue
+            if wake_time >= cycle_start + schedule.cycle_dur:
+                controlling = self.run_continuously
+        await self._update(now, self.profile.intensities[-1])
+        logger.info("Channel %s finished its profile.", self.name)
+        self.status.write(finished=True)
+
+    def close(self) -> None:
+        self.status.close()
+        self.history.close()
+
+
+def load_channels(path: str = CHANNELS_PATH) -> dict:
+    """Reads the channels file, saving a start time for channels that don't have one."""
+    with open(path, "r", encoding="utf-8") as infile:
+        channels = json.load(infile)
+    unstarted = [name for name, settings in channels.items() if not settings.get("started")]
+    if unstarted:
+        now = datetime.now().isoformat(timespec="seconds")
+        for name in unstarted:
+            channels[name]["started"] = now
+        # Written to a temporary file and renamed so a crash never leaves a partial file.
+        with open(path + ".tmp", "w", encoding="utf-8") as outfile:
+            json.dump(channels, outfile, indent=4)
+        os.replace(path + ".tmp", path)
+    return channels
+
+
+async def _heartbeat(channels: list) -> None:
+    """Refreshes the heartbeat of every channel's status record."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        for channel in channels:
+            channel.status.heartbeat()
+
+
+async def run_channels(channels: dict) -> None:
+    """Runs every channel's profile concurrently until all have completed.
+
+    Arguments:
+        channels (dict): Settings of each channel by name, as in the channels file.
+
+    Raises:
+        ValueError: If a channel has no profile, or uses a channel other than 0 without
+            ARDUINO_PROTOCOL=framed.
+    """
+    ports: Dict[str, ArduinoPort] = {}
+    running = []
+    # Checked before any port is opened or status record written.
+    for name, settings in channels.items():
+        if "profile" not in settings:
+            raise ValueError(f"Channel {name} has no profile.")
+        if ARDUINO_PROTOCOL != "framed" and int(settings.get("channel", 0)) != 0:
+            raise ValueError(
+                f"Channel {name} uses Arduino channel {settings['channel']}, which needs "
+                "ARDUINO_PROTOCOL=framed and the Arduino reflashed with the current sketch."
+            )
+    for name, settings in channels.items():
+        port = settings.get("port", COMM_PORT)
+        if port not in ports:
+            ports[port] = ArduinoPort(port)
+        profile_path = os.path.join(RPI_FOLDER, settings["profile"])
+        running.append(
+            Channel(
+                name,
+                ports[port],
+                int(settings.get("channel", 0)),
+                load_arrays(profile_path),
+                datetime.fromisoformat(settings["started"]),
+                bool(settings.get("run_continuously", True)),
+            )
+        )
+    logger.info("Running %s channels on %s serial ports.", len(running), len(ports))
+    heartbeat = asyncio.ensure_future(_heartbeat(running))
+    try:
+        await asyncio.gather(*(channel.run() for channel in running))
+    finally:
+        heartbeat.cancel()
+        for channel in running:
+            channel.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_channels(load_channels(sys.argv[1] if len(sys.argv) > 1 else CHANNELS_PATH)))
@@ -0,0 +1,94 @@
+"""Caches profile preview images on disk, keyed by the profile's content digest.
+
+The viewer used to draw every preview into one shared static/plot.png, so two people previewing
+at once overwrote each other's plots and viewing the same file again drew it again. A preview
+is now saved as <digest>.png, named by the hash of the profile it shows (see
+profile_format.profile_digest), so it never changes and can be cached by browsers for good.
+The cache is bounded by the total size of its images, the least recently used are deleted
+first.
+"""
+import logging
+import os
+import re
+import threading
+from glob import glob
+from typing import Callable
+
+PREVIEW_FOLDER_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static/previews"
+)
+# Total bytes of cached previews kept before the least recently used are deleted.
+MAX_PREVIEW_BYTES: int = 16 * 2**20
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+class PreviewCache:
+    """Preview PNGs of profiles, bounded by their total size.
+
+    Attributes:
+        folder (str): Where the previews are saved.
+        max_bytes (int): Total size of the previews kept.
+    """
+
+    def __init__(self, folder: str = PREVIEW_FOLDER_PATH, max_bytes: int = MAX_PREVIEW_BYTES):
+        """Initializes the PreviewCache class."""
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, digest: str) -> str:
+        """Returns the path of the preview of the profile named by digest.
+
+        Raises:
+            FileNotFoundError: If digest isn't a profile digest.
+        """
+        if not re.fullmatch(r"[0-9a-f]{16}", digest):
+            raise FileNotFoundError(f"Not a profile digest: {digest}")
+        return os.path.join(self.folder, f"{digest}.png")
+
+    def get_or_render(self, digest: str, render: Callable[[], bytes]) -> str:
+        """Returns the path of digest's preview, saving render()'s PNG first if there isn't one.
+
+        Raises:
+            FileNotFoundError: If digest isn't a profile digest, or render raises it.
+        """
+        path = self.path(digest)
+        with self._lock:
+            try:
+                # Mark the preview as recently used.
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                pass
+            png = render()
+            os.makedirs(self.folder, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as outfile:
+                outfile.write(png)
+            # Atomic so a preview being served is never a partial file.
+            os.replace(tmp_path, path)
+            logger.info("Cached preview %s (%s bytes)", path, len(png))
+            self.evict()
+        return path
+
+    def evict(self) -> None:
+        """Deletes the least recently used previews until they total at most max_bytes."""
+        entries = []
+        for path in glob(os.path.join(self.folder, "*.png")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                logger.info("Evicted preview: %s", path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,535 @@
+"""Compiles light profiles into a compact binary form shared by the web app and Light Controller.
+
+Parsing a profile spreadsheet (openpyxl) is the slowest step in handling a profile, and the
+same file used to be parsed by the validity check, the plots and the Light Controller. A
+profile is now parsed once and saved to compiled_path(<digest>) (see profile_format.py) where
+<digest> is a hash of the file's contents. The .npy holds a 3 x n float64 array: the seconds
+since the start of the profile, the light intensity and whether the row starts a ramp (1) or a
+step (0). Every consumer memory maps that file instead of reading the spreadsheet, or reads it
+with profile_format.py, which the Light Controller uses to avoid importing numpy and pandas.
+
+A profile is compacted as it's parsed (see parse_profile), so the arrays, and the memory used to
+compile them, hold the profile's transitions rather than every row of its spreadsheet, and the
+controller and plots step through only those. The rows of the source file follow the arrays as a second .npy array, so the
+compression can be reported.
+
+A profile's optional 3rd column gives each row's segment type. A 'step' (the default) holds the
+row's intensity until the next row. A 'ramp' changes linearly from the row's intensity to the
+next row's, so a sunrise needs two rows rather than one per minute.
+"""
+import csv
+import logging
+import os
+import re
+import zipfile
+from array import array
+from datetime import datetime, time, timedelta
+from glob import glob
+from typing import Iterator, NamedTuple, Optional, Tuple, Union
+from xml.etree import ElementTree
+
+import numpy as np
+
+from metrics import Histogram, timed
+from profile_format import (
+    COMPACT_TOLERANCE,
+    compiled_path,
+    profile_digest,
+    segment_intensity,
+)
+
+# The number of compiled profiles kept before the least recently used are deleted.
+MAX_COMPILED_PROFILES: int = 16
+# Segment types of a profile's optional 3rd column, blank is a step.
+SEGMENT_TYPES: tuple = ("step", "ramp")
+# Limits of an uploaded profile, larger files are rejected before they're read.
+MAX_PROFILE_BYTES: int = 64 * 2**20
+MAX_PROFILE_ROWS: int = 2_000_000
+# The range of a light intensity.
+MIN_INTENSITY: int = 0
+MAX_INTENSITY: int = 100
+# Day 0 of an .xlsx's date serial numbers, 1904 if the workbook says so (old Mac Excel).
+EPOCH_1900: datetime = datetime(1899, 12, 30)
+EPOCH_1904: datetime = datetime(1904, 1, 1)
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+PARSE_SECONDS = Histogram(
+    "climate_profile_parse_seconds", "Seconds to read and check a profile spreadsheet."
+)
+
+
+class ProfileError(ValueError):
+    """Raised when a file cannot be compiled into a light profile."""
+
+
+class CompiledProfile(NamedTuple):
+    """A parsed light profile.
+
+    Attributes:
+        digest (str): Hash of the source file's contents, names the compiled file.
+        seconds (ndarray): Seconds since the start of the profile of each row.
+        intensities (ndarray): Light intensity of each row.
+        ramps (ndarray): 1 where a row ramps to the next row's intensity, 0 for a step.
+        source_rows (int): Rows in the source file, before the profile was compacted.
+    """
+
+    digest: str
+    seconds: np.ndarray
+    intensities: np.ndarray
+    ramps: np.ndarray
+    source_rows: int = 0
+
+    @property
+    def compression(self) -> float:
+        """Returns the source file's rows per compiled row."""
+        return (self.source_rows or len(self.seconds)) / len(self.seconds)
+
+    def to_frame(self):
+        """Returns the profile as a DataFrame of timedeltas, light intensities and ramps."""
+        import pandas as pd
+
+        return pd.DataFrame(
+            {
+                "duration since start of script": pd.to_timedelta(
+                    self.seconds, unit="s"
+                ),
+                "intensity": self.intensities,
+                "ramp": self.ramps.astype(bool),
+            }
+        )
+
+    def intensity_at(self, row: int, elapsed: float) -> float:
+        """Returns the intensity elapsed seconds into the profile, see segment_intensity."""
+        return segment_intensity(self.seconds, self.intensities, self.ramps, row, elapsed)
+
+    def wake_rows(self) -> np.ndarray:
+        """Returns the rows a controller must wake for: intensity changes and ramp starts and ends."""
+        ramp_rows = np.flatnonzero(self.ramps[:-1])
+        return np.union1d(
+            np.flatnonzero(np.diff(self.intensities)) + 1,
+            np.concatenate((ramp_rows, ramp_rows + 1)),
+        )
+
+
+def profile_rows(filepath: str) -> Iterator[Tuple[int, tuple]]:
+    """Yields the (row number, cells) of an .xlsx (its first sheet) or .csv profile, one at a time.
+
+    Row numbers are the spreadsheet's, starting at 1 for the header. Only the row being read is in
+    memory (see xlsx_rows, or the csv module), whatever the size of the file.
+
+    Raises:
+        ProfileError: If the file is too large, not an .xlsx or .csv, or can't be read.
+    """
+    size = os.path.getsize(filepath)
+    if size > MAX_PROFILE_BYTES:
+        raise ProfileError(
+            f"The profile is {size / 2**20:.1f} MB, profiles must be at most "
+            f"{MAX_PROFILE_BYTES / 2**20:.0f} MB."
+        )
+    try:
+        if filepath.endswith(".xlsx"):
+            yield from xlsx_rows(filepath)
+        elif filepath.endswith(".csv"):
+            with open(filepath, "r", encoding="utf-8-sig", newline="") as infile:
+                yield from enumerate(csv.reader(infile), 1)
+        else:
+            raise ProfileError(f"Unsupported profile file type: {filepath}")
+    except ProfileError:
+        raise
+    except Exception as e:
+        raise ProfileError(f"Could not read profile {filepath}: {e}") from e
+
+
+def _local_name(tag: str) -> str:
+    """Returns an XML tag or attribute name without its namespace."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _xlsx_parts(archive: zipfile.ZipFile) -> Tuple[str, Optional[str], Optional[str], bool]:
+    """Returns the archive paths of an .xlsx's first sheet, shared strings and styles, and
+    whether its dates count from 1904."""
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    date1904 = False
+    sheet_id = None
+    for element in workbook.iter():
+        name = _local_name(element.tag)
+        if name == "workbookPr":
+            date1904 = element.get("date1904", "0").lower() in ("1", "true")
+        elif name == "sheet" and sheet_id is None:
+            sheet_id = next(
+                value for key, value in element.attrib.items() if _local_name(key) == "id"
+            )
+    targets = {}
+    for element in ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels")):
+        target = element.get("Target", "")
+        # Targets are relative to xl/ unless they're absolute within the archive.
+        target = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+        targets[element.get("Id")] = target
+        targets[element.get("Type", "").rsplit("/", 1)[-1]] = target
+    return targets[sheet_id], targets.get("sharedStrings"), targets.get("styles"), date1904
+
+
+def _string_text(element) -> str:
+    """Returns the text of a shared or inline string: its <t>, or its runs' <t> joined. Phonetic
+    runs (<rPh>) aren't part of the text."""
+    parts = []
+    for child in element:
+        name = _local_name(child.tag)
+        if name == "t":
+            parts.append(child.text or "")
+        elif name == "r":
+            parts.extend(t.text or "" for t in child if _local_name(t.tag) == "t")
+    return "".join(parts)
+
+
+def _shared_strings(archive: zipfile.ZipFile, path: Optional[str]) -> list:
+    """Returns the shared strings of an .xlsx."""
+    strings = []
+    if not path:
+        return strings
+    table = None
+    with archive.open(path) as source:
+        for event, element in ElementTree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if _local_name(element.tag) == "sst":
+                    table = element
+            elif _local_name(element.tag) == "si":
+                strings.append(_string_text(element))
+                table.remove(element)
+    return strings
+
+
+def _time_styles(archive: zipfile.ZipFile, path: Optional[str]) -> Tuple[set, set]:
+    """Returns the indices of an .xlsx's cell styles that format dates and durations."""
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+
+    dates, durations = set(), set()
+    if not path:
+        return dates, durations
+    styles = ElementTree.fromstring(archive.read(path))
+    formats = dict(BUILTIN_FORMATS)
+    for element in styles.iter():
+        if _local_name(element.tag) == "numFmt":
+            formats[int(element.get("numFmtId"))] = element.get("formatCode")
+    for element in styles:
+        if _local_name(element.tag) == "cellXfs":
+            for index, style in enumerate(element):
+                code = formats.get(int(style.get("numFmtId", 0)))
+                if is_date_format(code):
+                    dates.add(index)
+                if is_timedelta_format(code):
+                    durations.add(index)
+    return dates, durations
+
+
+def xlsx_rows(filepath: str) -> Iterator[Tuple[int, tuple]]:
+    """Yields the (row number, cell values) of the first sheet of an .xlsx, see profile_rows.
+
+    The sheet's XML is streamed from the archive and each row is removed from the parsed tree
+    once it's read, so memory stays flat whatever the number of rows (openpyxl's read only
+    mode keeps ~80 bytes of every row read). Cells are read as openpyxl reads them: shared
+    strings are looked up and numbers in a date or duration format become a datetime, time
+    or timedelta. Missing rows are yielded empty, so row numbers are the spreadsheet's.
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        sheet_path, strings_path, styles_path, date1904 = _xlsx_parts(archive)
+        strings = _shared_strings(archive, strings_path)
+        dates, durations = _time_styles(archive, styles_path)
+        epoch = EPOCH_1904 if date1904 else EPOCH_1900
+        last_row = 0
+        sheet_data = None
+        with archive.open(sheet_path) as source:
+            for event, element in ElementTree.iterparse(source, events=("start", "end")):
+                name = _local_name(element.tag)
+                if event == "start":
+                    if name == "sheetData":
+                        sheet_data = element
+                    continue
+                if name != "row":
+                    continue
+                row = int(element.get("r", last_row + 1))
+                for missing in range(last_row + 1, row):
+                    yield missing, ()
+                last_row = row
+                values = []
+                for cell in element:
+                    if _local_name(cell.tag) != "c":
+                        continue
+                    reference = cell.get("r")
+                    column = _column_number(reference) if reference else len(values) + 1
+                    values.extend([None] * (column - len(values)))
+                    values[column - 1] = _cell_value(cell, strings, dates, durations, epoch)
+                yield row, tuple(values)
+                # Read rows are dropped from the tree, the rest of the sheet isn't kept.
+                sheet_data.remove(element)
+
+
+def _column_number(reference: str) -> int:
+    """Returns the column number (from 1) of a cell reference, e.g. 28 for "AB7"."""
+    number = 0
+    for letter in reference.rstrip("0123456789"):
+        number = number * 26 + ord(letter.upper()) - 64
+    return number
+
+
+def _excel_time(value: float, epoch: datetime, duration: bool) -> Union[datetime, time, timedelta]:
+    """Converts an Excel serial number to a date, a time of day (below 1) or a duration, to the
+    millisecond as openpyxl does."""
+    if duration:
+        return timedelta(milliseconds=round(value * 86400 * 1000))
+    day, fraction = divmod(value, 1)
+    of_day = timedelta(milliseconds=round(fraction * 86400 * 1000))
+    if 0 <= value < 1 and of_day.days == 0:
+        return (datetime.min + of_day).time()
+    if 0 < value < 60 and epoch == EPOCH_1900:
+        # Excel counts the 29th of February 1900, which didn't exist.
+        day += 1
+    return epoch + timedelta(days=day) + of_day
+
+
+def _cell_value(cell, strings: list, dates: set, durations: set, epoch: datetime):
+    """Returns the value of an .xlsx <c> element, see xlsx_rows."""
+    kind = cell.get("t", "n")
+    text = None
+    for child in cell:
+        child_name = _local_name(child.tag)
+        if child_name == "v":
+            text = child.text
+        elif child_name == "is":
+            return _string_text(child)
+    if not text:
+        return None
+    if kind == "n":
+        value = float(text) if any(c in text for c in ".eE") else int(text)
+        style = int(cell.get("s", 0))
+        if style in dates:
+            return _excel_time(value, epoch, style in durations)
+        return value
+    if kind == "s":
+        return strings[int(text)]
+    if kind == "b":
+        return bool(int(text))
+    if kind == "d":
+        return datetime.fromisoformat(text.rstrip("Z"))
+    # "str" (a formula's text) and "e" (an error, e.g. #N/A) as they are.
+    return text
+
+
+def cell_text(cell) -> str:
+    """Returns a cell's value as stripped text, "" for an empty cell."""
+    return "" if cell is None else str(cell).strip()
+
+
+def time_value(cell, row: int) -> Union[datetime, float]:
+    """Converts the time cell of row to a date or seconds.
+
+    Arguments:
+        cell: The cell's value, a date, time of day, duration or "HH:MM:SS" text.
+        row (int): The row's number, for errors.
+
+    Returns (datetime or float):
+        A date (with time) as is, otherwise seconds: since midnight for a time of day, or the
+        seconds of a duration.
+
+    Raises:
+        ProfileError: If the cell isn't a time.
+    """
+    if isinstance(cell, str):
+        text = cell.strip()
+        try:
+            cell = datetime.strptime(text, "%H:%M:%S").time()
+        except ValueError:
+            try:
+                cell = datetime.fromisoformat(text)
+            except ValueError:
+                raise ProfileError(f"Row {row}: '{text}' is not a time, use HH:MM:SS.") from None
+    if isinstance(cell, datetime):
+        return cell
+    if isinstance(cell, time):
+        return cell.hour * 3600 + cell.minute * 60 + cell.second + cell.microsecond / 1e6
+    if isinstance(cell, timedelta):
+        return cell.total_seconds()
+    raise ProfileError(f"Row {row}: '{cell_text(cell)}' is not a time, use HH:MM:SS.")
+
+
+@timed(PARSE_SECONDS)
+def parse_profile(
+    filepath: str, tolerance: float = COMPACT_TOLERANCE
+) -> Tuple[np.ndarray, int]:
+    """Parses an .xlsx or .csv profile into a compact 3 x n array of seconds, intensities and ramps.
+
+    Rows are checked and compacted as they're streamed from the file (see profile_rows), so an
+    invalid profile is rejected at its first bad row and memory only grows with the profile's
+    transitions, not its rows. A step row is dropped if the row kept before it is a step whose
+    intensity it's within tolerance of, so a profile compacted with a tolerance of 0 sets the
+    same intensities at the same times. Comparing with the kept row rather than the row above
+    keeps a slow drift from being merged away. Ramps, the rows they end on and the first and
+    last rows are always kept.
+
+    Arguments:
+        filepath (str): Path to the .xlsx or .csv profile.
+        tolerance (float): The largest change of intensity to merge into the step before.
+
+    Returns (tuple):
+        The 3 x n array of the kept rows and the number of rows in the file.
+
+    Raises:
+        ProfileError: If the file is not a valid profile of times, intensities and optionally
+            segment types. Errors name the offending row.
+    """
+    seconds, intensities, ramps = array("d"), array("d"), array("d")
+    # The last row read if it was dropped, kept after all if it's the profile's last.
+    pending: Optional[tuple] = None
+    last_second = 0.0
+    source_rows = 0
+    columns = 0
+    first: Optional[datetime] = None
+    for row, cells in profile_rows(filepath):
+        if not any(cell_text(cell) for cell in cells):
+            continue
+        if not columns:
+            # The header row
+            columns = len(cells)
+            while columns and not cell_text(cells[columns - 1]):
+                columns -= 1
+            if columns not in (2, 3):
+                raise ProfileError(
+                    "A profile must have 2 columns: time and light intensity, "
+                    "and optionally a 3rd: segment type ('step' or 'ramp')."
+                )
+            continue
+        if any(cell_text(cell) for cell in cells[columns:]):
+            raise ProfileError(f"Row {row}: has values beyond the profile's {columns} columns.")
+        if source_rows >= MAX_PROFILE_ROWS:
+            raise ProfileError(f"Profiles must have at most {MAX_PROFILE_ROWS:,} rows.")
+        cells = tuple(cells) + (None,) * (columns - len(cells))
+        # Dates are timed from the first row's, times of day from midnight.
+        value = time_value(cells[0], row)
+        if not source_rows:
+            first = value if isinstance(value, datetime) else None
+        elif isinstance(value, datetime) != (first is not None):
+            raise ProfileError(f"Row {row}: mixes dates and times, use one or the other.")
+        second = (value - first).total_seconds() if first else value
+        if source_rows and second < last_second:
+            raise ProfileError(
+                f"Row {row}: its time is before the row above's, times must not go backwards."
+            )
+        if not cell_text(cells[1]):
+            raise ProfileError(f"Row {row}: has no light intensity.")
+        try:
+            intensity = float(cells[1])
+        except (TypeError, ValueError):
+            raise ProfileError(
+                f"Row {row}: '{cell_text(cells[1])}' is not a light intensity."
+            ) from None
+        if not MIN_INTENSITY <= intensity <= MAX_INTENSITY:
+            raise ProfileError(
+                f"Row {row}: intensity {cell_text(cells[1])} is outside "
+                f"{MIN_INTENSITY} to {MAX_INTENSITY}."
+            )
+        segment = cell_text(cells[2]).lower() if columns == 3 else ""
+        if segment and segment not in SEGMENT_TYPES:
+            raise ProfileError(
+                f"Row {row}: unknown segment type '{segment}', use 'step' or 'ramp'."
+            )
+        source_rows += 1
+        last_second = second
+        ramp = segment == "ramp"
+        if (
+            not seconds
+            or ramp
+            or ramps[-1]
+            or abs(intensity - intensities[-1]) > tolerance
+        ):
+            seconds.append(second)
+            intensities.append(intensity)
+            ramps.append(ramp)
+            pending = None
+        else:
+            pending = (second, intensity)
+    if not source_rows:
+        raise ProfileError("The profile has no rows.")
+    if pending:
+        seconds.append(pending[0])
+        intensities.append(pending[1])
+        ramps.append(0)
+    # The last row ends the profile, there is nothing to ramp to.
+    ramps[-1] = 0
+    data = np.empty((3, len(seconds)))
+    for i, values in enumerate((seconds, intensities, ramps)):
+        data[i] = np.frombuffer(values, dtype=float)
+    return data, source_rows
+
+
+def load_profile(filepath: str) -> CompiledProfile:
+    """Returns the compiled profile for filepath, compiling it first if needed.
+
+    Arguments:
+        filepath (str): Path to the .xlsx or .csv profile.
+
+    Returns (CompiledProfile):
+        The profile with its arrays memory mapped from the compiled file.
+
+    Raises:
+        ProfileError: If the file is not a valid profile.
+    """
+    digest = profile_digest(filepath)
+    path = compiled_path(digest)
+    if os.path.exists(path):
+        # Mark the entry as recently used.
+        os.utime(path)
+    else:
+        data, source_rows = parse_profile(filepath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            np.save(outfile, data)
+            np.save(outfile, np.array([source_rows, COMPACT_TOLERANCE], dtype=float))
+        # Atomic so the web app and Light Controller never see a partial file.
+        os.replace(tmp_path, path)
+        logger.info(
+            "Compiled profile %s (%s rows, %s after compaction, %.1f:1) to %s",
+            filepath,
+            source_rows,
+            data.shape[1],
+            source_rows / data.shape[1],
+            path,
+        )
+        evict_stale_profiles()
+    return load_compiled(digest)
+
+
+def load_compiled(digest: str) -> CompiledProfile:
+    """Returns the already compiled profile named by digest.
+
+    Raises:
+        FileNotFoundError: If there is no compiled profile for digest.
+    """
+    if not re.fullmatch(r"[0-9a-f]{16}", digest):
+        raise FileNotFoundError(f"Not a compiled profile digest: {digest}")
+    path = compiled_path(digest)
+    data = np.load(path, mmap_mode="r")
+    # The rows of the source file follow the arrays.
+    with open(path, "rb") as infile:
+        infile.seek(data.offset + data.nbytes)
+        try:
+            source_rows = int(np.load(infile)[0])
+        except EOFError:
+            source_rows = 0
+    return CompiledProfile(digest, data[0], data[1], data[2], source_rows)
+
+
+def evict_stale_profiles(max_entries: int = MAX_COMPILED_PROFILES) -> None:
+    """Deletes all but the max_entries most recently used compiled profiles."""
+    paths = sorted(
+        glob(compiled_path("*")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for path in paths[max_entries:]:
+        try:
+            os.remove(path)
+            logger.info("Evicted compiled profile: %s", path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,352 @@
+"""Reads compiled light profiles (see profile_cache.py) with the standard library only.
+
+profile_cache.py parses profile spreadsheets and saves them as .npy files. The Light
+Controller only needs to step through the compiled arrays, so this module reads them into
+array('d') storage (8 bytes per value) without importing numpy or pandas, keeping the
+long-lived Light Controller process small. ProfileSchedule locates times within a run of a
+profile for the Light Controller and the web app alike.
+
+Profiles are compacted when they're compiled: rows that don't change the intensity are dropped,
+and with PROFILE_TOLERANCE set, so are steps that change it by at most that much (see
+profile_cache.parse_profile). The compiled file keeps the number of rows of the source file
+after the arrays, so the compression can be reported.
+"""
+import ast
+import hashlib
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+COMPILED_FOLDER_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static/live"
+)
+# Bump when the layout of the compiled .npy changes so older entries are not reused.
+COMPILER_VERSION: int = 3
+# Steps that change the intensity by at most this much are merged into the step before when a
+# profile is compiled, 0 only drops rows that repeat the intensity.
+COMPACT_TOLERANCE: float = float(os.environ.get("PROFILE_TOLERANCE", 0))
+
+_NPY_MAGIC = b"\x93NUMPY"
+# Content digests of the most recently hashed paths, reused while a file's size and
+# modification time are unchanged. Bounded, as every upload is hashed under a new name.
+MAX_DIGESTS: int = 64
+_DIGESTS: OrderedDict = OrderedDict()
+_DIGESTS_LOCK = threading.Lock()
+
+
+def profile_digest(filepath: str) -> str:
+    """Returns a hash of the contents of filepath (and the compiler version and tolerance)."""
+    stat = os.stat(filepath)
+    key = os.path.abspath(filepath)
+    with _DIGESTS_LOCK:
+        cached = _DIGESTS.get(key)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            _DIGESTS.move_to_end(key)
+            return cached[2]
+    sha = hashlib.sha256(str(COMPILER_VERSION).encode())
+    if COMPACT_TOLERANCE:
+        sha.update(f":{COMPACT_TOLERANCE!r}".encode())
+    with open(filepath, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 16), b""):
+            sha.update(block)
+    digest = sha.hexdigest()[:16]
+    with _DIGESTS_LOCK:
+        _DIGESTS[key] = (stat.st_size, stat.st_mtime_ns, digest)
+        _DIGESTS.move_to_end(key)
+        while len(_DIGESTS) > MAX_DIGESTS:
+            _DIGESTS.popitem(last=False)
+    return digest
+
+
+def compiled_path(digest: str) -> str:
+    """Returns the path of the compiled profile for digest."""
+    return os.path.join(COMPILED_FOLDER_PATH, f"profile_{digest}.npy")
+
+
+def find_next_row(times: Sequence[float], elapsed_time: timedelta) -> int:
+    """Find the next row of the profile whose time > elapsed_time.
+
+    Arguments:
+        times (Sequence[float]): Ascending seconds since the start of the profile that light intensities are to be set.
+        elapsed_time (timedelta): The amount of time since the profile was started.
+    Returns (int):
+        Index of the first row where time > the elapsed time, or the last row if there is none.
+    """
+    # Binary search, O(log n) rather than walking the rows.
+    return min(bisect_right(times, elapsed_time.total_seconds()), len(times) - 1)
+
+
+def segment_intensity(
+    seconds: Sequence[float],
+    intensities: Sequence[float],
+    ramps: Sequence[float],
+    row: int,
+    elapsed: float,
+) -> float:
+    """Returns a profile's intensity elapsed seconds into it, which is within row's segment.
+
+    Arguments:
+        seconds (Sequence[float]): Seconds since the start of the profile of each row.
+        intensities (Sequence[float]): Light intensity of each row.
+        ramps (Sequence[float]): Nonzero where a row ramps to the next row's intensity.
+        row (int): The row in effect.
+        elapsed (float): Seconds since the start of the profile (cycle).
+
+    Returns (float):
+        The row's intensity, or for a ramp its intensity at elapsed rounded to a whole one.
+    """
+    if not ramps[row] or row + 1 >= len(seconds):
+        return intensities[row]
+    span = seconds[row + 1] - seconds[row]
+    fraction = min(max((elapsed - seconds[row]) / span, 0.0), 1.0) if span > 0 else 1.0
+    start, end = intensities[row], intensities[row + 1]
+    return int(round(start + (end - start) * fraction))
+
+
+class ProfileArrays:
+    """A compiled profile held in arrays of doubles.
+
+    Attributes:
+        digest (str): Hash of the source file's contents, names the compiled file.
+        seconds (array): Seconds since the start of the profile of each row.
+        intensities (array): Light intensity of each row.
+        ramps (array): 1 where a row ramps to the next row's intensity, 0 for a step.
+        source_rows (int): Rows in the source file, before the profile was compacted.
+    """
+
+    __slots__ = ("digest", "seconds", "intensities", "ramps", "source_rows")
+
+    def __init__(
+        self,
+        digest: str,
+        seconds: array,
+        intensities: array,
+        ramps: array,
+        source_rows: int = 0,
+    ):
+        """Initializes the ProfileArrays class."""
+        self.digest = digest
+        self.seconds = seconds
+        self.intensities = intensities
+        self.ramps = ramps
+        self.source_rows = source_rows or len(seconds)
+
+    def intensity_at(self, row: int, elapsed: float) -> float:
+        """Returns the intensity elapsed seconds into the profile, see segment_intensity."""
+        return segment_intensity(self.seconds, self.intensities, self.ramps, row, elapsed)
+
+    def wake_rows(self) -> array:
+        """Returns the rows a controller must wake for: intensity changes and ramp starts and ends."""
+        intensities, ramps = self.intensities, self.ramps
+        rows = array("l")
+        for row in range(1, len(intensities)):
+            if intensities[row] != intensities[row - 1] or ramps[row - 1] or (
+                ramps[row] and row < len(ramps) - 1
+            ):
+                rows.append(row)
+        if ramps and ramps[0] and len(ramps) > 1:
+            rows.insert(0, 0)
+        return rows
+
+
+class ProfileSchedule:
+    """A run of a profile: the intensity and cycle at any time, and when the intensity changes.
+
+    The Light Controller, the plots and the web app's APIs all locate a time within a run here.
+    A cycle is as long as the time of the profile's last row (a looping run starts the next
+    cycle then), and a time's row is found by binary search, so every query is O(log n) in the
+    profile's rows. intensities_at answers many times at once with numpy.
+
+    Attributes:
+        profile (ProfileArrays or CompiledProfile): The compiled profile.
+        started (datetime): When the run started, the start of its first cycle.
+        run_continuously (bool): Whether the profile loops.
+        cycle_dur (timedelta): The length of one cycle.
+    """
+
+    __slots__ = ("profile", "started", "run_continuously", "cycle_dur", "_wake_rows", "_last_row")
+
+    def __init__(self, profile, started: datetime, run_continuously: bool = True):
+        """Initializes the ProfileSchedule class."""
+        self.profile = profile
+        self.started = started
+        self.run_continuously = run_continuously
+        self._last_row = len(profile.seconds) - 1
+        self.cycle_dur = timedelta(seconds=float(profile.seconds[self._last_row]))
+        # Rows whose intensity differs from the row before, and the start and end of ramps, the
+        # only rows the intensity changes at.
+        self._wake_rows = profile.wake_rows()
+
+    def cycle_at(self, when: datetime) -> Tuple[int, datetime]:
+        """Returns the number and start time of the cycle in effect at when."""
+        if self.cycle_dur and self.run_continuously and when > self.started:
+            cycle_num = (when - self.started) // self.cycle_dur
+        else:
+            cycle_num = 0
+        return cycle_num, self.started + cycle_num * self.cycle_dur
+
+    def completed(self, when: datetime) -> bool:
+        """Returns whether the run is over at when, a looping run is only over if it's empty."""
+        return not self.cycle_dur or (
+            not self.run_continuously and when - self.started > self.cycle_dur
+        )
+
+    def row_at(self, elapsed: float) -> int:
+        """Returns the row in effect elapsed seconds into a cycle.
+
+        The last row only marks the end of the cycle, so it's never the row in effect.
+        """
+        row = bisect_right(self.profile.seconds, elapsed) - 1
+        return min(max(row, 0), max(self._last_row - 1, 0))
+
+    def intensity_at(self, when: datetime) -> float:
+        """Returns the intensity the run sets at when, the last row's once it's completed."""
+        if self.completed(when):
+            return self.profile.intensities[self._last_row]
+        _, cycle_start = self.cycle_at(when)
+        elapsed = (when - cycle_start).total_seconds()
+        return self.profile.intensity_at(self.row_at(elapsed), elapsed)
+
+    def next_transition(
+        self, when: datetime, ramp_tick: Optional[float] = None
+    ) -> Optional[datetime]:
+        """Returns when the intensity next changes after when.
+
+        Arguments:
+            when (datetime): The time to look from.
+            ramp_tick (float): During a ramp, the seconds after when to recalculate the
+                intensity at, if that's sooner. None for the end of the ramp.
+
+        Returns (datetime):
+            The time of the next row that changes the intensity, or the end of the cycle. None
+            if the run is completed.
+        """
+        if self.completed(when):
+            return None
+        _, cycle_start = self.cycle_at(when)
+        row = self.row_at((when - cycle_start).total_seconds())
+        wake_idx = bisect_right(self._wake_rows, row)
+        if wake_idx < len(self._wake_rows) and self._wake_rows[wake_idx] < self._last_row:
+            transition = cycle_start + timedelta(
+                seconds=float(self.profile.seconds[self._wake_rows[wake_idx]])
+            )
+        else:
+            transition = cycle_start + self.cycle_dur
+        if ramp_tick is not None and self.profile.ramps[row]:
+            transition = min(transition, when + timedelta(seconds=ramp_tick))
+        return transition
+
+    def intensities_at(self, timestamps):
+        """Returns the intensity the run sets at each of timestamps, as intensity_at does.
+
+        numpy is imported here rather than with the module, the Light Controller never needs it.
+
+        Arguments:
+            timestamps (array_like): Seconds since the epoch.
+
+        Returns (ndarray):
+            The intensity at each timestamp.
+        """
+        import numpy as np
+
+        seconds = np.asarray(self.profile.seconds, dtype=float)
+        intensities = np.asarray(self.profile.intensities, dtype=float)
+        ramps = np.asarray(self.profile.ramps) != 0
+        # Rounded to microseconds, as datetime arithmetic is, so .5 ramp steps round alike.
+        elapsed = np.round(np.asarray(timestamps, dtype=float) - self.started.timestamp(), 6)
+        cycle = self.cycle_dur.total_seconds()
+        if not cycle:
+            return np.full(elapsed.shape, intensities[self._last_row])
+        completed = elapsed > cycle if not self.run_continuously else np.zeros(elapsed.shape, bool)
+        if self.run_continuously:
+            elapsed = np.round(elapsed - np.floor(np.maximum(elapsed, 0) / cycle) * cycle, 6)
+        rows = np.clip(
+            np.searchsorted(seconds, elapsed, side="right") - 1, 0, max(self._last_row - 1, 0)
+        )
+        # Ramps move linearly to the next row's intensity, rounded as segment_intensity does.
+        ends = np.minimum(rows + 1, self._last_row)
+        span = seconds[ends] - seconds[rows]
+        fraction = np.where(
+            span > 0, np.clip((elapsed - seconds[rows]) / np.where(span > 0, span, 1), 0, 1), 1
+        )
+        ramped = np.round(intensities[rows] + (intensities[ends] - intensities[rows]) * fraction)
+        result = np.where(ramps[rows] & (rows < self._last_row), ramped, intensities[rows])
+        return np.where(completed, intensities[self._last_row], result)
+
+
+def _read_npy_header(infile, path: str) -> Optional[Tuple[dict, List[int]]]:
+    """Reads the header of the .npy array at infile's position, returning it and its shape.
+
+    Returns (tuple):
+        The header and the array's shape, None at the end of the file.
+
+    Raises:
+        ValueError: If there isn't an array of doubles there.
+    """
+    magic = infile.read(6)
+    if not magic:
+        return None
+    if magic != _NPY_MAGIC:
+        raise ValueError(f"Not a compiled profile: {path}")
+    major = infile.read(2)[0]
+    header_size = int.from_bytes(infile.read(2 if major == 1 else 4), "little")
+    header = ast.literal_eval(infile.read(header_size).decode("latin1"))
+    if header["descr"] != "<f8" or header["fortran_order"]:
+        raise ValueError(f"Unexpected compiled profile layout: {header}")
+    return header, list(header["shape"])
+
+
+def _read_doubles(infile, count: int) -> array:
+    """Reads count little endian doubles from infile."""
+    values = array("d")
+    values.fromfile(infile, count)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def read_compiled(digest: str) -> ProfileArrays:
+    """Reads the compiled profile named by digest without numpy.
+
+    The 3 x n array of the profile is followed by a second array: the rows of the source file
+    and the tolerance it was compacted with. The file isn't checked for its COMPILER_VERSION, a
+    profile compiled by another version has another digest (see profile_digest).
+
+    Raises:
+        FileNotFoundError: If there is no compiled profile for digest.
+        ValueError: If the file isn't laid out as a compiled profile.
+    """
+    path = compiled_path(digest)
+    with open(path, "rb") as infile:
+        header, shape = _read_npy_header(infile, path) or (None, [])
+        if shape[:1] != [3] or len(shape) != 2:
+            raise ValueError(f"Unexpected compiled profile layout: {header}")
+        rows = [_read_doubles(infile, shape[1]) for _ in range(3)]
+        trailer = _read_npy_header(infile, path)
+        source_rows = int(_read_doubles(infile, trailer[1][0])[0]) if trailer else 0
+    return ProfileArrays(digest, *rows, source_rows=source_rows)
+
+
+def load_arrays(filepath: str) -> ProfileArrays:
+    """Returns the compiled profile for filepath, compiling it first (with numpy) if needed.
+
+    Raises:
+        ProfileError: If the file is not a valid profile.
+    """
+    digest = profile_digest(filepath)
+    try:
+        profile = read_compiled(digest)
+    except FileNotFoundError:
+        # Only reached if the web app didn't compile the profile when it was uploaded.
+        from profile_cache import load_profile
+
+        load_profile(filepath)
+        return read_compiled(digest)
+    # Mark the entry as recently used.
+    os.utime(compiled_path(digest))
+    return profile
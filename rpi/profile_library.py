@@ -0,0 +1,133 @@
+"""Keeps the profiles stored on the Pi (default_profiles/) compiled and ready to run.
+
+Running one of the stored profiles used to mean downloading it and uploading it again, which
+parses, compiles and plots it like any new profile. The library compiles every stored profile
+when the web app starts (on a background thread) and again whenever a file is added or changed,
+so a stored profile is always a compiled profile (see profile_cache.py) indexed by its name and
+content hash, and its preview is the one cached for that hash (see preview_cache.py). Starting a
+library profile then only copies the file into the 'live' folder and starts the Light
+Controller.
+"""
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+from profile_cache import ProfileError, load_profile
+from profile_format import compiled_path
+
+LIBRARY_FOLDER_PATH: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "default_profiles"
+)
+# Files in the library folder that are profiles.
+PROFILE_EXTENSIONS: tuple = (".xlsx", ".csv")
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+class LibraryProfile:
+    """A profile stored in the library folder.
+
+    Attributes:
+        name (str): The profile's file name, names it in the library.
+        path (str): Path of the profile's file.
+        digest (str): Hash of the file's contents, names its compiled profile.
+        rows (int): Rows in the compiled profile, its transitions.
+        source_rows (int): Rows in the profile's file.
+        seconds (float): Time of the profile's last row, from its start.
+        error (str): Why the file isn't a valid profile, None if it is.
+    """
+
+    __slots__ = ("name", "path", "digest", "rows", "source_rows", "seconds", "error", "_stat")
+
+    def __init__(self, path: str, stat: os.stat_result):
+        """Initializes the LibraryProfile class, compiling the profile at path."""
+        self.name = os.path.basename(path)
+        self.path = path
+        self.digest: Optional[str] = None
+        self.rows = 0
+        self.source_rows = 0
+        self.seconds = 0.0
+        self.error: Optional[str] = None
+        self._stat = (stat.st_size, stat.st_mtime_ns)
+        try:
+            profile = load_profile(path)
+            self.digest = profile.digest
+            self.rows = len(profile.seconds)
+            self.source_rows = profile.source_rows
+            self.seconds = float(profile.seconds[-1])
+        except ProfileError as e:
+            self.error = str(e)
+            logger.warning("Library profile %s is not a valid profile: %s", path, e)
+
+    def to_dict(self) -> dict:
+        """Returns the profile's library entry, e.g. for a json response."""
+        return {
+            "name": self.name,
+            "digest": self.digest,
+            "rows": self.rows,
+            "source_rows": self.source_rows,
+            "seconds": self.seconds,
+            "error": self.error,
+        }
+
+
+class ProfileLibrary:
+    """The compiled profiles of a folder.
+
+    Attributes:
+        folder (str): The folder of stored profiles.
+    """
+
+    def __init__(self, folder: str = LIBRARY_FOLDER_PATH):
+        """Initializes the ProfileLibrary class."""
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, LibraryProfile] = {}
+
+    def start(self) -> threading.Thread:
+        """Compiles the library on a background thread so the web app starts without waiting."""
+        thread = threading.Thread(target=self.refresh, name="library", daemon=True)
+        thread.start()
+        return thread
+
+    def refresh(self) -> List[LibraryProfile]:
+        """Compiles added or changed profiles and forgets removed ones.
+
+        Unchanged files (same size and modification time) whose compiled profile is still
+        cached cost two stats, so this is called before every lookup.
+
+        Returns (list):
+            The library's profiles, sorted by name.
+        """
+        try:
+            names = sorted(
+                name for name in os.listdir(self.folder)
+                if name.lower().endswith(PROFILE_EXTENSIONS)
+            )
+        except FileNotFoundError:
+            names = []
+        with self._lock:
+            for name in set(self._profiles) - set(names):
+                del self._profiles[name]
+            for name in names:
+                path = os.path.join(self.folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entry = self._profiles.get(name)
+                if (
+                    entry
+                    and entry._stat == (stat.st_size, stat.st_mtime_ns)
+                    and (entry.error or os.path.exists(compiled_path(entry.digest)))
+                ):
+                    continue
+                self._profiles[name] = LibraryProfile(path, stat)
+                logger.info("Library profile %s compiled as %s", name, self._profiles[name].digest)
+            return [self._profiles[name] for name in sorted(self._profiles)]
+
+    def get(self, name: str) -> Optional[LibraryProfile]:
+        """Returns the library's profile called name, None if there isn't one."""
+        return next((entry for entry in self.refresh() if entry.name == name), None)
@@ -0,0 +1,185 @@
+"""An append-only log of every intensity the Light Controller sends to the lights.
+
+A run's config, profile and plot are deleted when it ends, so this log is the record of what
+the pond actually received, e.g. to correlate algae growth with delivered light over months.
+
+Each command is a fixed width record: the time it was sent, the intensity, the compiled
+profile's hash (see profile_cache.py) and the Light Controller's pid. Records are appended to
+{HISTORY_FOLDER}/history_<first timestamp>.bin and a new file is started once the current
+one reaches MAX_FILE_BYTES. Records are in time order so a time range is found by binary
+searching the files without loading them. A record timed before the one appended before it
+(the wall clock was set back, e.g. by NTP, and the run followed it) is appended with the
+earlier record's time to keep that order.
+
+Only the standard library is used so the Light Controller stays light.
+"""
+import logging
+import os
+import struct
+import time
+from datetime import datetime
+from glob import glob
+from typing import List, NamedTuple, Optional
+
+HISTORY_FOLDER: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data/history"
+)
+# Size a history file grows to before a new one is started (~170,000 records).
+MAX_FILE_BYTES: int = 4 * 1024 * 1024
+
+# Seconds since the epoch, intensity, 8 byte profile hash, pid.
+_RECORD = struct.Struct("<df8sI")
+RECORD_SIZE: int = _RECORD.size
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+class HistoryRecord(NamedTuple):
+    """An intensity sent to the lights.
+
+    Attributes:
+        timestamp (float): Seconds since the epoch when it was sent.
+        intensity (float): The intensity sent.
+        profile_hash (str): Digest of the compiled profile that was running.
+        pid (int): pid of the Light Controller that sent it.
+    """
+
+    timestamp: float
+    intensity: float
+    profile_hash: str
+    pid: int
+
+    def to_dict(self) -> dict:
+        return {
+            "time": datetime.fromtimestamp(self.timestamp).isoformat(
+                timespec="milliseconds"
+            ),
+            "intensity": self.intensity,
+            "profile_hash": self.profile_hash,
+            "pid": self.pid,
+        }
+
+
+def _history_files(folder: str) -> List[str]:
+    """Returns the history files in folder, oldest first."""
+    return sorted(
+        glob(os.path.join(folder, "history_*.bin")),
+        key=lambda path: int(os.path.basename(path)[8:-4]),
+    )
+
+
+class RunHistory:
+    """Appends records to the history log. There must only be one writer.
+
+    Attributes:
+        folder (str): Folder the history files are kept in.
+        max_file_bytes (int): Size a file grows to before a new one is started.
+    """
+
+    __slots__ = ("folder", "max_file_bytes", "_file", "_last_timestamp")
+
+    def __init__(self, folder: str = HISTORY_FOLDER, max_file_bytes: int = MAX_FILE_BYTES):
+        """Initializes the RunHistory class."""
+        self.folder = folder
+        self.max_file_bytes = max_file_bytes
+        self._file = None
+        # The time of the last record, later records are never appended before it.
+        self._last_timestamp = 0.0
+        os.makedirs(folder, exist_ok=True)
+        files = _history_files(folder)
+        if files:
+            self._open(files[-1])
+
+    def _open(self, path: str) -> None:
+        # Unbuffered, so every record is a single write that survives the process dying.
+        self._file = open(path, "ab", buffering=0)
+        size = self._file.tell()
+        if size % RECORD_SIZE:
+            # Drop a record that was only partly written (e.g. power loss).
+            self._file.truncate(size - size % RECORD_SIZE)
+            size -= size % RECORD_SIZE
+        if size:
+            with open(path, "rb") as infile:
+                infile.seek(size - RECORD_SIZE)
+                self._last_timestamp = struct.unpack("<d", infile.read(8))[0]
+
+    def append(
+        self,
+        intensity: float,
+        profile_hash: str,
+        pid: int,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        """Appends a record of an intensity sent to the lights, no earlier than the last."""
+        timestamp = time.time() if timestamp is None else timestamp
+        if timestamp < self._last_timestamp:
+            logger.debug(
+                "History record at %s is before the last record, appended at %s.",
+                timestamp,
+                self._last_timestamp,
+            )
+            timestamp = self._last_timestamp
+        self._last_timestamp = timestamp
+        if not self._file or self._file.tell() >= self.max_file_bytes:
+            if self._file:
+                self._file.close()
+            self._open(os.path.join(self.folder, f"history_{int(timestamp)}.bin"))
+        self._file.write(
+            _RECORD.pack(timestamp, intensity, bytes.fromhex(profile_hash)[:8], pid)
+        )
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _first_at_or_after(infile, records: int, timestamp: float) -> int:
+    """Binary searches an open history file for the first record at or after timestamp."""
+    lo, hi = 0, records
+    while lo < hi:
+        mid = (lo + hi) // 2
+        infile.seek(mid * RECORD_SIZE)
+        if struct.unpack("<d", infile.read(8))[0] < timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def query_history(
+    start: datetime,
+    end: datetime,
+    limit: Optional[int] = None,
+    folder: str = HISTORY_FOLDER,
+) -> List[HistoryRecord]:
+    """Returns the records sent from start up to (not including) end, oldest first.
+
+    Arguments:
+        start (datetime): Start of the time range.
+        end (datetime): End of the time range.
+        limit (int): Maximum number of records to return.
+        folder (str): Folder the history files are kept in.
+    """
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    files = _history_files(folder)
+    firsts = [int(os.path.basename(path)[8:-4]) for path in files]
+    records: List[HistoryRecord] = []
+    for i, path in enumerate(files):
+        # A file holds records from its first timestamp up to the next file's.
+        if firsts[i] >= end_ts or (i + 1 < len(files) and firsts[i + 1] < start_ts):
+            continue
+        with open(path, "rb") as infile:
+            count = os.fstat(infile.fileno()).st_size // RECORD_SIZE
+            first = _first_at_or_after(infile, count, start_ts)
+            last = _first_at_or_after(infile, count, end_ts)
+            if limit is not None:
+                last = min(last, first + limit - len(records))
+            infile.seek(first * RECORD_SIZE)
+            data = infile.read((last - first) * RECORD_SIZE)
+        for timestamp, intensity, profile_hash, pid in _RECORD.iter_unpack(data):
+            records.append(HistoryRecord(timestamp, intensity, profile_hash.hex(), pid))
+        if limit is not None and len(records) >= limit:
+            break
+    return records
@@ -0,0 +1,29 @@
+## Measures the command to PWM latency of the framed serial protocol with a connected Arduino
+    # the Arduino must be running arduino/arduino_lights_manager, lights will ramp 0 to 100
+
+import statistics
+import sys
+
+from light_utilities import ArduinoDeliveryError, FramedArduinoWriter, connect_arduino
+
+COMMANDS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+ARDUINO = connect_arduino()
+if ARDUINO is None:
+    sys.exit("No Arduino connected.")
+
+writer = FramedArduinoWriter(ARDUINO)
+failures = 0
+for i in range(COMMANDS):
+    try:
+        writer.send(i % 101)
+    except ArduinoDeliveryError as e:
+        failures += 1
+        print(e)
+writer.send(0)
+
+round_trips = sorted(writer.round_trips)
+print(f"{len(round_trips)} acknowledged, {failures} failed")
+print(f"median {statistics.median(round_trips) * 1000:.1f} ms")
+print(f"p99    {round_trips[int(len(round_trips) * 0.99) - 1] * 1000:.1f} ms")
+print(f"max    {round_trips[-1] * 1000:.1f} ms")
@@ -0,0 +1,136 @@
+"""Replays a light profile run in virtual time and records every command sent to the lights.
+
+The Light Controller (control_lights.py) runs with a VirtualClock and a SimulatedArduino, so a
+multi-day run of a looping profile takes seconds. Restarts (e.g. power outages) can be simulated
+to check the controller resumes where the run should be.
+
+Steps of the wall clock (e.g. an NTP correction) can be simulated to check the run follows them.
+
+Usage: python3 rpi/simulate.py <profile> [--days 3] [--once] [--start 2025-01-01T06:00:00]
+                                         [--restart-after 30.5 ...] [--trace trace.csv]
+                                         [--wall-jump 5 -3600 ...]
+"""
+import argparse
+import csv
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from clock import ClockStopped, VirtualClock
+from control_lights import control_lights
+from controller_status import StatusWriter
+from light_utilities import SimulatedArduino
+from run_history import RunHistory
+from transition_timing import TransitionLog
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+def run_simulation(
+    profile_path: str,
+    start: datetime,
+    duration: timedelta,
+    run_continuously: bool = True,
+    restarts: Sequence[timedelta] = (),
+    wall_jumps: Sequence[Tuple[timedelta, float]] = (),
+    started: Optional[datetime] = None,
+) -> List[Tuple[datetime, int, int]]:
+    """Runs the Light Controller in virtual time and returns what the lights were sent.
+
+    Arguments:
+        profile_path (str): The profile to run.
+        start (datetime): The virtual start time of the run.
+        duration (timedelta): How long to run for, unless a profile that doesn't loop ends first.
+        run_continuously (bool): Whether the profile loops.
+        restarts (Sequence[timedelta]): Times since the start the controller is killed and
+            resumed, as the supervisor does.
+        wall_jumps (Sequence[tuple]): (time since the start, seconds) of steps of the wall clock.
+        started (datetime): When the run was started, defaults to start. Differs from start to
+            simulate a controller whose wall clock is off from the one the run was started by.
+
+    Returns (list):
+        (time, channel, intensity) of every command the Arduino applied.
+    """
+    started = start if started is None else started
+    config = {
+        "_started": started,
+        "_profile_filepath": profile_path,
+        "run_continuously": run_continuously,
+        "last_intensity": 0,
+        "pid": None,
+    }
+    clock = VirtualClock(
+        start, wall_jumps=[(after.total_seconds(), seconds) for after, seconds in wall_jumps]
+    )
+    arduino = SimulatedArduino(clock)
+    end = start + duration
+    stops = sorted(start + restart for restart in restarts if restart < duration) + [end]
+    with tempfile.TemporaryDirectory() as folder:
+        for stop in stops:
+            clock.stop_at = stop
+            try:
+                control_lights(
+                    config,
+                    clock,
+                    arduino,
+                    StatusWriter(os.path.join(folder, "status.bin")),
+                    RunHistory(os.path.join(folder, "history")),
+                    checkpoint=False,
+                    # A restarted controller resumes (--resume) without flashing the lights.
+                    flash=stop is stops[0],
+                    timing=TransitionLog(started, os.path.join(folder, "timing")),
+                )
+                break
+            except ClockStopped:
+                if stop < end:
+                    logger.info("%s: Restarting the Light Controller.", stop)
+    return arduino.trace
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("profile", help="an .xlsx or .csv light profile")
+    parser.add_argument("--days", type=float, default=3, help="days to run for")
+    parser.add_argument("--once", action="store_true", help="don't loop the profile")
+    parser.add_argument("--start", type=datetime.fromisoformat,
+                        default=datetime.now().replace(microsecond=0),
+                        help="virtual start time (ISO format), defaults to now")
+    parser.add_argument("--restart-after", type=float, nargs="*", default=[],
+                        help="hours after the start to restart the Light Controller")
+    parser.add_argument("--trace", help="csv file to save the commands to")
+    parser.add_argument("--wall-jump", type=float, nargs=2, action="append", default=[],
+                        metavar=("HOURS", "SECONDS"),
+                        help="step the wall clock by SECONDS, HOURS after the start")
+    parser.add_argument("--verbose", action="store_true", help="log every command")
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logging.getLogger("control_lights").setLevel(logging.WARNING)
+        logging.getLogger("light_utilities").setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    trace = run_simulation(
+        args.profile,
+        args.start,
+        timedelta(days=args.days),
+        not args.once,
+        [timedelta(hours=hours) for hours in args.restart_after],
+        [(timedelta(hours=hours), seconds) for hours, seconds in args.wall_jump],
+    )
+    elapsed = time.perf_counter() - started
+    print(f"{len(trace):,} commands over {args.days:g} virtual days in {elapsed:.2f} s")
+    if trace:
+        print(f"first {trace[0][0]} intensity {trace[0][2]}, last {trace[-1][0]} intensity {trace[-1][2]}")
+    if args.trace:
+        with open(args.trace, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["time", "channel", "intensity"])
+            for sent, channel, intensity in trace:
+                writer.writerow([sent.isoformat(timespec="milliseconds"), channel, intensity])
+
+
+if __name__ == "__main__":
+    main()
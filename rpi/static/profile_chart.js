@@ -0,0 +1,130 @@
+// Draws light profiles from the web app's JSON API (/api/live, /api/profile/<digest>)
+// on a <canvas>, so the Raspberry Pi doesn't have to render plot images.
+
+const CHART_MARGIN = { left: 60, right: 20, top: 50, bottom: 90 };
+
+function chartTimeLabel(cycleStart, seconds, withSeconds) {
+    // cycle_start is the Raspberry Pi's local time without a timezone, so is parsed as local.
+    const t = new Date(cycleStart.getTime() + seconds * 1000);
+    const pad = (n) => String(n).padStart(2, "0");
+    const label = `${pad(t.getHours())}:${pad(t.getMinutes())}`;
+    return withSeconds ? `${label}:${pad(t.getSeconds())}` : label;
+}
+
+function drawProfileChart(canvas, data) {
+    const ctx = canvas.getContext("2d");
+    const width = canvas.width - CHART_MARGIN.left - CHART_MARGIN.right;
+    const height = canvas.height - CHART_MARGIN.top - CHART_MARGIN.bottom;
+    const seconds = data.seconds;
+    const xMax = Math.max(seconds[seconds.length - 1], 1);
+    const yMax = Math.max(100, ...data.intensities) * 1.05;
+    const x = (s) => CHART_MARGIN.left + (s / xMax) * width;
+    const y = (v) => CHART_MARGIN.top + height - (v / yMax) * height;
+    const cycleStart = new Date(data.cycle_start);
+    const withSeconds = data.cycle_duration < 600;
+
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.font = "12px sans-serif";
+    ctx.fillStyle = "black";
+
+    // Grid and axis labels
+    ctx.strokeStyle = "#ddd";
+    ctx.lineWidth = 1;
+    ctx.textAlign = "right";
+    for (let v = 0; v <= 100; v += 20) {
+        ctx.beginPath();
+        ctx.moveTo(x(0), y(v));
+        ctx.lineTo(x(xMax), y(v));
+        ctx.stroke();
+        ctx.fillText(v, x(0) - 6, y(v) + 4);
+    }
+    const ticks = 12;
+    for (let i = 0; i <= ticks; i++) {
+        const s = (xMax * i) / ticks;
+        ctx.beginPath();
+        ctx.moveTo(x(s), y(0));
+        ctx.lineTo(x(s), y(yMax));
+        ctx.stroke();
+        ctx.save();
+        ctx.translate(x(s) + 4, y(0) + 8);
+        ctx.rotate(Math.PI / 2);
+        ctx.textAlign = "left";
+        ctx.fillText(chartTimeLabel(cycleStart, s, withSeconds), 0, 0);
+        ctx.restore();
+    }
+    ctx.save();
+    ctx.translate(16, CHART_MARGIN.top + height / 2);
+    ctx.rotate(-Math.PI / 2);
+    ctx.textAlign = "center";
+    ctx.fillText("Light Intensity Value", 0, 0);
+    ctx.restore();
+    ctx.textAlign = "center";
+    ctx.fillText(
+        data.state ? "Rasberry Pi Time of Day" : "Duration from Start of Profile",
+        CHART_MARGIN.left + width / 2,
+        canvas.height - 8
+    );
+
+    // Title
+    let title = data.name;
+    if (data.state) {
+        const status = data.state.run_continuously ? " (looping)" : data.state.completed ? " (COMPLETED)" : "";
+        title = `Controlling Profile: ${data.name}${status}  Started: ${data.state.started.replace("T", " ")}`;
+    }
+    ctx.font = "14px sans-serif";
+    ctx.fillText(title, CHART_MARGIN.left + width / 2, 24);
+    ctx.font = "12px sans-serif";
+
+    // The profile's (already step expanded) series
+    ctx.strokeStyle = "#1f77b4";
+    ctx.lineWidth = 1.5;
+    ctx.beginPath();
+    seconds.forEach((s, i) => {
+        const px = x(s), py = y(data.intensities[i]);
+        i ? ctx.lineTo(px, py) : ctx.moveTo(px, py);
+    });
+    ctx.stroke();
+
+    if (data.state) {
+        drawChartMarker(ctx, x(data.state.now_seconds), y, `${data.state.last_intensity}`,
+                        "Last Update " + chartTimeLabel(cycleStart, data.state.now_seconds, withSeconds));
+        if (data.state.run_continuously && data.state.cycle_num) {
+            drawChartMarker(ctx, x(0), y, "", `Cycle ${(data.state.cycle_num + 1).toLocaleString()} Start Time`);
+        }
+    }
+}
+
+function drawChartMarker(ctx, px, y, value, label) {
+    // A dashed vertical red line with a rotated label and an optional value.
+    ctx.save();
+    ctx.strokeStyle = "red";
+    ctx.setLineDash([6, 4]);
+    ctx.beginPath();
+    ctx.moveTo(px, y(0));
+    ctx.lineTo(px, y(100 * 1.05));
+    ctx.stroke();
+    ctx.setLineDash([]);
+    ctx.fillStyle = "black";
+    if (value) {
+        ctx.textAlign = "left";
+        ctx.fillText(value, px + 6, y(Number(value)) - 6);
+    }
+    ctx.translate(px - 4, y(40));
+    ctx.rotate(-Math.PI / 2);
+    ctx.textAlign = "left";
+    ctx.fillText(label, 0, 0);
+    ctx.restore();
+}
+
+function loadProfileChart(canvas, url) {
+    // Fetches a profile downsampled to the canvas width and draws it.
+    const separator = url.includes("?") ? "&" : "?";
+    return fetch(`${url}${separator}width=${canvas.width}`)
+        .then((response) => (response.ok ? response.json() : null))
+        .then((data) => {
+            if (data) {
+                drawProfileChart(canvas, data);
+            }
+            return data;
+        });
+}
@@ -0,0 +1,223 @@
+"""Owns the Light Controller process and restarts it if it dies or hangs.
+
+The web app used to check a controller's pid only when it was itself restarted, so a controller
+that crashed or hung mid-run went unnoticed until the Pi was rebooted. The supervisor starts
+every controller and watches it from a thread of the web app. A controller that exits with an
+error, or whose heartbeat in the status record (see controller_status.py) stops for
+HANG_TIMEOUT seconds, is killed and restarted with --resume within a second. The restarted
+controller picks up the run from climate_config.json at the row in effect now, without flashing
+the lights.
+
+Heartbeats are timed by when the status record changes, on the monotonic clock, so a wall
+clock change (e.g. NTP on boot) never looks like a hang. The controller locks its port before
+it reports its pid (see light_utilities.lock_port), so a controller started while another one
+is still driving the lights exits with EXIT_PORT_LOCKED, which is never retried.
+"""
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Optional
+
+from controller_status import EXIT_PORT_LOCKED, HEARTBEAT_TIMEOUT, StatusReader
+
+# Seconds between checks of the controller.
+POLL_INTERVAL: float = 0.1
+# Seconds without a heartbeat before a running controller is considered hung. Less than the
+# HEARTBEAT_TIMEOUT after which the status record stops calling it alive by the two checks it
+# can take to see the last heartbeat and then the hang, so a hung controller is restarted
+# within HEARTBEAT_TIMEOUT (a second).
+HANG_TIMEOUT: float = HEARTBEAT_TIMEOUT - 2 * POLL_INTERVAL
+# Seconds a new controller has to report its pid (it opens the port and loads its profile first).
+START_TIMEOUT: float = 30.0
+# A controller that fails within MIN_UPTIME seconds of starting again is restarted after a delay
+# that doubles with each such failure, up to MAX_RESTART_DELAY seconds.
+MIN_UPTIME: float = 10.0
+MAX_RESTART_DELAY: float = 60.0
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+def controller_cmdline(pid: int) -> str:
+    """Returns the command line of process pid, "" if it isn't running (or isn't visible)."""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as infile:
+            return infile.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return ""
+
+
+class ControllerSupervisor:
+    """Starts, stops and restarts the Light Controller.
+
+    Attributes:
+        restarts (int): Times the controller has been restarted since the web app started.
+    """
+
+    def __init__(
+        self,
+        start: Callable[[bool], subprocess.Popen],
+        reader: Optional[StatusReader] = None,
+        hang_timeout: float = HANG_TIMEOUT,
+        start_timeout: float = START_TIMEOUT,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        """Initializes the ControllerSupervisor class.
+
+        Arguments:
+            start (Callable): Starts a controller process, resuming the run if passed True.
+            reader (StatusReader): Reads the controller's status record.
+            hang_timeout (float): Seconds without a heartbeat before a controller is restarted.
+            start_timeout (float): Seconds a new controller has to report its pid.
+            poll_interval (float): Seconds between checks of the controller.
+        """
+        self.restarts = 0
+        self._start = start
+        self._reader = StatusReader() if reader is None else reader
+        self.hang_timeout = hang_timeout
+        self.start_timeout = start_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._process: Optional[subprocess.Popen] = None
+        self._thread: Optional[threading.Thread] = None
+        # When the process was started and last beat (monotonic), 0 until it reports its pid.
+        self._started_at = 0.0
+        self._beat_at = 0.0
+        self._sequence = 0
+        # Failures in a row within MIN_UPTIME, and when to restart the controller (0 if not).
+        self._quick_failures = 0
+        self._restart_at = 0.0
+
+    @property
+    def pid(self) -> Optional[int]:
+        """The supervised controller's pid, None if there isn't one running."""
+        process = self._process
+        return process.pid if process and process.poll() is None else None
+
+    def start(self, resume: bool = False) -> subprocess.Popen:
+        """Stops any supervised controller and starts (and supervises) a new one."""
+        with self._lock:
+            self._stop()
+            self._quick_failures = 0
+            self._restart_at = 0.0
+            self._spawn(resume)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._watch, name="supervisor", daemon=True)
+                self._thread.start()
+            return self._process
+
+    def stop(self) -> None:
+        """Stops the supervised controller, it isn't restarted."""
+        with self._lock:
+            self._stop()
+            self._quick_failures = 0
+            self._restart_at = 0.0
+
+    def resume(self, pid: Optional[int]) -> subprocess.Popen:
+        """Takes over a run whose controller was started by a previous web app.
+
+        The previous controller (if pid is still a running control_lights.py) can't be watched
+        by this process, so it's stopped and a supervised one resumes its run.
+        """
+        if pid and "control_lights.py" in controller_cmdline(pid):
+            logger.info("Stopping the previous web app's Light Controller, pid %s", pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+                deadline = time.monotonic() + 2
+                while controller_cmdline(pid) and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                if controller_cmdline(pid):
+                    os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        return self.start(resume=True)
+
+    def _spawn(self, resume: bool) -> None:
+        """Starts a controller process, the lock must be held."""
+        self._process = self._start(resume)
+        self._started_at = time.monotonic()
+        self._beat_at = 0.0
+        self._reader.read()
+        self._sequence = self._reader.sequence
+        logger.info(
+            "Light Controller %s as pid %s", "resumed" if resume else "started", self._process.pid
+        )
+
+    def _stop(self) -> None:
+        """Kills the supervised controller, the lock must be held."""
+        process, self._process = self._process, None
+        if process and process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def _fail(self, reason: str) -> None:
+        """Kills the failed controller and restarts it (after any backoff), the lock must be held."""
+        now = time.monotonic()
+        if now - self._started_at < MIN_UPTIME:
+            self._quick_failures += 1
+        else:
+            self._quick_failures = 0
+        delay = (
+            min(2.0 ** (self._quick_failures - 2), MAX_RESTART_DELAY)
+            if self._quick_failures > 1
+            else 0.0
+        )
+        logger.error(
+            "Light Controller pid %s %s, restarting it%s",
+            self._process.pid,
+            reason,
+            f" in {delay:.0f} s" if delay else "",
+        )
+        self._stop()
+        self._restart_at = now + delay
+        if not delay:
+            self._check()
+
+    def _check(self) -> None:
+        """Restarts the controller if it failed or hung, the lock must be held."""
+        now = time.monotonic()
+        if self._restart_at:
+            if now >= self._restart_at:
+                self._restart_at = 0.0
+                self.restarts += 1
+                self._spawn(resume=True)
+            return
+        process = self._process
+        if process is None:
+            return
+        code = process.poll()
+        if code == 0:
+            logger.info("Light Controller pid %s finished its run", process.pid)
+            self._process = None
+        elif code == EXIT_PORT_LOCKED:
+            logger.error(
+                "Light Controller pid %s exited, another controller is driving the lights",
+                process.pid,
+            )
+            self._process = None
+        elif code is not None:
+            self._fail(f"exited with status {code}")
+        else:
+            status = self._reader.read()
+            if self._reader.sequence != self._sequence:
+                self._sequence = self._reader.sequence
+                if status and status.pid == process.pid:
+                    self._beat_at = now
+            if not self._beat_at:
+                if now - self._started_at > self.start_timeout:
+                    self._fail(f"didn't report its pid within {self.start_timeout:.0f} s")
+            elif now - self._beat_at > self.hang_timeout:
+                self._fail(f"missed its heartbeat for {now - self._beat_at:.1f} s")
+
+    def _watch(self) -> None:
+        """Checks the controller every poll_interval until the process exits."""
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                try:
+                    self._check()
+                except Exception:
+                    logger.exception("Supervising the Light Controller failed")
@@ -0,0 +1,176 @@
+"""A log of when each of a run's intensity changes was due and when it was sent to the lights.
+
+The Light Controller times its run on a RunClock (see clock.py). For every transition it slept
+until, it appends the time the change was due, the time it was sent and how far the wall clock
+had moved from the controller's monotonic clock to {TIMING_FOLDER}/timing_<run start>.bin. A run's log outlives its
+config and a restarted controller appends to its run's log, so the timing of any run, e.g. an
+experiment's, can be shown afterwards by timing_summary: how late its transitions were (p50,
+p99 and max) and whether the wall clock jumped during it. A summary is kept up to date by
+reading only the records appended since it was last asked for, and the percentiles are
+estimated from a histogram of bounded size, so /metrics can ask for the live run's summary on
+every scrape however long the run is.
+
+Only the standard library is used so the Light Controller stays light.
+"""
+import logging
+import math
+import os
+import struct
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from typing import Optional
+
+from clock import WALL_JUMP_TOLERANCE
+
+TIMING_FOLDER: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/timing")
+
+# Due and sent (seconds since the epoch, on the run clock), and the wall clock's offset from the
+# controller's monotonic clock (seconds, see RunClock.wall_offset).
+_RECORD = struct.Struct("<ddf")
+RECORD_SIZE: int = _RECORD.size
+# Upper bounds (seconds) of the lateness histogram's buckets, a quarter octave apart from 0.1 ms
+# to about 20 minutes, so an estimated percentile is within 19% of the true one.
+LATENESS_BUCKETS: tuple = tuple(1e-4 * 2 ** (step / 4) for step in range(94))
+# Running summaries by path, brought up to date with the records appended since.
+_SUMMARIES: dict = {}
+_SUMMARIES_LOCK = threading.Lock()
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+def timing_path(started: datetime, folder: str = TIMING_FOLDER) -> str:
+    """Returns the path of the timing log of the run started at started."""
+    return os.path.join(folder, f"timing_{started.strftime('%Y%m%dT%H%M%S%f')}.bin")
+
+
+class TransitionLog:
+    """Appends a run's transitions to its timing log. There must only be one writer.
+
+    Attributes:
+        path (str): The run's timing log.
+    """
+
+    __slots__ = ("path", "_file")
+
+    def __init__(self, started: datetime, folder: str = TIMING_FOLDER):
+        """Initializes the TransitionLog class, appending to the log of the run started at started."""
+        os.makedirs(folder, exist_ok=True)
+        self.path = timing_path(started, folder)
+        # Unbuffered, so every record is a single write that survives the process dying.
+        self._file = open(self.path, "ab", buffering=0)
+        size = self._file.tell()
+        if size % RECORD_SIZE:
+            # Drop a record that was only partly written (e.g. power loss).
+            self._file.truncate(size - size % RECORD_SIZE)
+
+    def append(self, due: datetime, sent: datetime, wall_offset: float = 0.0) -> None:
+        """Appends a transition that was due at due and sent at sent (run clock times)."""
+        self._file.write(_RECORD.pack(due.timestamp(), sent.timestamp(), wall_offset))
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class _RunningSummary:
+    """A timing log's summary, brought up to date by reading the records appended since."""
+
+    __slots__ = (
+        "read_to", "counts", "total", "max", "jumps", "last_offset", "max_offset", "lock"
+    )
+
+    def __init__(self):
+        """Initializes the _RunningSummary class, summarizing no transitions."""
+        # Bytes of the log read so far, always a whole number of records.
+        self.read_to = 0
+        # Transitions by lateness bucket, and above the last bucket.
+        self.counts = [0] * (len(LATENESS_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = None
+        self.jumps = 0
+        self.last_offset = 0.0
+        self.max_offset = 0.0
+        self.lock = threading.Lock()
+
+    def update(self, path: str, size: int, tolerance: float) -> None:
+        """Adds the records written to path since it was last read."""
+        end = size - size % RECORD_SIZE
+        if end <= self.read_to:
+            return
+        with open(path, "rb") as infile:
+            infile.seek(self.read_to)
+            data = infile.read(end - self.read_to)
+        self.read_to += len(data)
+        for due, sent, offset in _RECORD.iter_unpack(data):
+            lateness = sent - due
+            self.counts[bisect_left(LATENESS_BUCKETS, lateness)] += 1
+            self.total += lateness
+            if self.max is None or lateness > self.max:
+                self.max = lateness
+            if abs(offset - self.last_offset) >= tolerance:
+                self.jumps += 1
+            self.last_offset = offset
+            self.max_offset = max(self.max_offset, abs(offset))
+
+    def percentile(self, fraction: float, transitions: int) -> float:
+        """Returns the upper bound of the bucket holding the nearest rank percentile, at most
+        the largest lateness."""
+        rank = max(math.ceil(fraction * transitions), 1)
+        cumulative = 0
+        for bound, count in zip(LATENESS_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        transitions = sum(self.counts)
+        return {
+            "transitions": transitions,
+            "p50": self.percentile(0.5, transitions) if transitions else None,
+            "p99": self.percentile(0.99, transitions) if transitions else None,
+            "max": self.max,
+            "mean": self.total / transitions if transitions else None,
+            "wall_jumps": self.jumps,
+            "max_wall_offset": self.max_offset,
+        }
+
+
+def timing_summary(
+    started: datetime,
+    folder: str = TIMING_FOLDER,
+    tolerance: float = WALL_JUMP_TOLERANCE,
+) -> Optional[dict]:
+    """Returns how late the transitions of the run started at started were sent.
+
+    Only the records appended since the run's summary was last asked for are read.
+
+    Arguments:
+        started (datetime): The start of the run.
+        folder (str): Folder the timing logs are kept in.
+        tolerance (float): Seconds the wall clock's offset must change by between transitions
+            to count as a jump.
+
+    Returns (dict):
+        The number of transitions and the p50, p99, max and mean seconds they were sent after
+        they were due (p50 and p99 are estimated from LATENESS_BUCKETS), the wall clock jumps
+        (a controller restarted after a jump measures the offset from its own start, which
+        counts as another) and the largest offset of the wall clock from the controller's
+        monotonic clock. None if the run has no timing log.
+    """
+    path = timing_path(started, folder)
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+    with _SUMMARIES_LOCK:
+        running = _SUMMARIES.get(path)
+        if running is None or size < running.read_to:
+            # A log that shrank was replaced, it's summarized afresh.
+            running = _SUMMARIES[path] = _RunningSummary()
+    with running.lock:
+        running.update(path, size, tolerance)
+        return running.summary()
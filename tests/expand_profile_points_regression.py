@@ -0,0 +1,117 @@
+# Regression check of the vectorized expand_profile_points against the original
+# iterrows() implementation, on the sample profiles and on synthetic profiles.
+# Run from the repo root: `python tests/expand_profile_points_regression.py`
+
+import os
+import sys
+import time
+from datetime import timedelta
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "rpi"))
+from climate_web_utilities import expand_profile_points, times_to_timedeltas
+
+
+def _append(df, row):
+    # DataFrame._append was removed in pandas 3.
+    if hasattr(df, "_append"):
+        return df._append(row)
+    return pd.concat([df, row.to_frame().T])
+
+
+def legacy_expand_profile_points(df):
+    """The original (quadratic) implementation of expand_profile_points."""
+    df2 = pd.DataFrame(columns=df.columns)
+    idx2 = 0
+    zero = pd.Timedelta(seconds=0)
+    time_col = df.columns[0]
+    intensity_col = df.columns[1]
+    for idx, row in df.iterrows():
+        duration = row[time_col]
+        if idx == 0:
+            if duration == zero:
+                df2.loc[0] = [timedelta(0), 0]
+                row.name = 0
+                last_row = row
+            else:
+                first_row = row.copy()
+                first_row.name = 0
+                first_row[time_col] = zero
+                first_row[intensity_col] = 0
+                df2 = _append(df2, first_row)
+                last_row = first_row
+            idx2 += 1
+        if duration == zero or row[intensity_col] == last_row[intensity_col]:
+            if idx < len(df) - 1:
+                continue
+        new_row = last_row.copy()
+        new_row[time_col] = row[time_col]
+        new_row.name = idx2
+        df2 = _append(df2, new_row)
+        idx2 += 1
+        row.name = idx2
+        df2 = _append(df2, row)
+        last_row = row.copy()
+        idx2 += 1
+    return df2
+
+
+def assert_same(expected, actual, label):
+    assert list(expected.columns) == list(actual.columns), label
+    assert len(expected) == len(actual), f"{label}: {len(expected)} != {len(actual)} rows"
+    assert (
+        pd.to_timedelta(expected.iloc[:, 0]).to_numpy()
+        == pd.to_timedelta(actual.iloc[:, 0]).to_numpy()
+    ).all(), f"{label}: times differ"
+    assert np.allclose(
+        expected.iloc[:, 1].to_numpy(dtype=float), actual.iloc[:, 1].to_numpy(dtype=float)
+    ), f"{label}: intensities differ"
+    print(f"ok   {label} ({len(actual)} rows)")
+
+
+def synthetic_profile(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    seconds = np.cumsum(rng.integers(0, 3, rows))  # Includes repeated (zero step) times.
+    seconds[0] = rng.integers(0, 2)  # Start at zero or not.
+    intensities = rng.integers(0, 4, rows)  # Lots of duplicate intensities.
+    return pd.DataFrame(
+        {"time": pd.to_timedelta(seconds, unit="s"), "val": intensities}
+    )
+
+
+# Sample profiles shipped with the repo.
+samples = glob(os.path.join(REPO, "tests", "*.xlsx")) + glob(
+    os.path.join(REPO, "rpi", "default_profiles", "*.xlsx")
+)
+for path in sorted(samples):
+    try:
+        df = times_to_timedeltas(pd.read_excel(path))
+    except ValueError as e:
+        print(f"skip {os.path.relpath(path, REPO)}: {e}")
+        continue
+    assert_same(
+        legacy_expand_profile_points(df.copy()),
+        expand_profile_points(df.copy()),
+        os.path.relpath(path, REPO),
+    )
+
+# Synthetic edge cases: single rows, zero start or not, duplicate and repeated times.
+for rows in (1, 2, 3, 5, 50, 500):
+    for seed in range(20):
+        df = synthetic_profile(rows, seed)
+        assert_same(
+            legacy_expand_profile_points(df.copy()),
+            expand_profile_points(df.copy()),
+            f"synthetic rows={rows} seed={seed}",
+        )
+
+# Scaling of the vectorized implementation.
+for rows in (86_400, 1_000_000, 5_000_000):
+    df = synthetic_profile(rows)
+    start = time.perf_counter()
+    expand_profile_points(df)
+    print(f"{rows:>9,} rows expanded in {time.perf_counter() - start:.3f} s")
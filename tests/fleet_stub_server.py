@@ -0,0 +1,106 @@
+"""Stub Raspberry Pis for testing the fleet view (rpi/fleet.py) without the real devices.
+
+Serves a made up /api/status on consecutive ports, one per device, over kept alive connections:
+
+    python3 tests/fleet_stub_server.py serve 5101 4 --slow 5103
+
+Point the web app at them with a devices.json keyed "127.0.0.1:5101" etc., or run the self
+check, which also stands up a slow and an offline device and prints the fleet's status three
+times (the second from the cache):
+
+    python3 tests/fleet_stub_server.py check
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../rpi"))
+
+# Seconds a slow device takes to answer, longer than the fleet's timeout.
+SLOW_SECONDS = 5.0
+
+
+def stub_handler(name: str, delay: float = 0.0):
+    """Returns a request handler that answers /api/status as the device name."""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path != "/api/status":
+                self.send_error(404)
+                return
+            time.sleep(delay)
+            body = json.dumps(
+                {
+                    "name": name,
+                    "profile": f"{name.lower()}_profile.xlsx",
+                    "run_continuously": True,
+                    "started": "2025-01-01T06:00:00",
+                    "cycle_num": random.randint(0, 100),
+                    "last_intensity": random.randint(0, 100),
+                    "last_updated": datetime.now().isoformat(timespec="seconds"),
+                    "controller_alive": True,
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(port: int, name: str, delay: float = 0.0) -> ThreadingHTTPServer:
+    """Starts a stub device on port in a background thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), stub_handler(name, delay))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check() -> None:
+    from fleet import FleetMonitor
+
+    devices = {}
+    for i, port in enumerate(range(5101, 5105)):
+        serve(port, f"Stub{i}", SLOW_SECONDS if i == 3 else 0.0)
+        devices[f"127.0.0.1:{port}"] = {
+            "name": f"Stub{i}", "description": "slow" if i == 3 else "stub", "location": "here"
+        }
+    # Nothing listens on this port.
+    devices["127.0.0.1:5199"] = {"name": "Offline", "description": "offline", "location": "nowhere"}
+    fleet = FleetMonitor(devices, timeout=0.5, ttl=2.0)
+    for attempt in range(3):
+        started = time.perf_counter()
+        statuses = fleet.statuses()
+        print(f"fleet status in {(time.perf_counter() - started) * 1000:.0f} ms")
+        for status in statuses:
+            print(
+                f"  {status['name']:8} online={status['online']!s:5} "
+                f"intensity={status.get('last_intensity')!s:4} latency={status['latency_ms']} "
+                f"{status.get('error', '')}"
+            )
+        # The 2nd is answered from the cache, the 3rd reuses the kept alive connections.
+        time.sleep(fleet.ttl if attempt == 1 else 0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        first, count = int(sys.argv[2]), int(sys.argv[3])
+        slow = int(sys.argv[5]) if "--slow" in sys.argv else None
+        for port in range(first, first + count):
+            serve(port, f"Stub{port - first}", SLOW_SECONDS if port == slow else 0.0)
+        print(f"Serving {count} stub devices on ports {first}-{first + count - 1}")
+        threading.Event().wait()
+    else:
+        check()
@@ -0,0 +1,109 @@
+# Regression check that a profile that doesn't loop finishes, rather than crashing, when its
+# controller wakes after the end of the cycle (an oversleep, SIGSTOP or a slow serial write).
+# Run from the repo root: `python tests/late_wakeup_regression.py`
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "rpi"))
+import multi_controller
+from clock import VirtualClock
+from control_lights import control_lights
+from controller_status import StatusWriter
+from light_utilities import SimulatedArduino
+from profile_format import ProfileArrays, load_arrays
+from run_history import RunHistory
+from transition_timing import TransitionLog
+
+PROFILE = os.path.join(REPO, "tests", "demo_45secgradient_5mins.xlsx")
+
+
+class OversleepingClock(VirtualClock):
+    """A VirtualClock whose oversleep_at'th sleep sleeps an extra hour."""
+
+    __slots__ = ("sleeps", "oversleep_at")
+
+    def __init__(self, start, oversleep_at):
+        super().__init__(start)
+        self.sleeps = 0
+        self.oversleep_at = oversleep_at
+
+    def sleep(self, seconds):
+        self.sleeps += 1
+        if self.sleeps == self.oversleep_at:
+            seconds += 3600
+        super().sleep(seconds)
+
+
+def check_control_lights(oversleep_at):
+    start = datetime(2025, 1, 1, 6)
+    config = {
+        "_started": start,
+        "_profile_filepath": PROFILE,
+        "run_continuously": False,
+        "last_intensity": 0,
+        "pid": None,
+    }
+    clock = OversleepingClock(start, oversleep_at)
+    arduino = SimulatedArduino(clock)
+    with tempfile.TemporaryDirectory() as folder:
+        control_lights(
+            config,
+            clock,
+            arduino,
+            StatusWriter(os.path.join(folder, "status.bin")),
+            RunHistory(os.path.join(folder, "history")),
+            checkpoint=False,
+            flash=False,
+            timing=TransitionLog(start, os.path.join(folder, "timing")),
+        )
+    final = load_arrays(PROFILE).intensities[-1]
+    assert config["pid"] is None, "the run didn't finish"
+    assert arduino.trace[-1][2] == final, (arduino.trace[-1], final)
+
+
+class SlowPort:
+    """Stands in for an ArduinoPort whose first write takes longer than the whole profile."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.sent = []
+
+    async def send(self, intensity, channel):
+        if not self.sent:
+            # Blocks the event loop, as a hung serial write would.
+            time.sleep(self.seconds)
+        self.sent.append(intensity)
+
+
+def check_channel():
+    profile = ProfileArrays(
+        "0" * 16,
+        array("d", [0.0, 0.5, 1.0]),
+        array("d", [10.0, 20.0, 0.0]),
+        array("d", [0.0, 0.0, 0.0]),
+    )
+    port = SlowPort(1.5)
+    with tempfile.TemporaryDirectory() as folder:
+        multi_controller.STATUS_FOLDER = folder
+        multi_controller.HISTORY_FOLDER = folder
+        channel = multi_controller.Channel("late", port, 0, profile, datetime.now(), False)
+        try:
+            asyncio.run(channel.run())
+        finally:
+            channel.close()
+    assert port.sent == [10.0, 0.0], port.sent
+
+
+if __name__ == "__main__":
+    # Oversleep on the first few transitions, and on one well into the profile.
+    for oversleep_at in (1, 2, 3, 50):
+        check_control_lights(oversleep_at)
+    check_channel()
+    print("OK")
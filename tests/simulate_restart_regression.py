@@ -0,0 +1,40 @@
+# Regression check that a simulated restart resumes the run as the supervisor's --resume does:
+# the lights are flashed when the run starts, never when the controller is restarted.
+# Run from the repo root: `python tests/simulate_restart_regression.py`
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "rpi"))
+from profile_format import ProfileSchedule, load_arrays
+from simulate import run_simulation
+
+PROFILE = os.path.join(REPO, "tests", "demo_45secgradient_5mins.xlsx")
+# Commands sent by flash_lights_thrice when the run starts.
+FLASHES = 6
+
+
+def flash_pairs(trace):
+    """Returns the times of 100 then 0 sent half a second apart, a flash."""
+    return [
+        first[0]
+        for first, second in zip(trace, trace[1:])
+        if (first[2], second[2]) == (100, 0)
+        and second[0] - first[0] == timedelta(seconds=0.5)
+    ]
+
+
+if __name__ == "__main__":
+    start = datetime(2025, 1, 1, 6)
+    trace = run_simulation(
+        PROFILE, start, timedelta(minutes=12), restarts=[timedelta(minutes=2, seconds=30),
+                                                         timedelta(minutes=7)],
+    )
+    flashes = flash_pairs(trace)
+    assert len(flashes) == 3 and flashes[-1] < start + timedelta(seconds=3), flashes
+    schedule = ProfileSchedule(load_arrays(PROFILE), start, True)
+    for sent, _, intensity in trace[FLASHES:]:
+        assert schedule.intensity_at(sent) == intensity, (sent, intensity)
+    print("OK")
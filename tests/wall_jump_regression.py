@@ -0,0 +1,45 @@
+# Regression check that the Light Controller follows a jump of the wall clock, so it agrees with
+# the web app's schedule (which uses the wall clock) on the row in effect. The jump happens before
+# the run starts, as on a Pi without a real-time clock whose controller starts before NTP syncs,
+# and during the run.
+# Run from the repo root: `python tests/wall_jump_regression.py`
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "rpi"))
+from profile_format import ProfileSchedule, load_arrays
+from simulate import run_simulation
+
+PROFILE = os.path.join(REPO, "tests", "demo_45secgradient_5mins.xlsx")
+# Commands sent by flash_lights_thrice before the run starts.
+FLASHES = 6
+
+
+def check_follows_wall(start, wall_jumps, offset):
+    """Runs the profile and checks every command is the schedule's intensity at the wall time.
+
+    The run's clock starts offset seconds off the wall clock the run was started on.
+    """
+    started = start + timedelta(seconds=offset)
+    # The simulation stops by the wall clock, which is corrected by offset.
+    trace = run_simulation(
+        PROFILE, start, timedelta(minutes=12, seconds=offset), run_continuously=True,
+        wall_jumps=wall_jumps, started=started,
+    )
+    schedule = ProfileSchedule(load_arrays(PROFILE), started, True)
+    commands = trace[FLASHES:]
+    assert commands, "the run sent nothing"
+    for sent, _, intensity in commands:
+        assert schedule.intensity_at(sent) == intensity, (sent, intensity)
+
+
+if __name__ == "__main__":
+    start = datetime(2025, 1, 1, 6)
+    # The Pi booted an hour behind and NTP corrects it during the flashes.
+    check_follows_wall(start, [(timedelta(seconds=1.2), 3600.0)], 3600.0)
+    # The wall clock is set back 2 minutes, then forward 2 minutes, during the run.
+    check_follows_wall(start, [(timedelta(minutes=2), -120.0), (timedelta(minutes=5), 120.0)], 0.0)
+    print("OK")
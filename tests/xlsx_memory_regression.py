@@ -0,0 +1,52 @@
+# Regression check that reading an .xlsx profile takes the same memory whatever its number of
+# rows: the sheet is streamed and each row dropped once read (see profile_cache.xlsx_rows).
+# Run from the repo root: `python tests/xlsx_memory_regression.py`
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "rpi"))
+import openpyxl
+from profile_cache import xlsx_rows
+
+START = datetime(2025, 1, 1)
+
+
+def write_profile(path, rows):
+    """Writes a profile of rows one second apart, its intensity changing every 20 rows."""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["time", "intensity"])
+    for i in range(rows):
+        sheet.append((START + timedelta(seconds=i), i // 20 % 101))
+    workbook.save(path)
+
+
+def peak_mb(path):
+    """Returns the traced peak memory (MB) of reading every row of path."""
+    tracemalloc.start()
+    rows = sum(1 for _ in xlsx_rows(path))
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return rows, peak
+
+
+if __name__ == "__main__":
+    peaks = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in (10_000, 1_000_000):
+            path = os.path.join(folder, f"profile_{size}.xlsx")
+            write_profile(path, size)
+            started = time.perf_counter()
+            rows, peaks[size] = peak_mb(path)
+            assert rows == size + 1, rows
+            print(f"{size:>9,} rows read in {time.perf_counter() - started:.1f} s, "
+                  f"peak {peaks[size]:.2f} MB")
+    # About the same, allowing for the parser's buffers.
+    assert peaks[1_000_000] < 1.5 * peaks[10_000] + 1, peaks
+    print("OK")